@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+'''
+Compares per-query scoring with batched scoring on a frozen index.
+
+Runs a batch of queries through :meth:`MemorySimIndex.query` one at a time,
+and through :meth:`CSRSimIndex.query_many` as a single batch, and reports
+the throughput of each.
+
+Usage::
+
+    bash$ python benchmarks/batch_query.py [num_docs] [num_queries] [k]
+
+'''
+
+from __future__ import(division, absolute_import, print_function,
+                       unicode_literals)
+
+# boilerplate to allow running as script from a source checkout
+if __name__ == "__main__" and __package__ is None:
+    import sys, os
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    del sys, os
+
+import sys
+import time
+
+from corpus import synthetic_docs
+from query_latency import make_queries
+from pysimsearch.sim_index import MemorySimIndex, CSRSimIndex
+
+def main():
+    num_docs = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    num_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    k = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+
+    print("Indexing {} synthetic docs".format(num_docs))
+    index = MemorySimIndex()
+    index.index_string_buffers(synthetic_docs(num_docs, 100))
+    queries = make_queries(num_queries, 5)
+
+    start = time.time()
+    for query in queries:
+        index.query(query, k)
+    per_query = time.time() - start
+
+    start = time.time()
+    frozen_index = CSRSimIndex(index)
+    freeze = time.time() - start
+
+    start = time.time()
+    frozen_index.query_many(queries, k)
+    batched = time.time() - start
+
+    print("freeze: {:.2f}s".format(freeze))
+    print("{:<22} {:>12}".format('method', 'queries/sec'))
+    print("{:<22} {:>12.0f}".format('MemorySimIndex.query', num_queries / per_query))
+    print("{:<22} {:>12.0f}".format('CSRSimIndex.query_many', num_queries / batched))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+'''
+Measures query latency of a :class:`SimIndexCollection` over slow shards.
+
+Each shard is a :class:`MemorySimIndex` that sleeps for a fixed delay per
+query, standing in for the network latency of a remote shard.  Reports mean
+query latency for each of the given ``shard_max_concurrency`` limits;
+with enough concurrency, latency approaches one shard delay plus the
+merge, rather than the sum of the delays.  Finally, one shard is slowed
+down to a second per query, and latency is reported with and without a
+``shard_timeout`` of a few shard delays.
+
+Usage::
+
+    bash$ python benchmarks/collection_fanout.py [num_shards] [delay_ms] [concurrency ...]
+
+'''
+
+from __future__ import(division, absolute_import, print_function,
+                       unicode_literals)
+
+# boilerplate to allow running as script from a source checkout
+if __name__ == "__main__" and __package__ is None:
+    import sys, os
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    del sys, os
+
+import sys
+import time
+
+from corpus import synthetic_docs
+from pysimsearch.sim_index import MemorySimIndex, SimIndexCollection
+
+class DelayedSimIndex(MemorySimIndex):
+    '''MemorySimIndex with a fixed delay per query'''
+    def __init__(self, delay):
+        super(DelayedSimIndex, self).__init__()
+        self.delay = delay
+        
+    def query(self, q, k=None):
+        time.sleep(self.delay)
+        return super(DelayedSimIndex, self).query(q, k)
+
+def main():
+    num_shards = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    delay_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    limits = [int(arg) for arg in sys.argv[3:]] or [1, 4, 20]
+
+    collection = SimIndexCollection(
+        [DelayedSimIndex(delay_ms / 1000) for i in range(num_shards)])
+    collection.set_query_scorer('tfidf')
+    collection.index_string_buffers(synthetic_docs(5000, 100))
+    queries = [text for (name, text) in synthetic_docs(50, 5)]
+    
+    print("{} shards, {}ms per shard".format(num_shards, delay_ms))
+    print("{:>12} {:>12}".format('concurrency', 'latency ms'))
+    for limit in limits:
+        collection.set_config('shard_max_concurrency', limit,
+                              passthrough=False)
+        start = time.time()
+        for query in queries:
+            collection.query(query, 10)
+        elapsed = time.time() - start
+        print("{:>12} {:>12.1f}".format(limit, 1000 * elapsed / len(queries)))
+    
+    print("one shard at 1000ms")
+    collection._shards[0].delay = 1
+    collection.set_config('shard_max_concurrency', num_shards,
+                          passthrough=False)
+    for timeout in (None, 3 * delay_ms / 1000):
+        collection.set_config('shard_timeout', timeout, passthrough=False)
+        start = time.time()
+        for query in queries[:5]:
+            collection.query(query, 10)
+        elapsed = time.time() - start
+        print("{:>12} {:>12.1f}".format(
+            'no timeout' if timeout is None else '{}ms'.format(1000 * timeout),
+            1000 * elapsed / 5))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+'''
+Synthetic corpora shared by the benchmark scripts
+'''
+
+from __future__ import(division, absolute_import, print_function,
+                       unicode_literals)
+
+import random
+
+def synthetic_docs(num_docs, doc_len, vocab_size=50000, seed=0, start=0):
+    '''
+    Returns a list of (name, string) pairs with Zipf-like term frequencies
+
+    Params:
+        num_docs: number of documents to generate
+        doc_len: number of terms per document
+        vocab_size: number of distinct terms to draw from
+        seed: random seed, so that runs are repeatable
+        start: number of the first document (used to name documents)
+    '''
+    rand = random.Random(seed)
+    docs = []
+    for i in range(start, start + num_docs):
+        terms = ['t{}'.format(int(vocab_size ** rand.random()))
+                 for j in range(doc_len)]
+        docs.append(('doc{}'.format(i), ' '.join(terms)))
+    return docs
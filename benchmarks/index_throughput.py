@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+'''
+Measures indexing throughput as the corpus grows.
+
+Indexes a synthetic corpus in fixed-size batches and reports docs/sec for
+each batch.  With an amortized O(1) postings append, throughput should stay
+roughly flat as the index grows, rather than degrading with corpus size.
+
+Usage::
+
+    bash$ python benchmarks/index_throughput.py [num_batches] [batch_size] [shelf_filename] [write_buffer_size]
+
+If ``shelf_filename`` is given, a :class:`ShelfSimIndex` is benchmarked
+instead of a :class:`MemorySimIndex`, with the given ``write_buffer_size``
+(0 flushes postings after every batch).  The final :meth:`commit()` is
+timed separately.
+
+'''
+
+from __future__ import(division, absolute_import, print_function,
+                       unicode_literals)
+
+# boilerplate to allow running as script from a source checkout
+if __name__ == "__main__" and __package__ is None:
+    import sys, os
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    del sys, os
+
+import sys
+import time
+
+from corpus import synthetic_docs
+from pysimsearch.sim_index import MemorySimIndex, ShelfSimIndex
+
+def main():
+    num_batches = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    shelf_filename = sys.argv[3] if len(sys.argv) > 3 else None
+
+    if shelf_filename:
+        index = ShelfSimIndex(shelf_filename, 'n')
+        if len(sys.argv) > 4:
+            index.set_config('write_buffer_size', int(sys.argv[4]))
+    else:
+        index = MemorySimIndex()
+
+    print("{:>10} {:>12}".format('docs', 'docs/sec'))
+    for i in range(num_batches):
+        docs = synthetic_docs(batch_size, 100, seed=i, start=i * batch_size)
+        start = time.time()
+        index.index_string_buffers(docs)
+        elapsed = time.time() - start
+        print("{:>10} {:>12.0f}".format((i + 1) * batch_size,
+                                        batch_size / elapsed))
+
+    if shelf_filename:
+        start = time.time()
+        index.commit()
+        print("commit: {:.2f}s".format(time.time() - start))
+        index.close()
+
+if __name__ == '__main__':
+    main()
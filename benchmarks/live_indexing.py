@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+'''
+Measures indexing throughput and query latency on a live index.
+
+Alternates between indexing a batch of synthetic docs and running a fixed
+set of queries, and reports docs/sec for each batch along with the mean
+query latency after it, for a :class:`MemorySimIndex` and for a
+:class:`SegmentedSimIndex` (with background merges).  Query latency on the
+segmented index is also reported once merges have finished.
+
+Usage::
+
+    bash$ python benchmarks/live_indexing.py [num_batches] [batch_size] [segment_size] [merge_factor]
+
+'''
+
+from __future__ import(division, absolute_import, print_function,
+                       unicode_literals)
+
+# boilerplate to allow running as script from a source checkout
+if __name__ == "__main__" and __package__ is None:
+    import sys, os
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    del sys, os
+
+import sys
+import time
+
+from corpus import synthetic_docs
+from query_latency import make_queries, time_queries
+from pysimsearch.sim_index import MemorySimIndex, SegmentedSimIndex
+
+def run(index, num_batches, batch_size, queries):
+    print("{:>10} {:>12} {:>12}".format('docs', 'docs/sec', 'query (ms)'))
+    for i in range(num_batches):
+        docs = synthetic_docs(batch_size, 100, seed=i, start=i * batch_size)
+        start = time.time()
+        index.index_string_buffers(docs)
+        elapsed = time.time() - start
+        print("{:>10} {:>12.0f} {:>12.2f}".format(
+            (i + 1) * batch_size, batch_size / elapsed,
+            time_queries(index, queries, 10) * 1000))
+
+def main():
+    num_batches = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    segment_size = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+    merge_factor = int(sys.argv[4]) if len(sys.argv) > 4 else 4
+    queries = make_queries(50, 5)
+
+    print("MemorySimIndex")
+    run(MemorySimIndex(), num_batches, batch_size, queries)
+
+    print("SegmentedSimIndex(segment_size={}, merge_factor={})".format(
+        segment_size, merge_factor))
+    index = SegmentedSimIndex(segment_size, merge_factor)
+    run(index, num_batches, batch_size, queries)
+    index.wait_for_merges()
+    print("segments: {}".format(index.segment_stats()['segments']))
+    print("query after merges (ms): {:.2f}".format(
+        time_queries(index, queries, 10) * 1000))
+    index.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+'''
+Measures indexing throughput with parallel tokenization.
+
+Indexes a synthetic corpus into a :class:`MemorySimIndex` with each of the
+given numbers of tokenizer processes (0 tokenizes in-process), and reports
+docs/sec.  The speedup is bounded by the share of indexing time spent on
+tokenization, and by the number of cores.
+
+Usage::
+
+    bash$ python benchmarks/parallel_ingest.py [num_docs] [batch_size] [workers ...]
+
+'''
+
+from __future__ import(division, absolute_import, print_function,
+                       unicode_literals)
+
+# boilerplate to allow running as script from a source checkout
+if __name__ == "__main__" and __package__ is None:
+    import sys, os
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    del sys, os
+
+import multiprocessing
+import sys
+import time
+
+from corpus import synthetic_docs
+from pysimsearch.sim_index import MemorySimIndex
+
+def main():
+    num_docs = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    workers = [int(arg) for arg in sys.argv[3:]] or [0, 2, 4]
+
+    docs = synthetic_docs(num_docs, 100)
+    print("{} cores".format(multiprocessing.cpu_count()))
+    print("{:>8} {:>12}".format('workers', 'docs/sec'))
+    for num_workers in workers:
+        index = MemorySimIndex()
+        index.update_config(ingest_workers=num_workers,
+                            ingest_batch_size=batch_size)
+        start = time.time()
+        index.index_string_buffers(docs)
+        elapsed = time.time() - start
+        print("{:>8} {:>12.0f}".format(num_workers, num_docs / elapsed))
+
+if __name__ == '__main__':
+    main()
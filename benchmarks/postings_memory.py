@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+'''
+Compares the memory footprint of postings list layouts.
+
+Builds a :class:`MemorySimIndex` over a synthetic corpus (terms drawn from
+a Zipf-like distribution), and reports the size of its term index when
+postings are stored as compact :class:`PostingsList` arrays or as
+varint-encoded :class:`CompressedPostingsList` blocks, versus the original
+layout of python lists of (docid, freq) tuples.
+
+Usage::
+
+    bash$ python benchmarks/postings_memory.py [num_docs] [doc_len]
+
+'''
+
+from __future__ import(division, absolute_import, print_function,
+                       unicode_literals)
+
+# boilerplate to allow running as script from a source checkout
+if __name__ == "__main__" and __package__ is None:
+    import sys, os
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    del sys, os
+
+import sys
+
+from corpus import synthetic_docs
+from pysimsearch.sim_index import MemorySimIndex
+from pysimsearch.sim_index.postings import PostingsList, CompressedPostingsList
+
+def tuple_list_size(postings):
+    '''Returns bytes used by a list of (docid, freq) tuples'''
+    size = sys.getsizeof(postings)
+    for posting in postings:
+        size += sys.getsizeof(posting)
+        # small ints are cached by the interpreter, but larger docids are not
+        size += sum(sys.getsizeof(x) for x in posting if x > 256)
+    return size
+
+def postings_list_size(postings):
+    '''Returns bytes used by a :class:`PostingsList`'''
+    return (sys.getsizeof(postings) +
+            sys.getsizeof(postings.docids) +
+            sys.getsizeof(postings.freqs))
+
+def compressed_postings_list_size(postings):
+    '''Returns bytes used by a :class:`CompressedPostingsList`'''
+    return (sys.getsizeof(postings) +
+            sys.getsizeof(postings._data) +
+            sys.getsizeof(postings._block_last) +
+            sys.getsizeof(postings._block_offsets) +
+            postings_list_size(postings._tail))
+
+def main():
+    num_docs = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    doc_len = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    print("Indexing {} synthetic docs of {} terms".format(num_docs, doc_len))
+    index = MemorySimIndex()
+    index.index_string_buffers(synthetic_docs(num_docs, doc_len))
+
+    num_postings = 0
+    compact_bytes = 0
+    compressed_bytes = 0
+    tuple_bytes = 0
+    for postings in index._term_index.itervalues():
+        assert isinstance(postings, PostingsList)
+        num_postings += len(postings)
+        compact_bytes += postings_list_size(postings)
+        compressed_bytes += compressed_postings_list_size(
+            CompressedPostingsList(postings))
+        tuple_bytes += tuple_list_size(list(postings))
+
+    print("terms:    {}".format(len(index._term_index)))
+    print("postings: {}".format(num_postings))
+    print("{:<12} {:>14} {:>16}".format('layout', 'total bytes', 'bytes/posting'))
+    for (layout, size) in (('tuple-list', tuple_bytes),
+                           ('array', compact_bytes),
+                           ('varint', compressed_bytes)):
+        print("{:<12} {:>14} {:>16.1f}".format(layout, size,
+                                               size / num_postings))
+    print("reduction: {:.1f}x (array), {:.1f}x (varint)".format(
+        tuple_bytes / compact_bytes, tuple_bytes / compressed_bytes))
+
+if __name__ == '__main__':
+    main()
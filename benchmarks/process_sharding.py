@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+'''
+Measures query throughput of a :class:`ProcessShardedSimIndex`.
+
+Indexes a synthetic corpus into a single :class:`MemorySimIndex`, and into
+process-sharded indexes with each of the given numbers of shards, then
+reports queries/sec for a batch of synthetic queries issued by several
+client threads.  Scoring runs in the worker processes, so throughput can
+scale with the number of cores, less the cost of pickling results.
+
+Usage::
+
+    bash$ python benchmarks/process_sharding.py [num_docs] [num_queries] [shards ...]
+
+'''
+
+from __future__ import(division, absolute_import, print_function,
+                       unicode_literals)
+
+# boilerplate to allow running as script from a source checkout
+if __name__ == "__main__" and __package__ is None:
+    import sys, os
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    del sys, os
+
+from concurrent import futures
+import multiprocessing
+import sys
+import time
+
+from corpus import synthetic_docs
+from pysimsearch.sim_index import MemorySimIndex, ProcessShardedSimIndex
+
+CLIENT_THREADS = 8
+
+def queries_per_sec(index, queries):
+    with futures.ThreadPoolExecutor(max_workers=CLIENT_THREADS) as executor:
+        start = time.time()
+        for hits in executor.map(lambda q: list(index.query(q, 10)), queries):
+            pass
+        elapsed = time.time() - start
+    return len(queries) / elapsed
+
+def main():
+    num_docs = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    num_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    shards = [int(arg) for arg in sys.argv[3:]] or [1, 2, 4]
+
+    docs = synthetic_docs(num_docs, 100)
+    queries = [text for (name, text) in synthetic_docs(num_queries, 5)]
+    print("{} cores".format(multiprocessing.cpu_count()))
+    print("{:>8} {:>12}".format('shards', 'queries/sec'))
+    
+    index = MemorySimIndex()
+    index.set_query_scorer('tfidf')
+    index.index_string_buffers(docs)
+    print("{:>8} {:>12.1f}".format('local', queries_per_sec(index, queries)))
+    
+    for num_shards in shards:
+        index = ProcessShardedSimIndex(num_shards)
+        try:
+            index.set_query_scorer('tfidf')
+            index.index_string_buffers(docs)
+            print("{:>8} {:>12.1f}".format(num_shards,
+                                           queries_per_sec(index, queries)))
+        finally:
+            index.close()
+
+if __name__ == '__main__':
+    main()
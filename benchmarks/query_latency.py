@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+'''
+Measures query latency over a synthetic corpus.
+
+Runs a fixed set of queries against a :class:`MemorySimIndex` with each of
+the given scorers, and reports the mean latency for exhaustive scoring
+(``k=None``) and for top-k scoring.
+
+Usage::
+
+    bash$ python benchmarks/query_latency.py [num_docs] [k] [scorer ...]
+
+'''
+
+from __future__ import(division, absolute_import, print_function,
+                       unicode_literals)
+
+# boilerplate to allow running as script from a source checkout
+if __name__ == "__main__" and __package__ is None:
+    import sys, os
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    del sys, os
+
+import random
+import sys
+import time
+
+from corpus import synthetic_docs
+from pysimsearch.sim_index import MemorySimIndex
+
+def make_queries(num_queries, query_len, vocab_size=1000, seed=1):
+    '''Returns queries drawn from the more frequent terms of the corpus'''
+    rand = random.Random(seed)
+    return [' '.join('t{}'.format(int(vocab_size ** rand.random()))
+                     for j in range(query_len))
+            for i in range(num_queries)]
+
+def time_queries(index, queries, k):
+    '''Returns mean seconds per query'''
+    start = time.time()
+    for query in queries:
+        list(index.query(query, k))
+    return (time.time() - start) / len(queries)
+
+def main():
+    num_docs = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    k = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    scorers = sys.argv[3:] or ['simple_count', 'tfidf']
+
+    print("Indexing {} synthetic docs".format(num_docs))
+    index = MemorySimIndex()
+    index.index_string_buffers(synthetic_docs(num_docs, 100))
+    queries = make_queries(50, 5)
+
+    print("{:<14} {:>14} {:>14}".format('scorer', 'k=None (ms)',
+                                        'k={} (ms)'.format(k)))
+    for scorer in scorers:
+        index.set_query_scorer(scorer)
+        print("{:<14} {:>14.2f} {:>14.2f}".format(
+            scorer,
+            time_queries(index, queries, None) * 1000,
+            time_queries(index, queries, k) * 1000))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+'''
+Measures external-memory segment builds.
+
+Streams a synthetic corpus through a :class:`SegmentBuilder` in batches,
+reporting docs/sec and peak memory (max RSS) for each batch, followed by
+the time taken by the final merge.  With a fixed ``memory_budget``, both
+throughput and peak memory should stay flat as the corpus grows.
+
+Usage::
+
+    bash$ python benchmarks/segment_build.py [num_batches] [batch_size] [memory_budget_mb] [segment_filename]
+
+'''
+
+from __future__ import(division, absolute_import, print_function,
+                       unicode_literals)
+
+# boilerplate to allow running as script from a source checkout
+if __name__ == "__main__" and __package__ is None:
+    import sys, os
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    del sys, os
+
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from corpus import synthetic_docs
+from pysimsearch.sim_index import SegmentSimIndex
+from pysimsearch.sim_index.segment_builder import SegmentBuilder
+
+def max_rss_mb():
+    '''Returns peak resident set size of this process, in MB (on linux)'''
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def main():
+    num_batches = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    memory_budget = int(sys.argv[3]) if len(sys.argv) > 3 else 32
+    segment_filename = sys.argv[4] if len(sys.argv) > 4 else None
+
+    if segment_filename:
+        segment_file = open(segment_filename, 'w+b')
+    else:
+        segment_file = tempfile.TemporaryFile()
+    builder = SegmentBuilder(segment_file, memory_budget=memory_budget * 2**20)
+
+    print("{:>10} {:>12} {:>8} {:>14}".format('docs', 'docs/sec', 'runs',
+                                              'max rss (MB)'))
+    for i in range(num_batches):
+        docs = synthetic_docs(batch_size, 100, seed=i, start=i * batch_size)
+        start = time.time()
+        builder.index_string_buffers(docs)
+        elapsed = time.time() - start
+        print("{:>10} {:>12.0f} {:>8} {:>14.0f}".format(
+            (i + 1) * batch_size, batch_size / elapsed, builder.num_runs,
+            max_rss_mb()))
+
+    start = time.time()
+    builder.finish()
+    print("merge: {:.2f}s, {:.0f} MB segment, max rss {:.0f} MB".format(
+        time.time() - start, segment_file.tell() / 2**20, max_rss_mb()))
+
+    sim_index = SegmentSimIndex(segment_file)
+    print("docs in segment: {}".format(sim_index.get_local_N()))
+    sim_index.close()
+    segment_file.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+'''
+Compares startup cost of pickle snapshots and memory-mapped segments.
+
+Saves a :class:`MemorySimIndex` built over a synthetic corpus both with
+``MemorySimIndex.save()`` and as a segment, then reports file sizes, the
+time to load each back, and the mean top-k query latency of each.
+
+Usage::
+
+    bash$ python benchmarks/segment_load.py [num_docs] [k]
+
+'''
+
+from __future__ import(division, absolute_import, print_function,
+                       unicode_literals)
+
+# boilerplate to allow running as script from a source checkout
+if __name__ == "__main__" and __package__ is None:
+    import sys, os
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    del sys, os
+
+import os
+import sys
+import tempfile
+import time
+
+from corpus import synthetic_docs
+from query_latency import make_queries, time_queries
+from pysimsearch.sim_index import MemorySimIndex, SegmentSimIndex
+from pysimsearch.sim_index.segment import write_segment
+
+def main():
+    num_docs = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    k = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    print("Indexing {} synthetic docs".format(num_docs))
+    index = MemorySimIndex()
+    index.index_string_buffers(synthetic_docs(num_docs, 100))
+    queries = make_queries(50, 5)
+
+    tmpdir = tempfile.mkdtemp()
+    pickle_filename = os.path.join(tmpdir, 'index.pickle')
+    segment_filename = os.path.join(tmpdir, 'index.seg')
+    with open(pickle_filename, 'wb') as file:
+        index.save(file)
+    with open(segment_filename, 'wb') as file:
+        write_segment(index, file)
+
+    start = time.time()
+    with open(pickle_filename, 'rb') as file:
+        pickled_index = MemorySimIndex.load(file)
+    pickle_load = time.time() - start
+    pickled_index.set_query_scorer('tfidf')
+
+    start = time.time()
+    segment_index = SegmentSimIndex(segment_filename)
+    segment_load = time.time() - start
+
+    print("{:<10} {:>12} {:>12} {:>12}".format('format', 'MB', 'load (ms)',
+                                               'query (ms)'))
+    for (name, filename, load_time, loaded) in (
+            ('pickle', pickle_filename, pickle_load, pickled_index),
+            ('segment', segment_filename, segment_load, segment_index)):
+        print("{:<10} {:>12.1f} {:>12.2f} {:>12.2f}".format(
+            name, os.path.getsize(filename) / 2**20, load_time * 1000,
+            time_queries(loaded, queries, k) * 1000))
+
+    segment_index.close()
+    os.remove(pickle_filename)
+    os.remove(segment_filename)
+    os.rmdir(tmpdir)
+
+if __name__ == '__main__':
+    main()
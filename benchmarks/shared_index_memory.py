@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+'''
+Measures the private memory of forked query workers.
+
+Builds a :class:`MemorySimIndex` over a synthetic corpus, forks query
+workers (:class:`ProcessSimIndex`) that serve either the index itself or a
+frozen :class:`SegmentSimIndex` copy of it, runs queries through each
+worker, and then reports the memory each worker no longer shares with its
+parent (private dirty pages, from ``/proc/<pid>/smaps``, so Linux only).
+
+Usage::
+
+    bash$ python benchmarks/shared_index_memory.py [num_docs] [num_workers]
+
+'''
+
+from __future__ import(division, absolute_import, print_function,
+                       unicode_literals)
+
+# boilerplate to allow running as script from a source checkout
+if __name__ == "__main__" and __package__ is None:
+    import sys, os
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    del sys, os
+
+import gc
+import sys
+
+from corpus import synthetic_docs
+from pysimsearch.sim_index import (MemorySimIndex, SegmentSimIndex,
+                                   ProcessSimIndex)
+
+def private_dirty_bytes(pid):
+    '''Returns bytes of private dirty pages of process ``pid``'''
+    total = 0
+    with open('/proc/{}/smaps'.format(pid)) as smaps:
+        for line in smaps:
+            if line.startswith('Private_Dirty:'):
+                total += int(line.split()[1]) * 1024
+    return total
+
+def worker_memory(index, num_workers, queries):
+    '''Returns mean private dirty bytes of workers serving ``index``'''
+    workers = [ProcessSimIndex(factory=lambda: index)
+               for i in range(num_workers)]
+    try:
+        for worker in workers:
+            for query in queries:
+                worker.query(query, 10)
+        return (sum(private_dirty_bytes(worker._process.pid)
+                    for worker in workers) / num_workers)
+    finally:
+        for worker in workers:
+            worker.close()
+
+def main():
+    num_docs = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    num_workers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    index = MemorySimIndex()
+    index.set_query_scorer('tfidf')
+    index.index_string_buffers(synthetic_docs(num_docs, 100))
+    queries = [text for (name, text) in synthetic_docs(200, 5)]
+    frozen_index = SegmentSimIndex.freeze(index)
+
+    print("{} docs, {} workers".format(num_docs, num_workers))
+    print("{:<8} {:>22}".format('index', 'private MB/worker'))
+    print("{:<8} {:>22.1f}".format(
+        'memory', worker_memory(index, num_workers, queries) / 2**20))
+    # the parent no longer needs the original once it's frozen
+    del index
+    gc.collect()
+    print("{:<8} {:>22.1f}".format(
+        'frozen', worker_memory(frozen_index, num_workers, queries) / 2**20))
+
+if __name__ == '__main__':
+    main()
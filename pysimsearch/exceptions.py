@@ -37,3 +37,7 @@ class Error(Exception):
 class FileFormatException(Error):
     '''Exception for invalid input file'''
     pass
+
+class ReadOnlyIndexException(Error):
+    '''Exception for attempts to modify a read-only index'''
+    pass
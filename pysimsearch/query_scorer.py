@@ -34,10 +34,17 @@ from __future__ import (division, absolute_import, print_function,
         unicode_literals)
 
 import abc
+from bisect import bisect_left
 from collections import defaultdict
+import heapq
 import operator
 from math import log
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 class QueryScorer(object):
     '''
     Interface for query scorers which score similarity search results
@@ -60,8 +67,37 @@ class QueryScorer(object):
     def register_scorers(scorer_map):
         QueryScorer._scorers.update(scorer_map)
         
+    @staticmethod
+    def hit_order(hit):
+        '''
+        Sort key for (docid, score) tuples: by descending score, with ties
+        broken by lower docid.  All scorers order their results this way.
+        '''
+        (docid, score) = hit
+        return (-score, docid)
+    
+    @staticmethod
+    def top_hits(doc_hit_map, k=None):
+        '''
+        Returns (docid, score) tuples from doc_hit_map sorted by
+        :meth:`hit_order()`.  If ``k`` is given, only the top ``k`` are
+        returned, using heap selection rather than a full sort.
+        '''
+        if k is None:
+            return sorted(doc_hit_map.iteritems(), key=QueryScorer.hit_order)
+        return heapq.nsmallest(k, doc_hit_map.iteritems(),
+                               key=QueryScorer.hit_order)
+        
+    @staticmethod
+    def drop_deleted(doc_hit_map, deleted):
+        '''Removes docids that are in ``deleted`` from doc_hit_map'''
+        if deleted:
+            for docid in [docid for docid in doc_hit_map if docid in deleted]:
+                del doc_hit_map[docid]
+        
     @abc.abstractmethod
-    def score_docs(self, query_vec, postings_lists, **extra):
+    def score_docs(self, query_vec, postings_lists, k=None, deleted=None,
+                   **extra):
         '''Scores documents' similarities to query
         
         Scans postings_lists to compute similarity scores for docs for the
@@ -70,6 +106,10 @@ class QueryScorer(object):
         Params:
             query: the query document
             postings_lists: a list of postings lists for terms in query
+            k: if given, only the top ``k`` docs are returned
+            deleted: optional :class:`DocidBitset` of tombstoned docids,
+                     which postings lists may still contain, and which are
+                     left out of the results
         
         Returns:
             A sorted iterable of (docid, score) tuples
@@ -82,7 +122,8 @@ class SimpleCountQueryScorer(QueryScorer):
     QueryScorer that uses simple term frequencies for scoring.
     '''
 
-    def score_docs(self, query_vec, postings_lists, **extra):
+    def score_docs(self, query_vec, postings_lists, k=None, deleted=None,
+                   **extra):
         '''
         Scores query-document similarity using number of occurrences
         of query terms in document.  Multiple occurrences of a term
@@ -94,11 +135,10 @@ class SimpleCountQueryScorer(QueryScorer):
             assert(query_vec[term] >= 1)
             for (docid, freq) in postings_list:
                 doc_hit_map[docid] += freq
+        self.drop_deleted(doc_hit_map, deleted)
         
         # construct list of tuples sorted by value
-        return sorted(doc_hit_map.iteritems(),
-                      key=operator.itemgetter(1),
-                      reverse=True)
+        return self.top_hits(doc_hit_map, k)
 
 class TFIDFQueryScorer(QueryScorer):
     '''
@@ -112,6 +152,12 @@ class TFIDFQueryScorer(QueryScorer):
     choosing the weighting strategy at index time.
     
     Query length is ignored, as it has no effect on relative ordering
+    
+    For top-k queries, if the index supplies per-term score upper bounds
+    (via a ``get_term_max_score`` callback), documents are scored
+    document-at-a-time using the MaxScore algorithm, which skips documents
+    that cannot make it into the top k.  Results are the same as with
+    exhaustive scoring.
     '''
     
     @staticmethod
@@ -139,7 +185,8 @@ class TFIDFQueryScorer(QueryScorer):
         
         self.idf_weight = self.idf_weight_log
         
-    def score_docs(self, query_vec, postings_lists, N, get_doc_freq, get_doc_len, **extra):
+    def score_docs(self, query_vec, postings_lists, N, get_doc_freq, get_doc_len,
+                   k=None, get_term_max_score=None, deleted=None, **extra):
         '''
         Scores documents' similarities to query using cosine similarity
         in a vector space model.  Uses tf.idf weighting.
@@ -149,27 +196,272 @@ class TFIDFQueryScorer(QueryScorer):
             idf * self.tf_weight(q_tf) * self.tf_weight(d_tf)
         
         The overall score for a doc is given by the sum of the term-hit scores
+        
+        Params:
+            get_term_max_score: optional callback returning an upper bound on
+                                ``tf_weight(d_tf) / doc_len`` for a term.
+                                Postings lists must then be sorted by docid.
         '''
         
         if N == 0: return ()
+        if k is not None and get_term_max_score is not None:
+            hits = self._max_score_docs(query_vec, postings_lists, N,
+                                        get_doc_freq, get_doc_len,
+                                        get_term_max_score, k, deleted)
+            if hits is not None:
+                return hits
         doc_hit_map = defaultdict(int)
         for (term, postings_list) in postings_lists:
             idf = self.idf_weight(N, get_doc_freq(term))
             query_term_wt = self.tf_weight(query_vec[term]) * idf
             for (docid, freq) in postings_list:
                 doc_hit_map[docid] += self.tf_weight(freq) * query_term_wt
+        self.drop_deleted(doc_hit_map, deleted)
         for (docid, weight) in doc_hit_map.iteritems():
             doc_len = get_doc_len(docid)
             doc_hit_map[docid] = weight / doc_len
             
         # construct list of tuples sorted by value
-        return sorted(doc_hit_map.iteritems(),
-                      key=operator.itemgetter(1),
-                      reverse=True)
+        return self.top_hits(doc_hit_map, k)
+
+    def _max_score_docs(self, query_vec, postings_lists, N,
+                        get_doc_freq, get_doc_len, get_term_max_score, k,
+                        deleted=None):
+        '''
+        Document-at-a-time top-k scoring using MaxScore dynamic pruning.
+        
+        Terms are ordered by their score upper bounds.  Once the top-k heap
+        is full, the terms with the smallest bounds whose bounds sum to no
+        more than the k-th best score are "non-essential": a doc containing
+        only those terms can't enter the top k, so candidates are drawn from
+        the essential terms only, and non-essential postings are just probed
+        (via binary search) for docs that may still qualify.
+        
+        Returns ``None`` if pruning isn't applicable (e.g., negative term
+        weights), in which case the caller should score exhaustively.
+        '''
+        if k <= 0: return []
+        
+        # [upper bound, query term weight, docids, freqs, cursor, term order]
+        terms = []
+        for (order, (term, postings_list)) in enumerate(postings_lists):
+            idf = self.idf_weight(N, get_doc_freq(term))
+            query_term_wt = self.tf_weight(query_vec[term]) * idf
+            if query_term_wt < 0:
+                return None
+            if len(postings_list) == 0:
+                continue
+            (docids, freqs) = self._postings_arrays(postings_list)
+            terms.append([query_term_wt * get_term_max_score(term),
+                          query_term_wt, docids, freqs, 0, order])
+        terms.sort(key=operator.itemgetter(0))
+        
+        # bound_sums[i] is the sum of the upper bounds of terms[0..i]
+        bound_sums = []
+        for term in terms:
+            bound_sums.append(term[0] + (bound_sums[-1] if bound_sums else 0))
+        
+        heap = []  # min-heap of (score, -docid), so ties favor lower docids
+        threshold = None  # k-th best score, once the heap is full
+        first_essential = 0
+        while True:
+            # next candidate is the smallest docid among essential terms
+            candidate = None
+            for term in terms[first_essential:]:
+                (docids, cursor) = (term[2], term[4])
+                if cursor < len(docids) and (candidate is None or
+                                             docids[cursor] < candidate):
+                    candidate = docids[cursor]
+            if candidate is None:
+                break
+            if deleted and candidate in deleted:
+                for term in terms[first_essential:]:
+                    (docids, cursor) = (term[2], term[4])
+                    if cursor < len(docids) and docids[cursor] == candidate:
+                        term[4] += 1
+                continue
+            
+            doc_len = get_doc_len(candidate)
+            hits = []  # (term order, unnormalized term-hit score)
+            weight = 0
+            for term in terms[first_essential:]:
+                (docids, cursor) = (term[2], term[4])
+                if cursor < len(docids) and docids[cursor] == candidate:
+                    hit = self.tf_weight(term[3][cursor]) * term[1]
+                    hits.append((term[5], hit))
+                    weight += hit
+                    term[4] += 1
+            
+            # probe non-essential terms, most promising first, as long as
+            # the doc can still beat the threshold
+            pruned = False
+            for i in range(first_essential - 1, -1, -1):
+                if (threshold is not None and
+                    weight / doc_len + bound_sums[i] <= threshold):
+                    pruned = True
+                    break
+                term = terms[i]
+                (docids, freqs) = (term[2], term[3])
+                cursor = bisect_left(docids, candidate, term[4])
+                term[4] = cursor
+                if cursor < len(docids) and docids[cursor] == candidate:
+                    hit = self.tf_weight(freqs[cursor]) * term[1]
+                    hits.append((term[5], hit))
+                    weight += hit
+                    term[4] += 1
+            if pruned:
+                continue
+            
+            # sum term-hit scores in query order, to exactly match
+            # exhaustive scoring
+            hits.sort()
+            weight = 0
+            for (order, hit) in hits:
+                weight += hit
+            score = weight / doc_len
+            
+            if threshold is None:
+                heapq.heappush(heap, (score, -candidate))
+                if len(heap) == k:
+                    threshold = heap[0][0]
+            elif score > threshold:
+                heapq.heapreplace(heap, (score, -candidate))
+                threshold = heap[0][0]
+            else:
+                continue
+            
+            if threshold is not None:
+                while (first_essential < len(terms) and
+                       bound_sums[first_essential] <= threshold):
+                    first_essential += 1
+        
+        heap.sort(reverse=True)
+        return [(-neg_docid, score) for (score, neg_docid) in heap]
+
+    @staticmethod
+    def _postings_arrays(postings_list):
+        '''Returns parallel (docids, freqs) sequences for postings_list'''
+        if hasattr(postings_list, 'docids'):
+            return (postings_list.docids, postings_list.freqs)
+        return ([docid for (docid, freq) in postings_list],
+                [freq for (docid, freq) in postings_list])
+
+class NumPyTFIDFQueryScorer(TFIDFQueryScorer):
+    '''
+    Vectorized version of :class:`TFIDFQueryScorer`, which requires ``numpy``.
+    
+    Postings are read as numpy arrays (without copying, for
+    :class:`pysimsearch.sim_index.postings.PostingsList`, and for
+    :class:`pysimsearch.sim_index.postings.MappedPostingsList` on
+    little-endian hosts), and term-hit
+    scores are accumulated with a single scatter-add into a dense score
+    array indexed by docid.  Scores are then normalized by a precomputed
+    doc-length array in one step, and the top k are selected using
+    ``argpartition``.  Results match :class:`TFIDFQueryScorer`.
+    '''
+    
+    def __init__(self, tf_weight_type = 'raw'):
+        if np is None:
+            raise ImportError('NumPyTFIDFQueryScorer requires numpy')
+        super(NumPyTFIDFQueryScorer, self).__init__(tf_weight_type)
+        self._log_tf = (tf_weight_type == 'log')
+        
+    def score_docs(self, query_vec, postings_lists, N, get_doc_freq, get_doc_len,
+                   k=None, get_doc_len_array=None, deleted=None, **extra):
+        '''
+        Scores documents' similarities to query using cosine similarity
+        in a vector space model.  Uses tf.idf weighting.
+        
+        Params:
+            get_doc_len_array: optional callback returning a buffer of doc
+                               lengths (as doubles) indexed by docid.  If not
+                               given, ``get_doc_len()`` is called per hit.
+        '''
+        if N == 0 or k == 0: return ()
+        docid_arrays = []
+        weight_arrays = []
+        for (term, postings_list) in postings_lists:
+            idf = self.idf_weight(N, get_doc_freq(term))
+            query_term_wt = self.tf_weight(query_vec[term]) * idf
+            if len(postings_list) == 0:
+                continue
+            (docids, freqs) = self._np_postings(postings_list)
+            tf = freqs.astype(np.float64)
+            if self._log_tf:
+                tf = 1 + np.log(tf)
+            docid_arrays.append(docids)
+            weight_arrays.append(tf * query_term_wt)
+        if not docid_arrays: return ()
+        
+        # scatter-add term-hit scores into dense arrays indexed by docid,
+        # offset by the lowest docid so they only span the docids hit
+        docids = np.concatenate(docid_arrays).astype(np.intp)
+        base = docids.min()
+        docids -= base
+        size = docids.max() + 1
+        weights = np.bincount(docids, np.concatenate(weight_arrays), size)
+        hits = np.flatnonzero(np.bincount(docids, minlength=size))
+        weights = weights[hits]
+        hit_docids = hits + base
+        if deleted:
+            live = ~self._np_deleted_mask(hit_docids, deleted)
+            (hit_docids, weights) = (hit_docids[live], weights[live])
+        
+        if get_doc_len_array is not None:
+            doc_lens = np.frombuffer(get_doc_len_array(), dtype=np.float64)
+            doc_lens = doc_lens[hit_docids]
+        else:
+            doc_lens = np.array([get_doc_len(docid) for docid in hit_docids],
+                                dtype=np.float64)
+        scores = weights / doc_lens
+        
+        # select top k (ties are broken by docid)
+        if k is None or k >= len(scores):
+            top = np.argsort(-scores, kind='mergesort')
+        else:
+            # keep every hit tied with the k-th best score, so the tie is
+            # broken by docid rather than by partition order
+            kth_score = -np.partition(-scores, k - 1)[k - 1]
+            top = np.flatnonzero(scores >= kth_score)
+            top = top[np.lexsort((hit_docids[top], -scores[top]))][:k]
+        return [(int(docid), float(score))
+                for (docid, score) in zip(hit_docids[top], scores[top])]
+    
+    @staticmethod
+    def _np_deleted_mask(docids, deleted):
+        '''Returns boolean array marking which of docids are in deleted'''
+        bits = np.frombuffer(deleted.bitmap(), dtype=np.uint8)
+        mask = np.zeros(len(docids), dtype=bool)
+        in_range = (docids >> 3) < len(bits)
+        docids = docids[in_range]
+        mask[in_range] = (bits[docids >> 3] >> (docids & 7)) & 1
+        return mask
+    
+    @staticmethod
+    def _np_postings(postings_list):
+        '''Returns parallel (docids, freqs) numpy arrays for postings_list'''
+        if hasattr(postings_list, 'buffer_info'):
+            # view the packed little-endian postings in place, and only
+            # copy if they need byteswapping
+            (buf, offset, count) = postings_list.buffer_info()
+            docids = np.frombuffer(buf, dtype='<u4', count=count,
+                                   offset=offset)
+            freqs = np.frombuffer(buf, dtype='<u4', count=count,
+                                  offset=offset + 4 * count)
+            if not docids.dtype.isnative:
+                (docids, freqs) = (docids.astype(np.uintc),
+                                   freqs.astype(np.uintc))
+            return (docids, freqs)
+        if hasattr(postings_list, 'docids'):
+            return (np.frombuffer(postings_list.docids, dtype=np.uintc),
+                    np.frombuffer(postings_list.freqs, dtype=np.uintc))
+        postings = np.array(list(postings_list), dtype=np.int64)
+        return (postings[:, 0], postings[:, 1])
 
 # Register scorers by name
 QueryScorer.register_scorers({
     'simple_count': SimpleCountQueryScorer,
-    'tfidf': TFIDFQueryScorer
+    'tfidf': TFIDFQueryScorer,
+    'tfidf_np': NumPyTFIDFQueryScorer
 })
 
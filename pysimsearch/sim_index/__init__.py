@@ -5,3 +5,9 @@ from .shelf_sim_index import ShelfSimIndex
 from .remote_sim_index import RemoteSimIndex
 from .sim_index_collection import SimIndexCollection
 from .concurrent_sim_index import ConcurrentSimIndex
+from .csr_sim_index import CSRSimIndex
+from .segment_sim_index import SegmentSimIndex
+from .sqlite_sim_index import SqliteSimIndex
+from .segmented_sim_index import SegmentedSimIndex
+from .process_sim_index import ProcessSimIndex
+from .process_sharded_sim_index import ProcessShardedSimIndex
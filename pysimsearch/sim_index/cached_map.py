@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2011, Taher Haveliwala <oss@taherh.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#         * Redistributions of source code must retain the above copyright
+#           notice, this list of conditions and the following disclaimer.
+#         * Redistributions in binary form must reproduce the above copyright
+#           notice, this list of conditions and the following disclaimer in the
+#           documentation and/or other materials provided with the distribution.
+#         * The names of project contributors may not be used to endorse or
+#           promote products derived from this software without specific
+#           prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+'''
+Write-through LRU cache for slow maps
+
+:class:`CachedMap` wraps a map whose reads are expensive (e.g., a shelf,
+which unpickles values on every read), and keeps recently read values
+decoded in memory.  Writes go straight through to the underlying map and
+replace the cached value, so the cache never serves stale values as long
+as all writes go through the :class:`CachedMap`.
+
+Sample usage::
+
+    from shelve import DbfilenameShelf
+    from pysimsearch.sim_index.cached_map import CachedMap
+
+    postings = CachedMap(DbfilenameShelf('/tmp/postings', 'n'),
+                         max_weight=1000000, weigh=len)
+
+'''
+
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+
+from collections import MutableMapping, OrderedDict
+import threading
+
+class CachedMap(MutableMapping):
+    '''
+    LRU cache of values read from ``map``, bounded by total weight.
+    
+    Cached values are shared with callers, so they must not be modified in
+    place.
+    
+    Instance Attributes:
+        max_weight: bound on the total weight of cached values
+        hits, misses: counters
+    '''
+    
+    def __init__(self, map, max_weight, weigh=None):
+        '''
+        Params:
+            map: underlying map
+            max_weight: bound on the total weight of cached values
+            weigh: function returning the weight of a value (e.g., ``len``).
+                   By default, each value has weight 1.
+        '''
+        self._map = map
+        self.max_weight = max_weight
+        self._weigh = weigh or (lambda value: 1)
+        self._cache = OrderedDict()  # key -> (value, weight), in LRU order
+        self._weight = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        
+    def __getitem__(self, key):
+        with self._lock:
+            entry = self._cache.pop(key, None)
+            if entry is not None:
+                self._cache[key] = entry  # move to most-recently-used end
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        value = self._map[key]
+        with self._lock:
+            self._put(key, value)
+        return value
+        
+    def __setitem__(self, key, value):
+        self._map[key] = value
+        with self._lock:
+            self._put(key, value)
+        
+    def __delitem__(self, key):
+        with self._lock:
+            self._discard(key)
+        del self._map[key]
+        
+    def __contains__(self, key):
+        return key in self._cache or key in self._map
+        
+    def __iter__(self):
+        return iter(self._map)
+        
+    def __len__(self):
+        return len(self._map)
+    
+    # bulk reads go straight to the underlying map, without polluting
+    # the cache
+    def iteritems(self):
+        return self._map.iteritems()
+    
+    def items(self):
+        return self._map.items()
+    
+    def clear_cache(self):
+        '''Drops all cached values'''
+        with self._lock:
+            self._cache.clear()
+            self._weight = 0
+    
+    def sync(self):
+        return self._map.sync()
+        
+    def close(self):
+        self.clear_cache()
+        return self._map.close()
+        
+    def _put(self, key, value):
+        self._discard(key)
+        weight = self._weigh(value)
+        if weight > self.max_weight:
+            return
+        self._cache[key] = (value, weight)
+        self._weight += weight
+        while self._weight > self.max_weight:
+            (_, (_, evicted_weight)) = self._cache.popitem(last=False)
+            self._weight -= evicted_weight
+            
+    def _discard(self, key):
+        entry = self._cache.pop(key, None)
+        if entry is not None:
+            self._weight -= entry[1]
@@ -37,8 +37,13 @@ Sample usage::
     from pysimsearch.sim_index import MemorySimIndex, ConcurrentSimIndex
 
     index = ConcurrentSimIndex(MemorySimIndex())
-    index.index_urls('http://www.stanford.edu/', 'http://www.berkeley.edu')
-    print(list(index.query('stanford')))
+    token = index.index_urls('http://www.stanford.edu/',
+                             'http://www.berkeley.edu')
+    # wait for the urls to be indexed before querying
+    print(list(index.query('stanford', wait_for=token)))
+
+    # reads never block; each write publishes a new copy of the index
+    index = ConcurrentSimIndex(MemorySimIndex(), snapshot=True)
 
 '''
 
@@ -49,6 +54,8 @@ from concurrent import futures
 import threading
 
 from . import SimIndex
+from .rwlock import RWLock
+from .. import doc_reader
 
 class ConcurrentSimIndex(object):
     '''Proxy to a :class:`pysimsearch.sim_index.SimIndex` that allows
@@ -57,8 +64,36 @@ class ConcurrentSimIndex(object):
     ``ConcurrentSimIndex`` is compatible with the :class:`SimIndex` interface.
     We use ``concurrent.futures`` to allow some basic concurrency for indexing
     and querying.  In particular, calls to ``index_urls()`` are executed in a
-    nonblocking manner.
+    nonblocking manner, and return a token for the background job.
+    
+    Reads see whatever updates have been applied when they run, and don't
+    wait for background jobs.  For read-your-writes consistency, pass the
+    token returned by ``index_urls()`` as the ``wait_for`` keyword argument
+    to any read method, e.g., ``index.query('stanford', wait_for=token)``.
+    The read then waits until that job, and all jobs started before it,
+    have finished, and raises the exception of any that failed.
+    
+    By default, read methods hold the read lock of a writer-preferring
+    :class:`pysimsearch.sim_index.rwlock.RWLock`, so they run concurrently
+    with each other, while write methods hold its write lock.  Backends
+    whose reads aren't safe to run concurrently (those without a true
+    ``thread_safe_reads`` attribute, e.g., :class:`ShelfSimIndex` and
+    :class:`SqliteSimIndex`) are read under the write lock instead.
+    
+    In snapshot mode, reads take no lock at all.  Each write that changes
+    the postings is instead applied to a copy of the index (see
+    :meth:`MemorySimIndex.copy()`), which is then published with a single
+    reference assignment, so in-flight reads keep using the version they
+    started with.  Writes are serialized, and a write that raises leaves
+    the published index untouched.  Since each such write copies the whole
+    index, snapshot mode is meant for read-heavy workloads with
+    infrequent, batched updates.  Other writes (e.g., ``set_config()``
+    and ``set_global_df_map()``) only replace single values, so they're
+    applied to the published index in place.
     '''
+    
+    # a ConcurrentSimIndex may itself be shared by threads
+    thread_safe_reads = True
 
     READ_METHODS = {'name_to_docid',
                     'docid_to_name',
@@ -66,9 +101,12 @@ class ConcurrentSimIndex(object):
                     'docids_with_terms',
                     'docnames_with_terms',
                     'query',
+                    'query_many',
+                    'query_with_status',
                     'get_local_N',
                     'get_local_df_map',
                     'get_name_to_docid_map',
+                    'query_cache_stats',
                     'config'}
     
     WRITE_METHODS = {'set_query_scorer',
@@ -80,51 +118,87 @@ class ConcurrentSimIndex(object):
                      'index_string_buffers',
                      'index_files',
                      'del_docids',
+                     'compact',
+                     'commit',
+                     'enable_query_cache',
+                     'disable_query_cache',
                      }
     
-    # Note:  assume that index_urls() is implemented by calling index_files()
-    #        so that the write-lock will be acquired at the time index_files()
-    #        is called.  We don't want to acquire a lock on index_urls()
-    #        directly, as we'd like allow at least the url fetches to occur
-    #        concurrently.
-    #
-    # TODO: re-implement index_urls() here to ensure the assumption is true?
-    NONBLOCKING_METHODS = { 'index_urls' }
-
+    # writes that are applied to a copy of the index in snapshot mode
+    SNAPSHOT_WRITE_METHODS = {'index_string_buffers',
+                              'index_files',
+                              'del_docids',
+                              'compact',
+                              'commit',
+                              }
     
-    def __init__(self, sim_index):
+    
+    def __init__(self, sim_index, snapshot=False):
         '''Initialize with ``sim_index``
         
         Params:
             sim_index: A :class:`SimIndex` instance.
+            snapshot: if True, use snapshot mode, which requires
+                      ``sim_index`` to support ``copy()``
         '''
         self._sim_index = sim_index
         self._executor = futures.ThreadPoolExecutor(max_workers=10)
-        self._lock = threading.RLock()  # TODO: use a Read-Write Lock
-        self._futures = set()
+        self._lock = RWLock()
+        self._snapshot = snapshot
+        self._jobs_lock = threading.Lock()
+        self._jobs = {}  # token -> future, for running or failed jobs
+        self._last_token = 0
     
     def acquire_read_lock(self):
         '''Acquire read lock'''
-        self._lock.acquire()
+        self._lock.acquire_read()
     
     def release_read_lock(self):
         '''Release read lock'''
-        self._lock.release()
+        self._lock.release_read()
     
     def acquire_write_lock(self):
         '''Acquire write lock'''
-        self._lock.acquire()
+        self._lock.acquire_write()
         
     def release_write_lock(self):
         '''Release write lock'''
-        self._lock.release()
+        self._lock.release_write()
         
-    def _read_decorator(self, func):
-        '''Wrap func with read_lock protection'''
+    def _snapshot_write_decorator(self, name):
+        '''
+        Wrap method ``name`` so it's applied to a copy of the index, which
+        is then published
+        '''
         def wrapper(*args, **kwargs):
+            self.acquire_write_lock()
+            try:
+                sim_index = self._sim_index.copy()
+                val = getattr(sim_index, name)(*args, **kwargs)
+                self._sim_index = sim_index
+                return val
+            finally:
+                self.release_write_lock()
+        return wrapper
+        
+    def _read_decorator(self, name):
+        '''
+        Wrap method ``name`` with read_lock protection (unless in snapshot
+        mode), and support for the ``wait_for`` keyword argument
+        '''
+        def wrapper(*args, **kwargs):
+            wait_for = kwargs.pop('wait_for', None)
+            if wait_for is not None:
+                self.wait(wait_for)
+            if self._snapshot:
+                # use whichever version is published when the read starts
+                return getattr(self._sim_index, name)(*args, **kwargs)
+            if not self._sim_index.thread_safe_reads:
+                return self._write_decorator(
+                    getattr(self._sim_index, name))(*args, **kwargs)
             self.acquire_read_lock()
             try:
-                return func(*args, **kwargs)
+                return getattr(self._sim_index, name)(*args, **kwargs)
             finally:
                 self.release_read_lock()
         return wrapper
@@ -139,36 +213,83 @@ class ConcurrentSimIndex(object):
                 self.release_write_lock()
         return wrapper
     
-    def _nonblocking_decorator(self, func):
+    def index_urls(self, *urls):
         '''
-        Wrap func with non-blocking futures call.
-        Return value of ``func`` is ignored.
+        Index ``urls`` in the background
+        
+        Returns:
+            int token for the job, which can be passed to :meth:`wait()`,
+            or as the ``wait_for`` argument of a read method.  Tokens
+            increase with each call.
         '''
-        def wrapper(*args, **kwargs):
-            future = self._executor.submit(func, *args, **kwargs)
-            self._futures.add(future)
-        return wrapper
-
-    def _futures_wait(self):
-        if len(self._futures) > 0:
-            r = futures.wait(self._futures)
-            for future in r.done:
-                if future.exception() is not None:
-                    raise future.exception()
-        self._futures = set()
+        with self._jobs_lock:
+            self._last_token += 1
+            token = self._last_token
+            future = self._executor.submit(self._index_urls_job, urls)
+            self._jobs[token] = future
+        future.add_done_callback(lambda future: self._job_done(token, future))
+        return token
+    
+    def _index_urls_job(self, urls):
+        index_urls = getattr(type(self._sim_index), 'index_urls', None)
+        if getattr(index_urls, '__func__', None) is SimIndex.index_urls.__func__:
+            # The default index_urls() just fetches the urls and calls
+            # index_files(), so fetch them here without holding any lock.
+            # Materialize the files, since get_urls() is lazy.
+            named_files = list(doc_reader.get_urls(urls))
+            self.index_files(named_files)
+        else:
+            # e.g., a SimIndexCollection, which forwards urls to its shards
+            if self._snapshot:
+                self._snapshot_write_decorator('index_urls')(*urls)
+            else:
+                self._write_decorator(self._sim_index.index_urls)(*urls)
+    
+    def _job_done(self, token, future):
+        '''Forget successful jobs.  Failed jobs are kept until waited on'''
+        if future.exception() is None:
+            with self._jobs_lock:
+                del self._jobs[token]
+    
+    def wait(self, token=None, timeout=None):
+        '''
+        Wait for background jobs to finish
+        
+        Params:
+            token: wait for the job with this token, and all earlier jobs.
+                   If None, wait for all jobs started so far.
+            timeout: maximum number of seconds to wait, or None to wait
+                     indefinitely
+                     
+        Returns:
+            True if the jobs finished, False if we timed out.  If any of
+            them failed, its exception is raised (once).
+        '''
+        with self._jobs_lock:
+            if token is None:
+                token = self._last_token
+            jobs = [(t, future) for (t, future) in self._jobs.iteritems()
+                    if t <= token]
+        (done, not_done) = futures.wait([future for (t, future) in jobs],
+                                        timeout=timeout)
+        for (t, future) in sorted(jobs):
+            if future in done and future.exception() is not None:
+                with self._jobs_lock:
+                    if self._jobs.pop(t, None) is None:
+                        # another caller already raised it
+                        continue
+                raise future.exception()
+        return not not_done
 
     def __getattr__(self, name):
         func = getattr(self._sim_index, name)
         
         if name in self.READ_METHODS:
-            # wait for any outstanding non-blocking calls to complete
-            self._futures_wait()
-            return self._read_decorator(func)
+            return self._read_decorator(name)
         elif name in self.WRITE_METHODS:
-            # wait for any outstanding  non-blocking calls to complete
+            if self._snapshot and name in self.SNAPSHOT_WRITE_METHODS:
+                return self._snapshot_write_decorator(name)
             return self._write_decorator(func)
-        elif name in self.NONBLOCKING_METHODS:
-            return self._nonblocking_decorator(func)
         else:
             raise Exception("Unsupported method: {}".format(name))
 
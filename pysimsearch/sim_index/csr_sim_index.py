@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2011, Taher Haveliwala <oss@taherh.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#         * Redistributions of source code must retain the above copyright
+#           notice, this list of conditions and the following disclaimer.
+#         * Redistributions in binary form must reproduce the above copyright
+#           notice, this list of conditions and the following disclaimer in the
+#           documentation and/or other materials provided with the distribution.
+#         * The names of project contributors may not be used to endorse or
+#           promote products derived from this software without specific
+#           prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+'''
+CSRSimIndex
+
+Read-only :class:`SimIndex` that freezes a built
+:class:`pysimsearch.sim_index.MemorySimIndex` into a term-by-document
+sparse matrix in CSR format.  A batch of queries is scored as one sparse
+matrix-matrix product, which makes bulk (re-)ranking much faster than
+scoring queries one at a time.  Requires ``numpy`` and ``scipy``.
+
+Sample usage::
+
+    from pprint import pprint
+    from pysimsearch.sim_index import MemorySimIndex, CSRSimIndex
+
+    sim_index = MemorySimIndex()
+    sim_index.index_urls('http://www.stanford.edu/',
+                         'http://www.berkeley.edu',
+                         'http://www.ucla.edu',
+                         'http://www.mit.edu')
+    frozen_index = CSRSimIndex(sim_index)
+    pprint(frozen_index.query_many(['stanford university',
+                                    'university of california'], k=2))
+
+'''
+
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+
+from array import array
+
+try:
+    import numpy as np
+    import scipy.sparse as sp
+except ImportError:
+    np = sp = None
+
+from . import SimIndex
+from ..exceptions import *
+from ..query_scorer import QueryScorer, SimpleCountQueryScorer, TFIDFQueryScorer
+
+class CSRSimIndex(SimIndex):
+    '''
+    Inherits from :class:`pysimsearch.sim_index.SimIndex`.
+    
+    Frozen, read-only index backed by a term-by-document CSR matrix of term
+    frequencies.  Rows correspond to terms and columns to (live) documents.
+    Document lengths are precomputed into a vector, and the doc-side term
+    weights for the current scorer are materialized once into a weighted
+    copy of the matrix.  Query-side weights (including idf) are applied to
+    the query matrix, so global df stats may still be set.
+    
+    Supports the ``tfidf`` (and ``tfidf_np``) and ``simple_count`` scorers.
+    Unlike the exhaustive scorers, documents whose score is exactly 0
+    (e.g., that only match terms with an idf of 0) are not returned.
+    '''
+    
+    thread_safe_reads = True
+    
+    def __init__(self, sim_index):
+        '''Freeze ``sim_index``
+        
+        Params:
+            sim_index: A :class:`pysimsearch.sim_index.MemorySimIndex`
+        '''
+        if sp is None:
+            raise ImportError('CSRSimIndex requires numpy and scipy')
+        super(CSRSimIndex, self).__init__()
+        self.update_config(**sim_index._config)
+        
+        # documents: matrix column j corresponds to docid self._docids[j]
+        docids = sorted(sim_index._docid_to_name_map)
+        self._docids = np.array(docids, dtype=np.intp)
+        self._docid_to_name_map = { docid: sim_index.docid_to_name(docid)
+                                    for docid in docids }
+        self._name_to_docid_map = { name: docid for (docid, name)
+                                    in self._docid_to_name_map.items() }
+        self._doc_lens = np.array([sim_index.get_doc_len(docid)
+                                   for docid in docids], dtype=np.float64)
+        columns = { docid: col for (col, docid) in enumerate(docids) }
+        
+        # terms: matrix row i corresponds to term self._terms[i]
+        self._terms = []
+        self._term_to_row = {}
+        indptr = array(str('l'), [0])
+        indices = array(str('l'))
+        freqs = array(str('d'))
+        term_dict = sim_index._term_dict
+        for tid in xrange(len(term_dict)):
+            term = term_dict.term(tid)
+            self._term_to_row[term] = len(self._terms)
+            self._terms.append(term)
+            for (docid, freq) in sim_index._postings(tid):
+                indices.append(columns[docid])
+                freqs.append(freq)
+            indptr.append(len(indices))
+        self._freqs = sp.csr_matrix(
+            (np.array(freqs, dtype=np.float64),
+             np.array(indices, dtype=np.intp),
+             np.array(indptr, dtype=np.intp)),
+            shape=(len(self._terms), len(docids)))
+        
+        # local stats
+        self._N = len(docids)
+        self._df = np.diff(self._freqs.indptr)
+        self._global_df_map = None
+        
+        # cache of doc-side weighted matrices, keyed by scorer type
+        self._doc_weights = {}
+        self.set_query_scorer('tfidf')
+        
+    def set_query_scorer(self, query_scorer):
+        '''Set the query_scorer
+        
+        Params:
+            query_scorer: scorer name or object.  Must be either a
+                          :class:`TFIDFQueryScorer` or a
+                          :class:`SimpleCountQueryScorer`.
+        '''
+        if isinstance(query_scorer, basestring):
+            query_scorer = QueryScorer.make_scorer(query_scorer)
+        if isinstance(query_scorer, TFIDFQueryScorer):
+            if query_scorer.tf_weight is TFIDFQueryScorer.tf_weight_log:
+                self._scorer_type = 'tfidf_log'
+            else:
+                self._scorer_type = 'tfidf_raw'
+        elif isinstance(query_scorer, SimpleCountQueryScorer):
+            self._scorer_type = 'simple_count'
+        else:
+            raise Exception('Unsupported query scorer: {}'.format(query_scorer))
+        super(CSRSimIndex, self).set_query_scorer(query_scorer)
+    
+    def set_global_df_map(self, df_map):
+        self._global_df_map = df_map
+        self._bump_generation()
+        
+    def get_local_df_map(self):
+        return { term: int(df) for (term, df) in zip(self._terms, self._df)
+                 if df > 0 }
+    
+    def get_name_to_docid_map(self):
+        return self._name_to_docid_map
+    
+    def get_doc_freq(self, term):
+        if self._global_df_map:
+            return self._global_df_map.get(term, 1)
+        return int(self._df[self._term_to_row[term]]) or 1
+        
+    def index_files(self, named_files):
+        raise ReadOnlyIndexException('CSRSimIndex is read-only')
+        
+    def del_docids(self, *docids):
+        raise ReadOnlyIndexException('CSRSimIndex is read-only')
+        
+    def docid_to_name(self, docid):
+        return self._docid_to_name_map[docid]
+    
+    def name_to_docid(self, name):
+        return self._name_to_docid_map[name]
+    
+    def postings_list(self, term):
+        '''
+        Returns list of (docid, freq) tuples for documents containing term
+        '''
+        if self.config('lowercase'):
+            term = term.lower()
+        row = self._term_to_row.get(term)
+        if row is None:
+            return []
+        (start, end) = self._freqs.indptr[row:row + 2]
+        return [(int(self._docids[col]), int(freq)) for (col, freq) in
+                zip(self._freqs.indices[start:end], self._freqs.data[start:end])]
+    
+    def _doc_matrix(self):
+        '''Returns the term-by-doc matrix of doc-side weights for the scorer'''
+        weights = self._doc_weights.get(self._scorer_type)
+        if weights is None:
+            if self._scorer_type == 'simple_count':
+                weights = self._freqs
+            else:
+                weights = self._freqs.copy()
+                if self._scorer_type == 'tfidf_log':
+                    weights.data = 1 + np.log(weights.data)
+                inv_doc_lens = np.zeros(len(self._doc_lens))
+                np.divide(1, self._doc_lens, out=inv_doc_lens,
+                          where=self._doc_lens > 0)
+                weights = weights.dot(sp.diags(inv_doc_lens)).tocsr()
+            self._doc_weights[self._scorer_type] = weights
+        return weights
+    
+    def _query_matrix(self, query_vecs):
+        '''Returns the query-by-term matrix of query-side weights'''
+        N = self._global_N or self._N
+        lowercase = self.config('lowercase')
+        (rows, cols, vals) = ([], [], [])
+        for (i, query_vec) in enumerate(query_vecs):
+            term_freqs = {}
+            for (term, freq) in query_vec.iteritems():
+                if lowercase:
+                    term = term.lower()
+                if term in self._term_to_row:
+                    term_freqs[term] = term_freqs.get(term, 0) + freq
+            for (term, freq) in term_freqs.iteritems():
+                if self._scorer_type == 'simple_count':
+                    weight = 1
+                else:
+                    idf = self.query_scorer.idf_weight(N, self.get_doc_freq(term))
+                    weight = self.query_scorer.tf_weight(freq) * idf
+                rows.append(i)
+                cols.append(self._term_to_row[term])
+                vals.append(weight)
+        return sp.csr_matrix((vals, (rows, cols)),
+                             shape=(len(query_vecs), len(self._terms)))
+    
+    def _query_many(self, query_vecs, k=None):
+        '''Finds documents similar to each of query_vecs
+        
+        The whole batch is scored with one sparse matrix product.
+        '''
+        if (self._global_N or self._N) == 0 or k == 0:
+            return [[] for query_vec in query_vecs]
+        scores = self._query_matrix(query_vecs).dot(self._doc_matrix()).tocsr()
+        
+        results = []
+        for i in xrange(len(query_vecs)):
+            (start, end) = scores.indptr[i:i + 2]
+            cols = scores.indices[start:end]
+            row_scores = scores.data[start:end]
+            # select top k (ties are broken by docid)
+            if k is not None and k < len(row_scores):
+                # keep every doc tied with the k-th best score, so the tie
+                # is broken by docid rather than by partition order
+                kth_score = -np.partition(-row_scores, k - 1)[k - 1]
+                top = np.flatnonzero(row_scores >= kth_score)
+            else:
+                top = np.arange(len(row_scores))
+            top = top[np.lexsort((cols[top], -row_scores[top]))][:k]
+            results.append([(self._docid_to_name_map[self._docids[col]],
+                             float(score))
+                            for (col, score) in zip(cols[top], row_scores[top])])
+        return results
+    
+    def _query(self, query_vec, k=None):
+        '''Finds documents similar to query_vec
+        
+        Params:
+            query_vec: term vector representing query document
+            k: if given, only the top ``k`` results are returned
+        
+        Returns:
+            A list of (docname, score) tuples sorted by score
+        '''
+        return self._query_many([query_vec], k)[0]
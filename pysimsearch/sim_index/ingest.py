@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2011, Taher Haveliwala <oss@taherh.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#         * Redistributions of source code must retain the above copyright
+#           notice, this list of conditions and the following disclaimer.
+#         * Redistributions in binary form must reproduce the above copyright
+#           notice, this list of conditions and the following disclaimer in the
+#           documentation and/or other materials provided with the distribution.
+#         * The names of project contributors may not be used to endorse or
+#           promote products derived from this software without specific
+#           prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+'''
+Document tokenization for indexing, optionally in parallel
+
+:func:`iter_term_vecs()` turns a stream of (name, file) pairs into
+(name, term vector) pairs.  By default documents are tokenized in-process.
+If the ``ingest_workers`` config value is set, they are instead tokenized
+by a :class:`ParallelTokenizer`: a pool of worker processes, each of which
+tokenizes whole batches of ``ingest_batch_size`` documents.  Files are read
+in the calling process, and term vectors are yielded back in input order,
+so the single writer (the index) assigns the same docids as with serial
+tokenization.  At most ``ingest_max_pending`` batches are in flight at a
+time, so the input isn't read ahead without bound when the writer falls
+behind.
+
+Starting a pool is costly, so indexes keep theirs across ``index_files()``
+calls (see :func:`get_tokenizer()`), and shut it down when closed.
+
+Sample usage::
+
+    from pysimsearch.sim_index import MemorySimIndex
+
+    sim_index = MemorySimIndex()
+    sim_index.update_config(ingest_workers=8, ingest_batch_size=200)
+    sim_index.index_filenames(*filenames)
+
+'''
+
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+
+from collections import deque
+import io
+import multiprocessing
+import os
+
+from .. import term_vec
+
+def iter_term_vecs(named_files, config, tokenizer=None):
+    '''Yields (name, term vector) for each of ``named_files``, in order
+    
+    Params:
+        named_files: iterable of (filename, file) pairs.
+                     Takes ownership of (and consumes) the files.
+        config: index config, with the ``stoplist`` and ``lowercase``
+                values used for tokenization, and optionally
+                ``ingest_workers``, ``ingest_batch_size`` and
+                ``ingest_max_pending``
+        tokenizer: :class:`ParallelTokenizer` to use, which is left
+                   running.  If not given and ``ingest_workers`` is set,
+                   a pool is started (and shut down) for this call.
+    '''
+    if tokenizer is not None:
+        for (name, t_vec) in tokenizer.term_vecs(named_files):
+            yield (name, t_vec)
+    elif config.get('ingest_workers', 0):
+        tokenizer = get_tokenizer(None, config)
+        try:
+            for (name, t_vec) in tokenizer.term_vecs(named_files):
+                yield (name, t_vec)
+        finally:
+            tokenizer.close()
+    else:
+        for (name, file) in named_files:
+            with file:
+                t_vec = term_vec.term_vec(
+                    file,
+                    stoplist=config['stoplist'],
+                    lowercase=config['lowercase'],
+                )
+            yield (name, t_vec)
+
+def get_tokenizer(tokenizer, config):
+    '''
+    Returns a :class:`ParallelTokenizer` for ``config``, reusing
+    ``tokenizer`` if possible
+    
+    Params:
+        tokenizer: a :class:`ParallelTokenizer` or ``None``.  It's returned
+                   if it was started, in this process, with the same
+                   settings as ``config``; otherwise it's shut down.
+        config: index config, as for :func:`iter_term_vecs()`
+    
+    Returns:
+        a :class:`ParallelTokenizer`, or ``None`` if ``ingest_workers``
+        isn't set
+    '''
+    workers = config.get('ingest_workers', 0)
+    settings = (workers, config['stoplist'], config['lowercase'],
+                config.get('ingest_batch_size', 100),
+                config.get('ingest_max_pending', 0))
+    if tokenizer is not None:
+        if tokenizer.settings == settings and tokenizer.pid == os.getpid():
+            return tokenizer
+        tokenizer.close()
+    if not workers:
+        return None
+    return ParallelTokenizer(*settings)
+
+# tokenization config of a worker process, set by _init_worker()
+_worker_config = None
+
+def _init_worker(stoplist, lowercase):
+    global _worker_config
+    _worker_config = (stoplist, lowercase)
+
+def _tokenize_batch(batch):
+    '''Returns list of (name, term vector) for batch of (name, text) pairs'''
+    (stoplist, lowercase) = _worker_config
+    return [(name, term_vec.term_vec(io.StringIO(text), stoplist=stoplist,
+                                     lowercase=lowercase))
+            for (name, text) in batch]
+
+class ParallelTokenizer(object):
+    '''
+    Tokenizes documents in a pool of worker processes.
+    
+    Instance Attributes:
+        settings: the arguments the tokenizer was started with
+        pid: id of the process that started the pool
+    '''
+    
+    def __init__(self, workers, stoplist, lowercase, batch_size=100,
+                 max_pending=0):
+        '''
+        Params:
+            workers: number of worker processes
+            stoplist: stoplist used for tokenization
+            lowercase: if True, terms are lowercased
+            batch_size: number of documents sent to a worker at a time
+            max_pending: maximum number of batches in flight (by default,
+                         twice the number of workers)
+        '''
+        self.settings = (workers, stoplist, lowercase, batch_size, max_pending)
+        self.pid = os.getpid()
+        self._batch_size = batch_size
+        self._max_pending = max_pending or 2 * workers
+        self._pool = multiprocessing.Pool(workers, initializer=_init_worker,
+                                          initargs=(stoplist, lowercase))
+        
+    def close(self):
+        '''
+        Shuts down the worker processes.  In a forked child, the pool
+        belongs to the parent, and is left alone.
+        '''
+        if self._pool is not None and self.pid == os.getpid():
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+            
+    def term_vecs(self, named_files):
+        '''Yields (name, term vector) for each of ``named_files``, in order
+        
+        Params:
+            named_files: iterable of (filename, file) pairs.
+                         Takes ownership of (and consumes) the files.
+        '''
+        pending = deque()
+        batch = []
+        for (name, file) in named_files:
+            with file:
+                text = file.read()
+            if isinstance(text, str):
+                text = unicode(text)
+            batch.append((name, text))
+            if len(batch) >= self._batch_size:
+                # hand back finished batches, and block on the oldest one
+                # if too many are in flight
+                while pending and (pending[0].ready() or
+                                   len(pending) >= self._max_pending):
+                    for result in pending.popleft().get():
+                        yield result
+                pending.append(self._pool.apply_async(_tokenize_batch, (batch,)))
+                batch = []
+        if batch:
+            pending.append(self._pool.apply_async(_tokenize_batch, (batch,)))
+        while pending:
+            for result in pending.popleft().get():
+                yield result
@@ -37,16 +37,20 @@ See :mod:`pysimsearch.sim_index.memory_sim_index` for sample usage
 from __future__ import (division, absolute_import, print_function,
                         unicode_literals)
 
+from array import array
 from collections import defaultdict
 import sys
+import threading
 
-from . import SimIndex
+from .term_id_sim_index import TermIdSimIndex
+from .postings import DocidBitset
+from .term_dictionary import TermDictionary
 from .. import term_vec
 from ..exceptions import *
 
-class MapSimIndex(SimIndex):
+class MapSimIndex(TermIdSimIndex):
     '''
-    Inherits from :class:`pysimsearch.sim_index.SimIndex`.
+    Inherits from :class:`pysimsearch.sim_index.term_id_sim_index.TermIdSimIndex`.
     
     Simple implementation of the :class:`SimIndex` interface backed with dict-like
     objects (MutableMapping).  By default, uses `dict`, in which case the
@@ -61,6 +65,32 @@ class MapSimIndex(SimIndex):
     Instead, do the equivalent of::
     
         map[key] += [a,b]  # same as: map[key] = map[key].__iadd__([a,b])
+    
+    To keep the number of such assignments down, new postings (along with
+    df deltas) are staged in a write-back buffer, and each touched postings
+    list is written back exactly once when the buffer is flushed.  By
+    default the buffer is flushed at the end of each :meth:`index_files()`
+    call.  If the ``write_buffer_size`` config value is set, the buffer is
+    instead kept across calls, and flushed by :meth:`commit()` or once it
+    holds that many postings.  Reads merge the maps with the buffer.  If the
+    maps are known to hold live objects (e.g., plain ``dict``), pass
+    ``mutable_postings=True`` to instead append to postings lists in place.
+    
+    Deletions are similarly batched: :meth:`del_docids()` only records
+    tombstones for the deleted docids, which are skipped when reading postings.
+    The postings lists are physically cleaned up by :meth:`compact()`, which
+    is called automatically once the fraction of tombstoned docs exceeds the
+    ``compact_ratio`` config value.
+    
+    Terms are mapped to dense integer term ids by a
+    :class:`pysimsearch.sim_index.term_dictionary.TermDictionary`, and the
+    term index, df map and stored doc vectors are all keyed by term id.  The
+    public api (e.g., :meth:`postings_list()`, :meth:`get_local_df_map()`)
+    remains string-based.
+    
+    For each term, we also maintain an upper bound on ``freq / doc_len``
+    over its postings (see :meth:`get_term_max_score()`), which lets
+    scorers skip documents that cannot make it into the top k results.
     '''
 
     
@@ -71,7 +101,11 @@ class MapSimIndex(SimIndex):
                  term_index=None,
                  doc_vectors=None,
                  df_map=None,
-                 doc_len_map=None):
+                 doc_len_map=None,
+                 max_score_map=None,
+                 postings_type=list,
+                 mutable_postings=False,
+                 term_dict=None):
 
         super(MapSimIndex, self).__init__()
 
@@ -80,9 +114,27 @@ class MapSimIndex(SimIndex):
         self._docid_to_name_map = docid_to_name_map
         self._docid_to_feature_map = docid_to_feature_map
 
+        # term dictionary, mapping terms to the term ids used as keys
+        # by the term index, df map, and doc vectors
+        self._term_dict = term_dict if term_dict is not None else TermDictionary()
+        
         # term index
         self._term_index = term_index
         
+        # type used to construct stored postings lists, which must
+        # be constructible from an iterable of (docid, freq) tuples
+        self._postings_type = postings_type
+        
+        # if True, stored postings lists may be appended to in place,
+        # otherwise new postings and df deltas are staged in a write-back
+        # buffer and flushed in batches
+        self._mutable_postings = mutable_postings
+        self._pending_postings = defaultdict(list)
+        self._pending_max_scores = {}
+        self._pending_df = defaultdict(int)
+        self._pending_count = 0
+        self.set_config('write_buffer_size', 0)
+        
         # document vectors (useful for deletions and certain scoring algorithms)
         self._doc_vectors = doc_vectors
         
@@ -90,6 +142,22 @@ class MapSimIndex(SimIndex):
         self._df_map = df_map
         self._doc_len_map = doc_len_map
         
+        # dense in-memory copy of doc lengths indexed by docid.  New docs
+        # are appended as they're indexed; docs already in the maps (e.g.,
+        # in a reopened shelf) are filled in by get_doc_len_array(), under
+        # a lock since readers may call it concurrently.
+        self._doc_len_array = array(str('d'))
+        self._doc_len_array_lock = threading.Lock()
+        
+        # per-term upper bound on freq / doc_len, used for dynamic pruning
+        self._max_score_map = max_score_map
+        
+        # tombstones for deleted docids, along with the term ids whose
+        # postings lists still reference them
+        self._deleted = DocidBitset()
+        self._deleted_terms = set()
+        self.set_config('compact_ratio', 0.1)
+        
         # global stats, which if present, are used instead
         # of the local stats
         self._global_df_map = None
@@ -97,59 +165,173 @@ class MapSimIndex(SimIndex):
         # set a default scorer
         self.set_query_scorer('tfidf')
 
+    def __getstate__(self):
+        # locks and tokenizer pools can't be pickled
+        state = self.__dict__.copy()
+        del state['_doc_len_array_lock']
+        state['_tokenizer'] = None
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._doc_len_array_lock = threading.Lock()
+
     def set_global_df_map(self, df_map):
         self._global_df_map = df_map
+        self._bump_generation()
         
     def get_local_df_map(self):
-        return self._df_map
+        # look terms up by id rather than iterating over the df map, which
+        # shelf-backed maps don't support
+        df_map = {}
+        for tid in xrange(len(self._term_dict)):
+            df = self._df_map.get(tid, 0) + self._pending_df.get(tid, 0)
+            if df:
+                df_map[self._term_dict.term(tid)] = df
+        return df_map
     
     def get_name_to_docid_map(self):
         return self._name_to_docid_map
     
-    def get_doc_freq(self, term):
-        df_map = self._global_df_map or self._df_map
-        return df_map.get(term, 1)
+    def get_doc_freq(self, tid):
+        '''Returns document frequency for term id ``tid``'''
+        if self._global_df_map:
+            return self._global_df_map.get(self._term_dict.term(tid), 1)
+        return self._df_map.get(tid, 0) + self._pending_df.get(tid, 0) or 1
         
     def get_doc_len(self, docid):
         return self._doc_len_map.get(docid, 0)
         
+    def get_doc_len_array(self):
+        '''
+        Returns an ``array('d')`` of doc lengths indexed by docid, with 0
+        for deleted docids.  The array must not be held onto across updates.
+        '''
+        doc_lens = self._doc_len_array
+        if len(doc_lens) < self._next_docid:
+            with self._doc_len_array_lock:
+                for docid in xrange(len(doc_lens), self._next_docid):
+                    doc_lens.append(self._doc_len_map.get(docid, 0))
+        return doc_lens
+        
+    def get_term_max_score(self, tid):
+        '''
+        Returns an upper bound on ``freq / doc_len`` over the postings of
+        term id ``tid``.
+        
+        The bound is computed at index time, and is not lowered when
+        documents are deleted, so it may be loose (but remains valid).
+        Since ``1 + log(tf) <= tf``, it also bounds log-scaled tf weights.
+        '''
+        return max(self._max_score_map.get(tid, 0),
+                   self._pending_max_scores.get(tid, 0))
+        
     def index_files(self, named_files):
         '''
         Build a similarity index over collection given in named_files
         named_files is a list iterable of (filename, file) pairs
         '''
-        for (name, file) in named_files:
-            with file:
-                t_vec = term_vec.term_vec(
-                    file,
-                    stoplist=self.config('stoplist'),
-                    lowercase=self.config('lowercase'),
-                )
-            docid = self._next_docid
-            self._name_to_docid_map[name] = docid
-            self._docid_to_name_map[docid] = name
-            for term in t_vec:
-                if term not in self._df_map: self._df_map[term] = 0
-                self._df_map[term] += 1
-            self._add_vec(docid, t_vec)
-            self._doc_len_map[docid] = term_vec.l2_norm(t_vec)
-            self._doc_vectors[docid] = t_vec
-            self._N += 1
-            self._next_docid += 1
-
-    def _add_vec(self, docid, term_vec):
-        '''Add term_vec to the index'''
-        # build up a dictionary of batched updates for the index
-        term_index = defaultdict(list)
-        for (term, freq) in term_vec.iteritems():
-            term_index[term].append((docid, freq))
-
-        # apply the updates to the term index
-        for (term, new_postings) in term_index.items():
-            self._term_index[term] = self.postings_list(term) + new_postings
+        try:
+            for (name, t_vec) in self._term_vecs(named_files):
+                self._index_term_vec(name, t_vec)
+        finally:
+            if not self.config('write_buffer_size'):
+                self._flush_pending()
+            self._bump_generation()
+
+    def _index_term_vec(self, name, t_vec):
+        '''Adds document ``name``, with term vector ``t_vec``, to the index'''
+        docid = self._next_docid
+        self._name_to_docid_map[name] = docid
+        self._docid_to_name_map[docid] = name
+        tid_vec = { self._term_dict.add(term): freq
+                    for (term, freq) in t_vec.iteritems() }
+        for tid in tid_vec:
+            self._add_df(tid, 1)
+        doc_len = term_vec.l2_norm(t_vec)
+        self._add_vec(docid, tid_vec, doc_len)
+        self._doc_len_map[docid] = doc_len
+        if len(self._doc_len_array) == docid:
+            self._doc_len_array.append(doc_len)
+        self._doc_vectors[docid] = tid_vec
+        self._N += 1
+        self._next_docid += 1
+        
+        buffer_size = self.config('write_buffer_size')
+        if buffer_size and self._pending_count >= buffer_size:
+            self._flush_pending()
+
+    def commit(self):
+        '''Writes back any buffered postings and df deltas to the maps'''
+        self._flush_pending()
+
+    def _add_df(self, tid, delta):
+        '''Adds delta to the df of term id ``tid``'''
+        if self._mutable_postings:
+            df = self._df_map.get(tid, 0) + delta
+            if df:
+                self._df_map[tid] = df
+            else:
+                del self._df_map[tid]
+        else:
+            self._pending_df[tid] += delta
+
+    def _add_vec(self, docid, tid_vec, doc_len):
+        '''Add tid_vec, a term vector keyed by term id, to the index'''
+        if self._mutable_postings:
+            max_scores = self._max_score_map
+            for (tid, freq) in tid_vec.iteritems():
+                postings = self._term_index.get(tid)
+                if postings is None:
+                    postings = self._term_index[tid] = self._postings_type()
+                postings.append((docid, freq))
+                if freq / doc_len > max_scores.get(tid, 0):
+                    max_scores[tid] = freq / doc_len
+        else:
+            # stage the postings, to be applied by _flush_pending()
+            max_scores = self._pending_max_scores
+            for (tid, freq) in tid_vec.iteritems():
+                self._pending_postings[tid].append((docid, freq))
+                if freq / doc_len > max_scores.get(tid, 0):
+                    max_scores[tid] = freq / doc_len
+            self._pending_count += len(tid_vec)
+
+    def _flush_pending(self):
+        '''
+        Apply staged postings and df deltas, with one assignment per
+        touched term
+        '''
+        pending = self._pending_postings
+        self._pending_postings = defaultdict(list)
+        self._pending_count = 0
+        for (tid, new_postings) in pending.iteritems():
+            postings = self._term_index.get(tid)
+            if postings is None:
+                postings = self._postings_type()
+            self._term_index[tid] = postings + new_postings
+        
+        pending_df = self._pending_df
+        self._pending_df = defaultdict(int)
+        for (tid, delta) in pending_df.iteritems():
+            if delta:
+                df = self._df_map.get(tid, 0) + delta
+                if df:
+                    self._df_map[tid] = df
+                else:
+                    del self._df_map[tid]
+        
+        pending_max_scores = self._pending_max_scores
+        self._pending_max_scores = {}
+        for (tid, max_score) in pending_max_scores.iteritems():
+            if max_score > self._max_score_map.get(tid, 0):
+                self._max_score_map[tid] = max_score
 
     def del_docids(self, *docids):
-        '''Delete docids from index'''
+        '''Delete docids from index
+        
+        Docids are tombstoned rather than removed from postings lists right
+        away.  See :meth:`compact()`.
+        '''
 
         def _del_helper(map, key):
             try:
@@ -158,19 +340,14 @@ class MapSimIndex(SimIndex):
 #                sys.stderr.write("Unkown docid: {}\n".format(docid))
                 pass
                 
-        # TODO: optimize for batch deletion
         for docid in docids:
-            for (term, freq) in self._doc_vectors[docid].iteritems():
+            for tid in self._doc_vectors[docid]:
                 # decr df count
-                self._df_map[term] -= 1
-                # filter out docid from term index
-                self._term_index[term] = [
-                    (_docid, freq)
-                    for (_docid, freq) in self._term_index.get(term, [])
-                    if _docid != docid
-                ]
-                if len(self._term_index[term]) == 0:
-                    del self._term_index[term]
+                self._add_df(tid, -1)
+                self._deleted_terms.add(tid)
+            self._deleted.add(docid)
+            if docid < len(self._doc_len_array):
+                self._doc_len_array[docid] = 0
             
             name = self.docid_to_name(docid)
             _del_helper(self._docid_to_name_map, docid)
@@ -180,6 +357,35 @@ class MapSimIndex(SimIndex):
             _del_helper(self._doc_vectors, docid)
             
             self._N -= 1
+        self._bump_generation()
+        
+        if len(self._deleted) > self.config('compact_ratio') * self._N:
+            self.compact()
+
+    def compact(self):
+        '''Physically remove tombstoned docids from the postings lists
+        
+        Each postings list that references deleted docids is rewritten
+        once, regardless of how many of its docids were deleted.  Also
+        flushes the write-back buffer.
+        '''
+        self._flush_pending()
+        deleted = self._deleted
+        for tid in self._deleted_terms:
+            postings = self._term_index.get(tid)
+            if postings is None:
+                continue
+            live_postings = self._postings_type(
+                (docid, freq) for (docid, freq) in postings
+                if docid not in deleted
+            )
+            if len(live_postings) == 0:
+                del self._term_index[tid]
+            else:
+                self._term_index[tid] = live_postings
+        
+        self._deleted = DocidBitset()
+        self._deleted_terms = set()
         
     def docid_to_name(self, docid):
         return self._docid_to_name_map[docid]
@@ -194,28 +400,42 @@ class MapSimIndex(SimIndex):
         if self.config('lowercase'):
             term = term.lower()
 
-        return self._term_index.get(term, [])
-        
-    def _query(self, query_vec):
-        '''Finds documents similar to query_vec
-        
-        Params:
-            query_vec: term vector representing query document
-        
-        Returns:
-            A iterable of (docname, score) tuples sorted by score
+        tid = self._term_dict.get_id(term)
+        if tid is None:
+            return []
+        return self._postings(tid)
+
+    def _term_id(self, term):
+        return self._term_dict.get_id(term)
+
+    def _tombstones(self):
+        return self._deleted or None
+
+    def _query_postings(self, tid):
         '''
-        postings_lists = []
-        for term in query_vec:
-            postings_lists.append((term, self.postings_list(term)))
+        Returns postings for term id ``tid``, which may include tombstoned
+        docids.  Queries score these directly, passing the tombstones to
+        the scorer, so pending deletes don't cost a copy per query.
 
-        
-        N = self._global_N or self._N
-        hits = self.query_scorer.score_docs(query_vec=query_vec,
-                                            postings_lists=postings_lists,
-                                            N=N,
-                                            get_doc_freq=self.get_doc_freq,
-                                            get_doc_len=self.get_doc_len)
-        
-        return ((self.docid_to_name(docid), score) for (docid, score) in hits)
+        The result is always of ``postings_type``, so scorers keep their
+        array fast paths.
+        '''
+        postings = self._term_index.get(tid)
+        if postings is None:
+            postings = self._postings_type()
+        pending = self._pending_postings.get(tid)
+        if pending:
+            # pending docids are all newer than the stored ones
+            postings = postings + self._postings_type(pending)
+        return postings
 
+    def _postings(self, tid):
+        '''Returns postings for term id ``tid``, skipping tombstones'''
+        postings = self._query_postings(tid)
+        if tid in self._deleted_terms:
+            deleted = self._deleted
+            postings = self._postings_type(
+                (docid, freq) for (docid, freq) in postings
+                if docid not in deleted
+            )
+        return postings
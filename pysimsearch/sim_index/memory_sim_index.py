@@ -56,6 +56,7 @@ import cPickle as pickle
 from collections import defaultdict
 
 from . import MapSimIndex
+from .postings import PostingsList, CompressedPostingsList
 from pysimsearch.exceptions import *
 
 class MemorySimIndex(MapSimIndex):
@@ -63,10 +64,20 @@ class MemorySimIndex(MapSimIndex):
     Inherits from :class:`pysimsearch.sim_index.MapSimIndex`.
     
     Memory-based implementation of :class:`SimIndex`.  Indexes are backed with
-    ``dict``.
+    ``dict``.  Postings lists are stored as compact
+    :class:`pysimsearch.sim_index.postings.PostingsList` objects rather
+    than lists of tuples, and are appended to in place.
     '''
     
-    def __init__(self):
+    thread_safe_reads = True
+    
+    def __init__(self, compress_postings=False):
+        '''
+        Params:
+            compress_postings: if True, postings lists are stored as
+                               :class:`CompressedPostingsList` objects, which
+                               use less memory but are slower to scan
+        '''
         
         # index metadata
         name_to_docid_map = dict()
@@ -82,6 +93,7 @@ class MemorySimIndex(MapSimIndex):
         # additional stats used for scoring
         df_map = dict()
         doc_len_map = dict()
+        max_score_map = dict()
 
         self._maps = dict(name_to_docid_map=name_to_docid_map,
                           docid_to_name_map=docid_to_name_map,
@@ -89,17 +101,40 @@ class MemorySimIndex(MapSimIndex):
                           term_index=term_index,
                           doc_vectors=doc_vectors,
                           df_map=df_map,
-                          doc_len_map=doc_len_map)
+                          doc_len_map=doc_len_map,
+                          max_score_map=max_score_map)
         
-        super(MemorySimIndex, self).__init__(**self._maps)
+        if compress_postings:
+            postings_type = CompressedPostingsList
+        else:
+            postings_type = PostingsList
+        super(MemorySimIndex, self).__init__(postings_type=postings_type,
+                                             mutable_postings=True,
+                                             **self._maps)
         
     def save(self, file):
         '''Saved index to file'''
-        # pickle won't let us save query_scorer
-        qs = self.query_scorer
-        self.query_scorer = None
+        # pickle won't let us save query_scorer or the query cache's lock
+        (qs, cache) = (self.query_scorer, self._query_cache)
+        (self.query_scorer, self._query_cache) = (None, None)
         pickle.dump(self, file)
-        self.query_scorer = qs
+        (self.query_scorer, self._query_cache) = (qs, cache)
+        
+    def copy(self):
+        '''
+        Returns an independent copy of the index, sharing only the query
+        scorer, the query cache (whose entries are tagged by generation)
+        and the tokenizer pool
+        '''
+        (qs, cache) = (self.query_scorer, self._query_cache)
+        (self.query_scorer, self._query_cache) = (None, None)
+        try:
+            sim_index = pickle.loads(pickle.dumps(self, 2))
+        finally:
+            (self.query_scorer, self._query_cache) = (qs, cache)
+        (sim_index.query_scorer, sim_index._query_cache) = (qs, cache)
+        sim_index._tokenizer = self._tokenizer
+        return sim_index
         
     @staticmethod
     def load(file):
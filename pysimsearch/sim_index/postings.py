@@ -0,0 +1,529 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2011, Taher Haveliwala <oss@taherh.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#         * Redistributions of source code must retain the above copyright
+#           notice, this list of conditions and the following disclaimer.
+#         * Redistributions in binary form must reproduce the above copyright
+#           notice, this list of conditions and the following disclaimer in the
+#           documentation and/or other materials provided with the distribution.
+#         * The names of project contributors may not be used to endorse or
+#           promote products derived from this software without specific
+#           prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+'''
+Postings list representations
+
+A postings list is conceptually a list of (docid, freq) tuples, sorted by
+docid.  Storing it literally as a python list of tuples is simple, but costs
+well over 100 bytes per posting.  :class:`PostingsList` instead keeps the
+docids and frequencies in two parallel ``array('I')`` buffers (8 bytes per
+posting), while still behaving like a sequence of (docid, freq) tuples.
+
+Sample usage::
+
+    from pysimsearch.sim_index.postings import PostingsList
+
+    postings = PostingsList([(0, 2), (3, 1)])
+    postings += [(5, 1)]
+    print(list(postings))   # [(0, 2), (3, 1), (5, 1)]
+
+:class:`CompressedPostingsList` is a drop-in alternative that encodes
+postings in blocks of delta-gap docids and frequencies as variable-byte
+integers, which typically takes 2-3 bytes per posting.
+
+:class:`MappedPostingsList` is a read-only postings list over packed
+little-endian docids and freqs in a buffer (e.g., a memory-mapped segment),
+which consumers such as the numpy scorer can read without copying.
+
+:class:`DocidBitset` is a compact set of docids, used for tombstones.
+
+'''
+
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+
+from array import array
+from itertools import izip
+import struct
+import sys
+
+# array() requires a native str typecode under python 2
+DOCID_TYPECODE = str('I')
+FREQ_TYPECODE = str('I')
+
+BIG_ENDIAN = (sys.byteorder == 'big')
+
+def to_le_bytes(a):
+    '''Returns contents of array ``a`` as little-endian bytes'''
+    if BIG_ENDIAN:
+        a = array(a.typecode, a)
+        a.byteswap()
+    return a.tostring()
+
+def from_le_bytes(typecode, data):
+    '''Returns array of type ``typecode`` decoded from little-endian bytes'''
+    a = array(typecode)
+    a.fromstring(bytes(data))
+    if BIG_ENDIAN:
+        a.byteswap()
+    return a
+
+def pack_postings(postings):
+    '''
+    Returns postings (a :class:`PostingsList` or iterable of (docid, freq)
+    tuples) packed as little-endian uint32 docids followed by freqs
+    '''
+    if not isinstance(postings, PostingsList):
+        postings = PostingsList(postings)
+    return to_le_bytes(postings.docids) + to_le_bytes(postings.freqs)
+
+def unpack_postings(data):
+    '''Returns :class:`PostingsList` decoded from :func:`pack_postings` output'''
+    data = bytes(data)
+    half = len(data) // 2
+    postings = PostingsList()
+    postings.docids = from_le_bytes(DOCID_TYPECODE, data[:half])
+    postings.freqs = from_le_bytes(FREQ_TYPECODE, data[half:])
+    return postings
+
+class PostingsList(object):
+    '''
+    Compact postings list backed by parallel ``array`` buffers.
+
+    Iterating yields (docid, freq) tuples, so a ``PostingsList`` can be used
+    anywhere a list of postings tuples is expected (e.g., by
+    :meth:`QueryScorer.score_docs()`).  Docids and frequencies must be
+    non-negative integers that fit in a C ``unsigned int``.
+
+    Instance Attributes:
+        docids: ``array('I')`` of docids
+        freqs: ``array('I')`` of term frequencies, parallel to ``docids``
+    '''
+
+    __slots__ = ('docids', 'freqs')
+
+    def __init__(self, postings=()):
+        '''Initialize with ``postings``, an iterable of (docid, freq) tuples'''
+        self.docids = array(DOCID_TYPECODE)
+        self.freqs = array(FREQ_TYPECODE)
+        self.extend(postings)
+
+    def append(self, posting):
+        '''Append a single (docid, freq) tuple'''
+        (docid, freq) = posting
+        self.docids.append(docid)
+        self.freqs.append(freq)
+
+    def extend(self, postings):
+        '''Append an iterable of (docid, freq) tuples'''
+        if isinstance(postings, (PostingsList, MappedPostingsList)):
+            self.docids.extend(postings.docids)
+            self.freqs.extend(postings.freqs)
+        else:
+            for (docid, freq) in postings:
+                self.docids.append(docid)
+                self.freqs.append(freq)
+
+    def __len__(self):
+        return len(self.docids)
+
+    def __iter__(self):
+        return izip(self.docids, self.freqs)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            sliced = PostingsList()
+            sliced.docids = self.docids[i]
+            sliced.freqs = self.freqs[i]
+            return sliced
+        return (self.docids[i], self.freqs[i])
+
+    def __add__(self, other):
+        result = PostingsList(self)
+        result.extend(other)
+        return result
+
+    def __iadd__(self, other):
+        self.extend(other)
+        return self
+
+    def __eq__(self, other):
+        try:
+            return list(self) == list(other)
+        except TypeError:
+            return NotImplemented
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    def __repr__(self):
+        return 'PostingsList({!r})'.format(list(self))
+
+    # __slots__ classes need explicit pickle support
+    def __getstate__(self):
+        return (self.docids.tostring(), self.freqs.tostring())
+
+    def __setstate__(self, state):
+        (docids, freqs) = state
+        self.docids = array(DOCID_TYPECODE)
+        self.docids.fromstring(docids)
+        self.freqs = array(FREQ_TYPECODE)
+        self.freqs.fromstring(freqs)
+
+# number of postings per CompressedPostingsList block
+POSTINGS_BLOCK_SIZE = 128
+
+# num postings, num blocks
+_COMPRESSED_HEADER = struct.Struct(str('<II'))
+
+def encode_varints(values, out):
+    '''Appends non-negative ints in ``values`` to bytearray ``out`` as varints'''
+    for value in values:
+        while value >= 0x80:
+            out.append((value & 0x7f) | 0x80)
+            value >>= 7
+        out.append(value)
+
+def decode_varints(data, pos, count, out):
+    '''
+    Appends ``count`` varints decoded from bytearray ``data`` starting at
+    ``pos`` to ``out``, and returns the position following them.
+    '''
+    for i in xrange(count):
+        value = 0
+        shift = 0
+        byte = data[pos]
+        while byte >= 0x80:
+            value |= (byte & 0x7f) << shift
+            shift += 7
+            pos += 1
+            byte = data[pos]
+        out.append(value | (byte << shift))
+        pos += 1
+    return pos
+
+class CompressedPostingsList(object):
+    '''
+    Compressed postings list, which can be used in place of
+    :class:`PostingsList`.
+    
+    Postings are grouped into blocks of ``POSTINGS_BLOCK_SIZE``.  Each full
+    block is stored as varint-encoded docid gaps (relative to the last docid
+    of the previous block) followed by varint-encoded freqs, and the last
+    docid and byte offset of each block are kept uncompressed, so blocks can
+    be decoded (or skipped) independently.  Postings are appended to an
+    uncompressed tail block, which is encoded once it fills up.
+    
+    Iteration decodes one block at a time.  Docids must be appended in
+    increasing order.
+    '''
+
+    __slots__ = ('_data', '_block_last', '_block_offsets', '_tail')
+
+    def __init__(self, postings=()):
+        '''Initialize with ``postings``, an iterable of (docid, freq) tuples'''
+        self._data = bytearray()
+        self._block_last = array(DOCID_TYPECODE)
+        self._block_offsets = array(str('I'))
+        self._tail = PostingsList()
+        self.extend(postings)
+
+    def append(self, posting):
+        '''Append a single (docid, freq) tuple'''
+        self._tail.append(posting)
+        if len(self._tail) == POSTINGS_BLOCK_SIZE:
+            self._encode_tail()
+
+    def extend(self, postings):
+        '''Append an iterable of (docid, freq) tuples'''
+        for posting in postings:
+            self.append(posting)
+
+    def _encode_tail(self):
+        '''Encodes the tail as a new block'''
+        tail = self._tail
+        prev = self._block_last[-1] if self._block_last else 0
+        gaps = []
+        for docid in tail.docids:
+            gaps.append(docid - prev)
+            prev = docid
+        self._block_offsets.append(len(self._data))
+        encode_varints(gaps, self._data)
+        encode_varints(tail.freqs, self._data)
+        self._block_last.append(prev)
+        self._tail = PostingsList()
+
+    def num_blocks(self):
+        '''Returns number of blocks, including the tail'''
+        return len(self._block_last) + (1 if self._tail else 0)
+
+    def block(self, i):
+        '''Returns the ``i``-th block decoded as a :class:`PostingsList`'''
+        if i == len(self._block_last):
+            return self._tail
+        block = PostingsList()
+        pos = decode_varints(self._data, self._block_offsets[i],
+                             POSTINGS_BLOCK_SIZE, block.docids)
+        decode_varints(self._data, pos, POSTINGS_BLOCK_SIZE, block.freqs)
+        docids = block.docids
+        docid = self._block_last[i - 1] if i else 0
+        for j in xrange(len(docids)):
+            docid += docids[j]
+            docids[j] = docid
+        return block
+
+    def decode(self):
+        '''Returns all postings decoded as a :class:`PostingsList`'''
+        postings = PostingsList()
+        for i in xrange(self.num_blocks()):
+            postings.extend(self.block(i))
+        return postings
+
+    def __len__(self):
+        return len(self._block_last) * POSTINGS_BLOCK_SIZE + len(self._tail)
+
+    def __iter__(self):
+        for i in xrange(self.num_blocks()):
+            for posting in self.block(i):
+                yield posting
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return CompressedPostingsList(self.decode()[i])
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('index out of range')
+        return self.block(i // POSTINGS_BLOCK_SIZE)[i % POSTINGS_BLOCK_SIZE]
+
+    def __add__(self, other):
+        result = CompressedPostingsList()
+        result._data = bytearray(self._data)
+        result._block_last = array(DOCID_TYPECODE, self._block_last)
+        result._block_offsets = array(str('I'), self._block_offsets)
+        result._tail = PostingsList(self._tail)
+        result.extend(other)
+        return result
+
+    def __iadd__(self, other):
+        self.extend(other)
+        return self
+
+    def __eq__(self, other):
+        try:
+            return list(self) == list(other)
+        except TypeError:
+            return NotImplemented
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    def __repr__(self):
+        return 'CompressedPostingsList({!r})'.format(list(self))
+
+    def tobytes(self):
+        '''
+        Returns postings serialized as a little-endian byte string: a
+        header, the last docid and offset of each block, and the encoded
+        blocks.  The tail is encoded as a final, possibly partial, block.
+        '''
+        postings = self
+        if self._tail:
+            postings = self + ()
+            postings._encode_tail()
+        return b''.join((
+            _COMPRESSED_HEADER.pack(len(self), len(postings._block_last)),
+            to_le_bytes(postings._block_last),
+            to_le_bytes(postings._block_offsets),
+            bytes(postings._data)))
+
+    @staticmethod
+    def frombytes(data):
+        '''Returns :class:`CompressedPostingsList` read from :meth:`tobytes()`'''
+        postings = CompressedPostingsList()
+        postings._load(bytes(data))
+        return postings
+
+    def _load(self, data):
+        (num_postings, num_blocks) = _COMPRESSED_HEADER.unpack_from(data)
+        pos = _COMPRESSED_HEADER.size
+        self._block_last = from_le_bytes(DOCID_TYPECODE,
+                                         data[pos:pos + 4 * num_blocks])
+        pos += 4 * num_blocks
+        self._block_offsets = from_le_bytes(str('I'),
+                                            data[pos:pos + 4 * num_blocks])
+        pos += 4 * num_blocks
+        self._data = bytearray(data[pos:])
+        self._tail = PostingsList()
+        
+        # decode a partial last block into the tail
+        tail_len = num_postings - (num_blocks - 1) * POSTINGS_BLOCK_SIZE
+        if num_blocks and tail_len < POSTINGS_BLOCK_SIZE:
+            tail = PostingsList()
+            start = self._block_offsets.pop()
+            pos = decode_varints(self._data, start, tail_len, tail.docids)
+            decode_varints(self._data, pos, tail_len, tail.freqs)
+            self._block_last.pop()
+            docid = self._block_last[-1] if self._block_last else 0
+            for j in xrange(tail_len):
+                docid += tail.docids[j]
+                tail.docids[j] = docid
+            del self._data[start:]
+            self._tail = tail
+
+    def __getstate__(self):
+        return self.tobytes()
+
+    def __setstate__(self, state):
+        self._load(state)
+
+class MappedPostingsList(object):
+    '''
+    Read-only postings list over ``count`` little-endian uint32 docids
+    followed by ``count`` uint32 freqs, at ``offset`` in buffer ``buf``
+    
+    Nothing is copied until the postings are read from python:
+    :meth:`buffer_info()` gives consumers that can read the buffer directly
+    (e.g., with ``numpy.frombuffer()``) zero-copy access, while ``docids``
+    and ``freqs`` are decoded into arrays on first use.
+    '''
+
+    __slots__ = ('_buf', '_offset', '_count', '_docids', '_freqs')
+
+    def __init__(self, buf, offset, count):
+        self._buf = buf
+        self._offset = offset
+        self._count = count
+        self._docids = None
+        self._freqs = None
+
+    def buffer_info(self):
+        '''Returns (buf, offset, count)'''
+        return (self._buf, self._offset, self._count)
+
+    @property
+    def docids(self):
+        if self._docids is None:
+            start = self._offset
+            self._docids = from_le_bytes(
+                DOCID_TYPECODE, self._buf[start:start + 4 * self._count])
+        return self._docids
+
+    @property
+    def freqs(self):
+        if self._freqs is None:
+            start = self._offset + 4 * self._count
+            self._freqs = from_le_bytes(
+                FREQ_TYPECODE, self._buf[start:start + 4 * self._count])
+        return self._freqs
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        return izip(self.docids, self.freqs)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            sliced = PostingsList()
+            sliced.docids = self.docids[i]
+            sliced.freqs = self.freqs[i]
+            return sliced
+        return (self.docids[i], self.freqs[i])
+
+    def __add__(self, other):
+        result = PostingsList(self)
+        result.extend(other)
+        return result
+
+    def __eq__(self, other):
+        try:
+            return list(self) == list(other)
+        except TypeError:
+            return NotImplemented
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    def __repr__(self):
+        return 'MappedPostingsList({!r})'.format(list(self))
+
+# compact postings list types, which rpc layers materialize as lists
+POSTINGS_LIST_TYPES = (PostingsList, CompressedPostingsList,
+                       MappedPostingsList)
+
+class DocidBitset(object):
+    '''
+    Compact set of non-negative integer docids, backed by a ``bytearray``
+    with one bit per docid.
+    
+    Used to record tombstones for deleted documents, since docids are
+    assigned densely.
+    '''
+
+    def __init__(self, docids=()):
+        self._bits = bytearray()
+        self._count = 0
+        for docid in docids:
+            self.add(docid)
+
+    def add(self, docid):
+        (byte, mask) = (docid >> 3, 1 << (docid & 7))
+        if byte >= len(self._bits):
+            self._bits.extend(bytearray(byte + 1 - len(self._bits)))
+        if not self._bits[byte] & mask:
+            self._bits[byte] |= mask
+            self._count += 1
+
+    def discard(self, docid):
+        if docid in self:
+            self._bits[docid >> 3] &= ~(1 << (docid & 7))
+            self._count -= 1
+
+    def clear(self):
+        self._bits = bytearray()
+        self._count = 0
+
+    def __contains__(self, docid):
+        byte = docid >> 3
+        return byte < len(self._bits) and bool(self._bits[byte] & (1 << (docid & 7)))
+
+    def __len__(self):
+        return self._count
+
+    def bitmap(self):
+        '''
+        Returns the backing ``bytearray``, in which bit ``docid & 7`` of
+        byte ``docid >> 3`` is set for each docid.  Must not be modified.
+        '''
+        return self._bits
+
+    def __iter__(self):
+        for (byte, bits) in enumerate(self._bits):
+            if bits:
+                for bit in range(8):
+                    if bits & (1 << bit):
+                        yield (byte << 3) | bit
+
+    def __repr__(self):
+        return 'DocidBitset({!r})'.format(list(self))
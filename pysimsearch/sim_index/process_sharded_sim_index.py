@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2011, Taher Haveliwala <oss@taherh.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#         * Redistributions of source code must retain the above copyright
+#           notice, this list of conditions and the following disclaimer.
+#         * Redistributions in binary form must reproduce the above copyright
+#           notice, this list of conditions and the following disclaimer in the
+#           documentation and/or other materials provided with the distribution.
+#         * The names of project contributors may not be used to endorse or
+#           promote products derived from this software without specific
+#           prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+'''
+ProcessShardedSimIndex
+
+A :class:`SimIndexCollection` whose shards are :class:`ProcessSimIndex`
+workers, for using several cores on a single machine.
+
+Sample usage::
+
+    from pprint import pprint
+    from pysimsearch.sim_index import ProcessShardedSimIndex
+
+    index = ProcessShardedSimIndex(num_shards=4)
+    index.set_query_scorer('tfidf')
+    index.index_urls('http://www.stanford.edu/',
+                     'http://www.berkeley.edu',
+                     'http://www.ucla.edu',
+                     'http://www.mit.edu')
+    pprint(index.query('stanford university'))
+    index.close()
+
+'''
+
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+
+import multiprocessing
+
+from .memory_sim_index import MemorySimIndex
+from .process_sim_index import ProcessSimIndex
+from .sim_index_collection import SimIndexCollection
+
+class ProcessShardedSimIndex(SimIndexCollection):
+    '''
+    Inherits from :class:`pysimsearch.sim_index.SimIndexCollection`.
+    
+    Documents are sharded across ``num_shards`` worker processes, each
+    holding its own index (a :class:`MemorySimIndex`, by default).  Since
+    scoring happens in the workers, queries aren't limited by the GIL of
+    the calling process.  Queries are scattered to all workers before any
+    results are gathered, and global term stats are maintained as for any
+    other :class:`SimIndexCollection`.
+    
+    Call :meth:`close()` to shut down the workers.
+    '''
+    
+    def __init__(self, num_shards=None, factory=MemorySimIndex, root=True):
+        '''
+        Params:
+            num_shards: number of worker processes (by default, the number
+                        of cpus)
+            factory: callable that returns the :class:`SimIndex` for a shard
+            root: True if this is the root of a collection tree
+        '''
+        super(ProcessShardedSimIndex, self).__init__(root=root)
+        if num_shards is None:
+            num_shards = multiprocessing.cpu_count()
+        self.add_shards(*[ProcessSimIndex(factory)
+                          for i in range(num_shards)])
+        
+    def close(self):
+        '''Shuts down the worker processes'''
+        for shard in self._shards:
+            shard.close()
+        self.clear_shards()
+        
+    def _query(self, query_vec, k=None):
+        '''Scatters query to all shards and returns merged results'''
+        return self._merge_hits(
+            ProcessSimIndex.scatter(self._shards, 'query', query_vec, k), k)
+
+    def _query_many(self, query_vecs, k=None):
+        '''Scatters a batch of queries to all shards, and merges results'''
+        shard_results = ProcessSimIndex.scatter(self._shards, 'query_many',
+                                                query_vecs, k)
+        return [self._merge_hits([shard_result[i]
+                                  for shard_result in shard_results], k)
+                for i in range(len(query_vecs))]
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2011, Taher Haveliwala <oss@taherh.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#         * Redistributions of source code must retain the above copyright
+#           notice, this list of conditions and the following disclaimer.
+#         * Redistributions in binary form must reproduce the above copyright
+#           notice, this list of conditions and the following disclaimer in the
+#           documentation and/or other materials provided with the distribution.
+#         * The names of project contributors may not be used to endorse or
+#           promote products derived from this software without specific
+#           prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+'''
+ProcessSimIndex
+
+Proxy to a :class:`SimIndex` running in a child process.  Requests and
+results are sent over a ``multiprocessing`` pipe, so scoring happens
+outside of the calling process (and its GIL).
+
+Sample usage::
+
+    from pysimsearch.sim_index import ProcessSimIndex
+
+    index = ProcessSimIndex()  # MemorySimIndex in a worker process
+    index.set_query_scorer('tfidf')
+    index.index_string_buffers([('doc1', 'hello there'),
+                                ('doc2', 'hello world')])
+    print(index.query('hello'))
+    index.close()
+
+'''
+
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+
+import multiprocessing
+import threading
+import types
+
+from . import SimIndex
+from .memory_sim_index import MemorySimIndex
+from .postings import POSTINGS_LIST_TYPES
+
+def _serve(conn, factory):
+    '''Worker process loop: applies requests received on ``conn``'''
+    sim_index = factory()
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+        (name, args, kwargs) = request
+        try:
+            r = getattr(sim_index, name)(*args, **kwargs)
+            # materialize generators (and compact postings lists), as
+            # sim_server does, so they can be pickled
+            if isinstance(r, (types.GeneratorType,) + POSTINGS_LIST_TYPES):
+                r = list(r)
+            reply = (True, r)
+        except Exception as e:
+            reply = (False, e)
+        try:
+            conn.send(reply)
+        except Exception as e:
+            # e.g., an exception that can't be pickled
+            conn.send((False, Exception(repr(reply[1]))))
+
+class ProcessSimIndex(object):
+    '''Proxy to a :class:`pysimsearch.sim_index.SimIndex` in a child process
+    
+    Like :class:`RemoteSimIndex`, ``ProcessSimIndex`` is compatible with
+    the :class:`SimIndex` interface, and arguments and return values must
+    be picklable, so e.g., query scorers must be given by name.  Calls
+    through a ``ProcessSimIndex`` are serialized, but different
+    ``ProcessSimIndex`` instances run in parallel.  See
+    :meth:`scatter()` for issuing a call to several at once.
+    '''
+    
+    thread_safe_reads = True
+    
+    def __init__(self, factory=MemorySimIndex):
+        '''Start a worker process holding ``factory()``
+        
+        Params:
+            factory: callable that returns the :class:`SimIndex` to serve
+        '''
+        (self._conn, child_conn) = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=_serve,
+                                                args=(child_conn, factory))
+        self._process.daemon = True
+        self._process.start()
+        child_conn.close()
+        self._lock = threading.Lock()
+        
+    def close(self):
+        '''Shuts down the worker process'''
+        with self._lock:
+            if self._process is not None:
+                self._conn.send(None)
+                self._process.join()
+                self._conn.close()
+                self._process = None
+            
+    def _send(self, name, args, kwargs):
+        if self._process is None:
+            raise Exception('ProcessSimIndex is closed')
+        self._conn.send((name, args, kwargs))
+        
+    def _recv(self):
+        '''Returns (ok, value) reply to the last request'''
+        return self._conn.recv()
+    
+    def _call(self, name, args, kwargs):
+        with self._lock:
+            self._send(name, args, kwargs)
+            (ok, value) = self._recv()
+        if not ok:
+            raise value
+        return value
+        
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        def func(*args, **kwargs):
+            return self._call(name, args, kwargs)
+        return func
+    
+    @staticmethod
+    def scatter(proxies, name, *args, **kwargs):
+        '''
+        Calls method ``name`` on each of ``proxies`` concurrently
+        
+        The request is sent to every worker before any reply is read, so
+        the workers run in parallel.
+        
+        Returns:
+            list of return values, in the order of ``proxies``.  If any
+            call raised, the first such exception is raised instead.
+        '''
+        # lock in list order, so concurrent scatters can't deadlock
+        locked = []
+        sent = []
+        try:
+            for proxy in proxies:
+                proxy._lock.acquire()
+                locked.append(proxy)
+            try:
+                for proxy in proxies:
+                    proxy._send(name, args, kwargs)
+                    sent.append(proxy)
+            finally:
+                # always read the replies we're owed, to keep the pipes
+                # in sync
+                replies = [proxy._recv() for proxy in sent]
+        finally:
+            for proxy in locked:
+                proxy._lock.release()
+        for (ok, value) in replies:
+            if not ok:
+                raise value
+        return [value for (ok, value) in replies]
+
+# ProcessSimIndex is a subtype of SimIndex
+SimIndex.register(ProcessSimIndex)
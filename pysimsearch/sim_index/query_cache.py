@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2011, Taher Haveliwala <oss@taherh.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#         * Redistributions of source code must retain the above copyright
+#           notice, this list of conditions and the following disclaimer.
+#         * Redistributions in binary form must reproduce the above copyright
+#           notice, this list of conditions and the following disclaimer in the
+#           documentation and/or other materials provided with the distribution.
+#         * The names of project contributors may not be used to endorse or
+#           promote products derived from this software without specific
+#           prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+'''
+LRU cache for query results
+
+:class:`QueryCache` holds the results of recent queries, keyed on the
+normalized query vector, the scorer name and ``k``.  Each
+:class:`pysimsearch.sim_index.SimIndex` keeps a generation counter that is
+bumped by any call that can change query results (e.g., ``index_files()``,
+``del_docids()``, ``set_query_scorer()``); the cache is emptied whenever it
+sees a newer generation, so stale results are never returned.
+
+Caching is off by default.  Sample usage::
+
+    from pysimsearch.sim_index import MemorySimIndex
+
+    index = MemorySimIndex()
+    index.enable_query_cache(max_entries=10000, max_bytes=64 * 2**20)
+    index.index_urls('http://www.stanford.edu/', 'http://www.berkeley.edu')
+    print(list(index.query('stanford')))   # miss
+    print(list(index.query('Stanford')))   # hit
+    print(index.query_cache_stats())
+
+'''
+
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+
+from collections import OrderedDict
+import sys
+import threading
+
+class QueryCache(object):
+    '''
+    LRU cache of query results, bounded by number of entries and
+    (optionally) by approximate memory use.
+    
+    Thread-safe, so that a cache may be shared by concurrent readers (e.g.,
+    under :class:`pysimsearch.sim_index.ConcurrentSimIndex`).
+    
+    Instance Attributes:
+        max_entries: maximum number of cached queries
+        max_bytes: if not None, bound on approximate memory used by
+                   cached keys and results
+        hits, misses, evictions, invalidations: counters
+    '''
+
+    def __init__(self, max_entries=1024, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (results, size), in LRU order
+        self._bytes = 0
+        self._generation = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(query_vec, scorer_name, k, lowercase=True):
+        '''
+        Returns cache key for query_vec.  Terms are case-folded if
+        ``lowercase`` is set, duplicate terms are merged, and terms with
+        zero weight are dropped, so that equivalent queries share a key.
+        '''
+        weights = {}
+        for (term, weight) in query_vec.iteritems():
+            if lowercase:
+                term = term.lower()
+            weights[term] = weights.get(term, 0) + weight
+        terms = tuple(sorted((term, weight)
+                             for (term, weight) in weights.iteritems()
+                             if weight))
+        return (terms, scorer_name, k)
+
+    def get(self, key, generation):
+        '''Returns cached results for key, or None on a miss'''
+        with self._lock:
+            self._check_generation(generation)
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries[key] = entry  # move to most-recently-used end
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, results, generation):
+        '''
+        Caches results (a list of (docname, score) tuples) for key.
+        Results computed for an older generation are discarded.
+        '''
+        with self._lock:
+            if self._generation is not None and generation < self._generation:
+                return
+            self._check_generation(generation)
+            size = self._entry_size(key, results)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (results, size)
+            self._bytes += size
+            while (len(self._entries) > self.max_entries or
+                   (self.max_bytes is not None and self._bytes > self.max_bytes)):
+                (_, (_, evicted_size)) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        '''Drops all cached results'''
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        '''Returns dict of cache counters and current size'''
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'invalidations': self.invalidations,
+                    'entries': len(self._entries),
+                    'bytes': self._bytes}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _check_generation(self, generation):
+        '''Empties cache if index has changed since entries were cached'''
+        if generation != self._generation:
+            if self._entries:
+                self.invalidations += 1
+                self._entries.clear()
+                self._bytes = 0
+            self._generation = generation
+
+    @staticmethod
+    def _entry_size(key, results):
+        '''Returns approximate bytes used by a cache entry'''
+        (terms, scorer_name, k) = key
+        size = sys.getsizeof(key) + sys.getsizeof(terms)
+        for (term, weight) in terms:
+            size += sys.getsizeof(term) + sys.getsizeof(weight)
+        size += sys.getsizeof(results)
+        for (name, score) in results:
+            size += sys.getsizeof(name) + sys.getsizeof(score)
+        # results are tuples, or lists when returned over rpc
+        if results:
+            size += len(results) * sys.getsizeof(results[0])
+        return size
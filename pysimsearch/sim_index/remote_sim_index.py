@@ -55,11 +55,25 @@ Sample usage:
 from __future__ import (division, absolute_import, print_function,
                         unicode_literals)
 
+import threading
+
 import jsonrpclib as rpclib
 #import xmlrpclib as rpclib
 
 from . import SimIndex
 
+class _TimeoutTransport(rpclib.jsonrpc.Transport):
+    '''jsonrpclib transport whose connections time out after ``timeout`` secs'''
+    
+    def __init__(self, timeout):
+        rpclib.jsonrpc.Transport.__init__(self)
+        self.timeout = timeout
+        
+    def make_connection(self, host):
+        connection = rpclib.jsonrpc.Transport.make_connection(self, host)
+        connection.timeout = self.timeout
+        return connection
+
 class RemoteSimIndex(object):
     '''Proxy to a remote :class:`pysimsearch.sim_index.SimIndex`
     
@@ -74,22 +88,53 @@ class RemoteSimIndex(object):
     >>> remote_index.query('university')
     ...
     
+    Each thread gets its own connection to the server, so a
+    ``RemoteSimIndex`` may be shared by threads.
     '''
     
-    def __init__(self, server_url):
+    thread_safe_reads = True
+    
+    # rpcs that ``query_timeout`` applies to
+    QUERY_METHODS = ('query', 'query_with_status', 'query_many')
+    
+    def __init__(self, server_url, query_timeout=None):
         '''Initialize with server_url
         
         Params:
             server_url: url for remote ``SimIndex`` server
+            query_timeout: if given, query rpcs that take longer than
+                           ``query_timeout`` seconds raise
+                           ``socket.timeout``.  Other rpcs never time out,
+                           since an update could be applied remotely even
+                           though the call failed.
         '''
         from .. import sim_server
         self.PREFIX = sim_server.SimIndexService.PREFIX
         self.EXPORTED_METHODS = sim_server.SimIndexService.EXPORTED_METHODS
-        self._server = rpclib.Server(server_url)
+        self._server_url = server_url
+        self._query_timeout = query_timeout
+        self._local = threading.local()
+        
+    def _server(self, timed=False):
+        '''Returns this thread's server proxy
+        
+        If ``timed`` is True, the proxy's rpcs time out after
+        ``query_timeout`` seconds.
+        '''
+        timed = timed and self._query_timeout is not None
+        attr = 'timed_server' if timed else 'server'
+        server = getattr(self._local, attr, None)
+        if server is None:
+            transport = None
+            if timed:
+                transport = _TimeoutTransport(self._query_timeout)
+            server = rpclib.Server(self._server_url, transport=transport)
+            setattr(self._local, attr, server)
+        return server
         
     def __getattr__(self, name):
         if name in self.EXPORTED_METHODS:
-            func = getattr(self._server,
+            func = getattr(self._server(timed=name in self.QUERY_METHODS),
                            self.PREFIX + '.' + name)
             return func
         else:
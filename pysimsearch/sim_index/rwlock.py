@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2011, Taher Haveliwala <oss@taherh.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#         * Redistributions of source code must retain the above copyright
+#           notice, this list of conditions and the following disclaimer.
+#         * Redistributions in binary form must reproduce the above copyright
+#           notice, this list of conditions and the following disclaimer in the
+#           documentation and/or other materials provided with the distribution.
+#         * The names of project contributors may not be used to endorse or
+#           promote products derived from this software without specific
+#           prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+'''
+Reader-writer lock
+
+Sample usage::
+
+    from pysimsearch.sim_index.rwlock import RWLock
+
+    lock = RWLock()
+    with lock.read_locked():
+        ...  # any number of readers may hold the lock at once
+    with lock.write_locked():
+        ...  # writers have exclusive access
+
+'''
+
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+
+from contextlib import contextmanager
+import threading
+
+class RWLock(object):
+    '''
+    Writer-preferring reader-writer lock.
+    
+    Any number of threads may hold the read lock at once, while the write
+    lock is exclusive.  Once a writer is waiting, new readers wait behind
+    it, so a steady stream of queries can't starve updates.
+    
+    Both locks are reentrant: a thread holding the read lock (or the write
+    lock) may acquire the read lock again, and a thread holding the write
+    lock may acquire it again.  Upgrading a read lock to a write lock would
+    deadlock, and raises ``RuntimeError``.
+    '''
+    
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = {}  # thread id -> read lock count
+        self._writer = None  # thread id of writer
+        self._write_count = 0
+        self._waiting_writers = 0
+        
+    def acquire_read(self):
+        me = threading.current_thread().ident
+        with self._cond:
+            if self._writer != me and me not in self._readers:
+                while self._writer is not None or self._waiting_writers:
+                    self._cond.wait()
+            self._readers[me] = self._readers.get(me, 0) + 1
+            
+    def release_read(self):
+        me = threading.current_thread().ident
+        with self._cond:
+            count = self._readers[me] - 1
+            if count:
+                self._readers[me] = count
+            else:
+                del self._readers[me]
+                if not self._readers:
+                    self._cond.notify_all()
+                    
+    def acquire_write(self):
+        me = threading.current_thread().ident
+        with self._cond:
+            if self._writer == me:
+                self._write_count += 1
+                return
+            if me in self._readers:
+                raise RuntimeError('cannot upgrade a read lock to a write lock')
+            self._waiting_writers += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = me
+            self._write_count = 1
+            
+    def release_write(self):
+        with self._cond:
+            if self._writer != threading.current_thread().ident:
+                raise RuntimeError('write lock is not held by this thread')
+            self._write_count -= 1
+            if not self._write_count:
+                self._writer = None
+                self._cond.notify_all()
+                
+    @contextmanager
+    def read_locked(self):
+        '''Context manager that holds the read lock'''
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+            
+    @contextmanager
+    def write_locked(self):
+        '''Context manager that holds the write lock'''
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2011, Taher Haveliwala <oss@taherh.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#         * Redistributions of source code must retain the above copyright
+#           notice, this list of conditions and the following disclaimer.
+#         * Redistributions in binary form must reproduce the above copyright
+#           notice, this list of conditions and the following disclaimer in the
+#           documentation and/or other materials provided with the distribution.
+#         * The names of project contributors may not be used to endorse or
+#           promote products derived from this software without specific
+#           prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+'''
+Immutable on-disk segment format
+
+A segment is a versioned, little-endian binary file holding a complete,
+read-only index.  It is laid out so that it can be ``mmap``-ed and queried
+in place (see :class:`pysimsearch.sim_index.SegmentSimIndex`), without
+unpickling or building any per-term python objects at startup.
+
+Layout (all sections start on an 8-byte boundary)::
+
+    header        magic, version, postings codec, counts and section offsets
+    postings      per term: docids as uint32[df], then freqs as uint32[df]
+                  (or, with the varint codec, the term's postings as
+                  serialized by CompressedPostingsList.tobytes())
+    term table    fixed-size entries sorted by utf-8 term bytes (see
+                  TERM_ENTRY), so terms can be found by binary search
+    term strings  utf-8 term bytes referenced by the term table
+    docids        uint32[num_docs] of live docids, ascending
+    doc lengths   float64[docid_limit], indexed by docid (0 if absent)
+    name offsets  uint64[num_docs + 1] into the names section, parallel
+                  to docids
+    name order    uint32[num_docs] of positions in docids, sorted by name
+    names         utf-8 document names
+    config        json-encoded index config (e.g., stoplist)
+
+Sample usage::
+
+    from pysimsearch.sim_index import MemorySimIndex, SegmentSimIndex
+    from pysimsearch.sim_index.segment import write_segment
+
+    sim_index = MemorySimIndex()
+    sim_index.index_urls('http://www.stanford.edu/', 'http://www.berkeley.edu')
+    with open('myindex.seg', 'wb') as segment_file:
+        write_segment(sim_index, segment_file)
+
+    segment_index = SegmentSimIndex('myindex.seg')
+    print(list(segment_index.query('stanford')))
+
+'''
+
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+
+from array import array
+import json
+import struct
+
+from .postings import (PostingsList, CompressedPostingsList, DOCID_TYPECODE,
+                       FREQ_TYPECODE, to_le_bytes, from_le_bytes)
+
+SEGMENT_MAGIC = b'PSSEGMNT'
+SEGMENT_VERSION = 1
+
+# postings codecs: raw uint32 arrays, or CompressedPostingsList.tobytes()
+CODEC_RAW = 0
+CODEC_VARINT = 1
+
+# magic, version, codec, num_terms, num_docs, docid_limit, followed by
+# section offsets: postings, term table, term strings, docids, doc lengths,
+# name offsets, name order, names, config; and the config length
+HEADER = struct.Struct(str('<8sIIQQQ10Q'))
+HEADER_SIZE = 128
+
+# term string offset, postings offset, postings bytes, term string length,
+# df, max score (upper bound on freq/doc_len over the postings)
+TERM_ENTRY = struct.Struct(str('<QQQIId'))
+
+UINT32 = struct.Struct(str('<I'))
+UINT64 = struct.Struct(str('<Q'))
+FLOAT64 = struct.Struct(str('<d'))
+
+class SegmentWriter(object):
+    '''
+    Streams an index out in the segment format.
+    
+    Postings are written as soon as each term is added, so only the
+    (fixed-size) term table and the document table are held in memory.
+    Terms must be added in ascending order of their utf-8 bytes.  The
+    header is written last, so ``file`` must be seekable.
+    
+    For indexes that don't fit in memory, postings may be streamed out with
+    :meth:`add_term_chunks()`, and the document table passed to
+    :meth:`finish()` as streams of sections (see
+    :class:`pysimsearch.sim_index.segment_builder.SegmentBuilder`).
+    '''
+    
+    def __init__(self, file, config=None, codec=CODEC_RAW):
+        '''
+        Params:
+            file: binary file object to write the segment to
+            config: index config to store with the segment
+            codec: postings codec, ``CODEC_RAW`` or ``CODEC_VARINT``
+        '''
+        if codec not in (CODEC_RAW, CODEC_VARINT):
+            raise ValueError('Unsupported postings codec: {}'.format(codec))
+        self._file = file
+        self._config = config or {}
+        self._codec = codec
+        self._offset = 0
+        self._write(b'\0' * HEADER_SIZE)
+        
+        self._term_entries = bytearray()
+        self._term_strings = bytearray()
+        self._num_terms = 0
+        self._last_term = None
+        self._docs = []  # (docid, name bytes, doc_len) tuples
+        
+    def add_term(self, term, postings, max_score=0.0):
+        '''Writes postings for term
+        
+        Params:
+            term: unicode term
+            postings: :class:`PostingsList` or iterable of (docid, freq)
+                      tuples, sorted by docid
+            max_score: upper bound on ``freq / doc_len`` over the postings
+        '''
+        term_bytes = self._check_term(term)
+        postings_offset = self._offset
+        if self._codec == CODEC_VARINT:
+            if not isinstance(postings, CompressedPostingsList):
+                postings = CompressedPostingsList(postings)
+            self._write(postings.tobytes())
+        else:
+            if not isinstance(postings, PostingsList):
+                postings = PostingsList(postings)
+            self._write(to_le_bytes(postings.docids))
+            self._write(to_le_bytes(postings.freqs))
+        self._add_term_entry(term_bytes, postings_offset, len(postings),
+                             max_score)
+        
+    def add_term_chunks(self, term, df, chunks, max_score=0.0):
+        '''Writes postings for term, streamed as raw byte chunks
+        
+        Only supported by the raw codec.
+        
+        Params:
+            term: unicode term
+            df: number of postings
+            chunks: iterable of byte strings that together hold the df
+                    docids (sorted) as little-endian uint32s, followed by
+                    their freqs
+            max_score: upper bound on ``freq / doc_len`` over the postings
+        '''
+        if self._codec != CODEC_RAW:
+            raise ValueError('add_term_chunks() requires the raw codec')
+        term_bytes = self._check_term(term)
+        postings_offset = self._offset
+        for chunk in chunks:
+            self._write(chunk)
+        if self._offset - postings_offset != 8 * df:
+            raise ValueError('postings chunks for {!r} do not match '
+                             'df={}'.format(term, df))
+        self._add_term_entry(term_bytes, postings_offset, df, max_score)
+        
+    def _check_term(self, term):
+        '''Returns utf-8 bytes of term, checking that terms are sorted'''
+        term_bytes = term.encode('utf-8')
+        if self._last_term is not None and term_bytes <= self._last_term:
+            raise ValueError('terms must be added in sorted order: '
+                             '{!r}'.format(term))
+        self._last_term = term_bytes
+        return term_bytes
+    
+    def _add_term_entry(self, term_bytes, postings_offset, df, max_score):
+        self._term_entries += TERM_ENTRY.pack(len(self._term_strings),
+                                              postings_offset,
+                                              self._offset - postings_offset,
+                                              len(term_bytes),
+                                              df,
+                                              max_score)
+        self._term_strings += term_bytes
+        self._num_terms += 1
+        
+    def add_doc(self, docid, name, doc_len):
+        '''Adds a document to the doc table'''
+        self._docs.append((docid, name.encode('utf-8'), doc_len))
+        
+    def finish(self, doc_table=None):
+        '''Writes the term and doc tables, followed by the header
+        
+        Params:
+            doc_table: if given, a (num_docs, docid_limit, sections) tuple
+                       describing a doc table to stream out instead of the
+                       docs added with :meth:`add_doc()`.  ``sections``
+                       holds the docids, doc lengths, name offsets, name
+                       order and names sections (laid out as described
+                       above), each as an iterable of byte strings.
+        '''
+        offsets = []
+        offsets.append(HEADER_SIZE)  # postings
+        
+        offsets.append(self._align())
+        self._write(bytes(self._term_entries))
+        offsets.append(self._align())
+        self._write(bytes(self._term_strings))
+        
+        if doc_table is None:
+            doc_table = self._doc_table()
+        (num_docs, docid_limit, sections) = doc_table
+        for section in sections:
+            offsets.append(self._align())
+            for chunk in section:
+                self._write(chunk)
+        
+        config = json.dumps(self._config).encode('utf-8')
+        offsets.append(self._align())
+        self._write(config)
+        
+        self._file.seek(0)
+        self._file.write(HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION, self._codec,
+                                     self._num_terms, num_docs,
+                                     docid_limit, *(offsets + [len(config)])))
+        self._file.seek(self._offset)
+        self._file.flush()
+        
+    def _doc_table(self):
+        '''Returns the doc table for the docs added with :meth:`add_doc()`'''
+        self._docs.sort()
+        docids = array(DOCID_TYPECODE, (docid for (docid, name, doc_len)
+                                        in self._docs))
+        docid_limit = docids[-1] + 1 if docids else 0
+        doc_lens = array(str('d'), [0.0]) * docid_limit
+        name_offsets = [0]
+        for (docid, name, doc_len) in self._docs:
+            doc_lens[docid] = doc_len
+            name_offsets.append(name_offsets[-1] + len(name))
+        name_order = sorted(xrange(len(self._docs)),
+                            key=lambda i: self._docs[i][1])
+        sections = ([to_le_bytes(docids)],
+                    [to_le_bytes(doc_lens)],
+                    [b''.join(UINT64.pack(x) for x in name_offsets)],
+                    [to_le_bytes(array(DOCID_TYPECODE, name_order))],
+                    [b''.join(name for (docid, name, doc_len) in self._docs)])
+        return (len(self._docs), docid_limit, sections)
+        
+    def _write(self, data):
+        self._file.write(data)
+        self._offset += len(data)
+        
+    def _align(self):
+        '''Pads output to an 8-byte boundary and returns the new offset'''
+        padding = -self._offset % 8
+        if padding:
+            self._write(b'\0' * padding)
+        return self._offset
+
+def write_segment(sim_index, file, codec=CODEC_RAW):
+    '''Writes ``sim_index`` to ``file`` in the segment format
+    
+    Params:
+        sim_index: A :class:`pysimsearch.sim_index.MemorySimIndex`
+        file: binary file object opened for writing
+        codec: postings codec, ``CODEC_RAW`` or ``CODEC_VARINT``
+    '''
+    writer = SegmentWriter(file, config=sim_index._config, codec=codec)
+    term_dict = sim_index._term_dict
+    terms = sorted((term_dict.term(tid).encode('utf-8'), tid)
+                   for tid in xrange(len(term_dict)))
+    for (term_bytes, tid) in terms:
+        postings = sim_index._postings(tid)
+        if postings:
+            writer.add_term(term_bytes.decode('utf-8'), postings,
+                            sim_index.get_term_max_score(tid))
+    for (docid, name) in sim_index._docid_to_name_map.iteritems():
+        writer.add_doc(docid, name, sim_index.get_doc_len(docid))
+    writer.finish()
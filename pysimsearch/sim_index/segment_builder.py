@@ -0,0 +1,468 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2011, Taher Haveliwala <oss@taherh.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#         * Redistributions of source code must retain the above copyright
+#           notice, this list of conditions and the following disclaimer.
+#         * Redistributions in binary form must reproduce the above copyright
+#           notice, this list of conditions and the following disclaimer in the
+#           documentation and/or other materials provided with the distribution.
+#         * The names of project contributors may not be used to endorse or
+#           promote products derived from this software without specific
+#           prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+'''
+External-memory segment builder
+
+Builds a segment (see :mod:`pysimsearch.sim_index.segment`) over a corpus
+that is too large to index in memory, using single-pass in-memory indexing
+(SPIMI).  Documents are streamed into an in-memory run of postings until an
+estimate of its size reaches ``memory_budget``.  The run is then sorted by
+term and spilled to a temporary file, and a new run is started.  Document
+names and lengths are streamed straight to temporary files as documents
+are added.
+
+:meth:`SegmentBuilder.finish()` k-way merges the runs into the segment.
+Since runs cover increasing docid ranges, the postings of a term are just
+the concatenation of its postings in each run, and are copied through
+chunk by chunk.  At most ``max_fan_in`` runs are merged at once (so at
+most that many run files are open); with more runs, consecutive runs are
+first merged into larger runs, over as many passes as needed.  Memory use
+is therefore bounded by the budget (plus one chunk and one run record per
+merged run, and the term table), regardless of the number of documents.
+
+The segment can then be served with
+:class:`pysimsearch.sim_index.SegmentSimIndex`.
+
+Sample usage::
+
+    from pysimsearch import doc_reader
+    from pysimsearch.sim_index import SegmentSimIndex
+    from pysimsearch.sim_index.segment_builder import SegmentBuilder
+
+    with open('myindex.seg', 'wb') as segment_file:
+        builder = SegmentBuilder(segment_file, memory_budget=64 * 2**20)
+        builder.index_files(doc_reader.get_text_files(filenames))
+        builder.finish()
+
+    sim_index = SegmentSimIndex('myindex.seg')
+
+'''
+
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+
+from array import array
+import heapq
+import io
+import os
+import shutil
+import struct
+import tempfile
+
+from .postings import (PostingsList, DOCID_TYPECODE, FREQ_TYPECODE,
+                       to_le_bytes, from_le_bytes)
+from .ingest import get_tokenizer, iter_term_vecs
+from .segment import SegmentWriter, CODEC_RAW, UINT64, FLOAT64
+from .. import term_vec
+
+# term length, df, max score; followed by the term, the docids as uint32s,
+# and the freqs as uint32s
+_RUN_RECORD = struct.Struct(str('<IId'))
+
+# name length, docid; followed by the name
+_NAME_RECORD = struct.Struct(str('<II'))
+
+# rough in-memory costs used to estimate the size of a run
+_POSTING_COST = 8
+_TERM_COST = 200
+_NAME_COST = 80
+
+_CHUNK_SIZE = 1 << 20
+
+def _read_chunks(path):
+    '''Yields contents of file at path in chunks'''
+    with io.open(path, 'rb') as file:
+        while True:
+            chunk = file.read(_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+class _RunReader(object):
+    '''Reads the records of a spilled run, in term order'''
+    
+    def __init__(self, path):
+        self._file = io.open(path, 'rb')
+        self._next()
+        
+    def _next(self):
+        '''Reads the header of the next record'''
+        header = self._file.read(_RUN_RECORD.size)
+        if not header:
+            self.term = None
+            self._file.close()
+            return
+        (term_len, self.df, self.max_score) = _RUN_RECORD.unpack(header)
+        self.term = self._file.read(term_len)
+        self._postings_offset = self._file.tell()
+    
+    def _read_range(self, offset, size):
+        '''Yields ``size`` bytes starting at ``offset``, in chunks'''
+        end = offset + size
+        while offset < end:
+            self._file.seek(offset)
+            chunk = self._file.read(min(_CHUNK_SIZE, end - offset))
+            if not chunk:
+                raise IOError('truncated run: {}'.format(self._file.name))
+            offset += len(chunk)
+            yield chunk
+    
+    def read_docids(self):
+        '''Yields the docids of the current record, in chunks'''
+        return self._read_range(self._postings_offset, 4 * self.df)
+    
+    def read_freqs(self):
+        '''Yields the freqs of the current record, in chunks'''
+        return self._read_range(self._postings_offset + 4 * self.df,
+                                4 * self.df)
+    
+    def advance(self):
+        '''Skips to the next record'''
+        self._file.seek(self._postings_offset + 8 * self.df)
+        self._next()
+
+def _read_names(path):
+    '''Yields (name bytes, docid) tuples from a spilled run of names'''
+    with io.open(path, 'rb') as file:
+        while True:
+            header = file.read(_NAME_RECORD.size)
+            if not header:
+                return
+            (name_len, docid) = _NAME_RECORD.unpack(header)
+            yield (file.read(name_len), docid)
+
+def _postings_chunks(readers):
+    '''
+    Yields the docids, then the freqs, of the current records of readers
+    (which are in docid order), in chunks
+    '''
+    for reader in readers:
+        for chunk in reader.read_docids():
+            yield chunk
+    for reader in readers:
+        for chunk in reader.read_freqs():
+            yield chunk
+
+class SegmentBuilder(object):
+    '''
+    Builds a segment over documents that are streamed in, in bounded memory.
+    
+    Documents are assigned dense docids in the order they are added.
+    '''
+    
+    def __init__(self, file, memory_budget=256 * 2**20, config=None,
+                 tmpdir=None, codec=CODEC_RAW, max_fan_in=64):
+        '''
+        Params:
+            file: seekable binary file object to write the segment to
+            memory_budget: approximate bound, in bytes, on the size of the
+                           in-memory run
+            config: index config (e.g., ``lowercase`` and ``stoplist``)
+                    used to tokenize documents, which is stored with the
+                    segment.  Set ``ingest_workers`` to tokenize in
+                    parallel (see :mod:`pysimsearch.sim_index.ingest`).
+            tmpdir: directory in which to create the directory for spilled
+                    runs (by default, the system temp directory)
+            codec: postings codec for the segment.  With ``CODEC_VARINT``
+                   the postings of each term are decoded in memory while
+                   merging, so memory use then also depends on the longest
+                   postings list.
+            max_fan_in: max number of runs merged at once
+        '''
+        if max_fan_in < 2:
+            raise ValueError('max_fan_in must be at least 2')
+        self._file = file
+        self._memory_budget = memory_budget
+        self._config = {'lowercase': True, 'stoplist': {}}
+        self._config.update(config or {})
+        self._codec = codec
+        self._max_fan_in = max_fan_in
+        self._tokenizer = None
+        
+        self._tmpdir = tempfile.mkdtemp(prefix='pysimsearch-', dir=tmpdir)
+        self._runs = []
+        self._name_runs = []
+        self._num_merged_runs = 0
+        
+        # doc table sections that are streamed out as docs are added
+        self._doc_lens_file = self._open_tmp('doc_lens')
+        self._names_file = self._open_tmp('names')
+        self._name_offsets_file = self._open_tmp('name_offsets')
+        self._name_offsets_file.write(UINT64.pack(0))
+        self._names_size = 0
+        
+        self._num_docs = 0
+        self._start_run()
+        
+    def _open_tmp(self, name):
+        return io.open(os.path.join(self._tmpdir, name), 'wb')
+    
+    def _start_run(self):
+        self._postings = {}  # term -> (docids, freqs, [max score])
+        self._names = []  # (name bytes, docid) tuples
+        self._run_size = 0
+    
+    @property
+    def num_docs(self):
+        '''Number of documents added so far'''
+        return self._num_docs
+    
+    @property
+    def num_runs(self):
+        '''Number of runs spilled so far'''
+        return len(self._runs)
+        
+    def index_files(self, named_files):
+        '''Add ``named_files`` to the segment
+        
+        Params:
+            named_files: iterable of (filename, file) pairs.
+                         Takes ownership of (and consumes) the files.
+        '''
+        self._tokenizer = get_tokenizer(self._tokenizer, self._config)
+        for (name, t_vec) in iter_term_vecs(named_files, self._config,
+                                            self._tokenizer):
+            self._add_doc(name, t_vec)
+            
+    def index_string_buffers(self, named_string_buffers):
+        '''Add ``named_string_buffers``, an iterable of (name, string)
+        tuples, to the segment'''
+        def named_files():
+            for (name, string_buffer) in named_string_buffers:
+                if isinstance(string_buffer, str):
+                    string_buffer = unicode(string_buffer)
+                yield (name, io.StringIO(string_buffer))
+        self.index_files(named_files())
+        
+    def _add_doc(self, name, t_vec):
+        docid = self._num_docs
+        doc_len = term_vec.l2_norm(t_vec)
+        for (term, freq) in t_vec.iteritems():
+            entry = self._postings.get(term)
+            if entry is None:
+                entry = self._postings[term] = (array(DOCID_TYPECODE),
+                                                array(FREQ_TYPECODE), [0])
+                self._run_size += _TERM_COST
+            entry[0].append(docid)
+            entry[1].append(freq)
+            if freq / doc_len > entry[2][0]:
+                entry[2][0] = freq / doc_len
+        self._run_size += _POSTING_COST * len(t_vec)
+        
+        name_bytes = name.encode('utf-8')
+        self._names.append((name_bytes, docid))
+        self._run_size += _NAME_COST + len(name_bytes)
+        self._doc_lens_file.write(FLOAT64.pack(doc_len))
+        self._names_file.write(name_bytes)
+        self._names_size += len(name_bytes)
+        self._name_offsets_file.write(UINT64.pack(self._names_size))
+        self._num_docs += 1
+        
+        if self._run_size >= self._memory_budget:
+            self._spill()
+            
+    def _spill(self):
+        '''Writes the in-memory run out, sorted by term, and starts a new one'''
+        path = os.path.join(self._tmpdir, 'run-{:05d}'.format(len(self._runs)))
+        with io.open(path, 'wb') as run:
+            terms = sorted((term.encode('utf-8'), term) for term in self._postings)
+            for (term_bytes, term) in terms:
+                (docids, freqs, max_score) = self._postings.pop(term)
+                run.write(_RUN_RECORD.pack(len(term_bytes), len(docids),
+                                           max_score[0]))
+                run.write(term_bytes)
+                run.write(to_le_bytes(docids))
+                run.write(to_le_bytes(freqs))
+        self._runs.append(path)
+        
+        path = os.path.join(self._tmpdir, 'names-{:05d}'.format(len(self._name_runs)))
+        with io.open(path, 'wb') as run:
+            self._names.sort()
+            for (name_bytes, docid) in self._names:
+                run.write(_NAME_RECORD.pack(len(name_bytes), docid))
+                run.write(name_bytes)
+        self._name_runs.append(path)
+        
+        self._start_run()
+        
+    def finish(self):
+        '''Merges the runs and writes out the segment'''
+        try:
+            if self._names:
+                self._spill()
+            for file in (self._doc_lens_file, self._names_file,
+                         self._name_offsets_file):
+                file.close()
+            
+            while len(self._runs) > self._max_fan_in:
+                self._runs = self._merge_pass(self._runs, self._merge_run_files)
+            while len(self._name_runs) > self._max_fan_in:
+                self._name_runs = self._merge_pass(self._name_runs,
+                                                   self._merge_name_files)
+            
+            writer = SegmentWriter(self._file, config=self._config,
+                                   codec=self._codec)
+            self._merge_runs(writer)
+            sections = (self._docids(),
+                        _read_chunks(self._doc_lens_file.name),
+                        _read_chunks(self._name_offsets_file.name),
+                        self._name_order(),
+                        _read_chunks(self._names_file.name))
+            writer.finish((self._num_docs, self._num_docs, sections))
+        finally:
+            self.close()
+    
+    def close(self):
+        '''
+        Removes spilled runs, and shuts down the tokenizer pool.  Called
+        by :meth:`finish()`
+        '''
+        if self._tokenizer is not None:
+            self._tokenizer.close()
+            self._tokenizer = None
+        for file in (self._doc_lens_file, self._names_file,
+                     self._name_offsets_file):
+            file.close()
+        shutil.rmtree(self._tmpdir, ignore_errors=True)
+            
+    def _merge_pass(self, paths, merge_files):
+        '''
+        Merges each group of up to ``max_fan_in`` consecutive runs in paths
+        into one run with ``merge_files(group, path)``, and returns the
+        paths of the merged runs (in docid order)
+        '''
+        merged = []
+        for start in xrange(0, len(paths), self._max_fan_in):
+            group = paths[start:start + self._max_fan_in]
+            if len(group) == 1:
+                merged.append(group[0])
+                continue
+            path = os.path.join(self._tmpdir, 'merged-{:05d}'.format(
+                self._num_merged_runs))
+            self._num_merged_runs += 1
+            merge_files(group, path)
+            for run_path in group:
+                os.remove(run_path)
+            merged.append(path)
+        return merged
+    
+    def _merge_run_files(self, paths, path):
+        '''Merges the runs of postings at paths into a run at path'''
+        with io.open(path, 'wb') as run:
+            for (term_bytes, readers) in self._iter_terms(paths):
+                run.write(_RUN_RECORD.pack(
+                    len(term_bytes), sum(reader.df for reader in readers),
+                    max(reader.max_score for reader in readers)))
+                run.write(term_bytes)
+                for chunk in _postings_chunks(readers):
+                    run.write(chunk)
+    
+    def _merge_name_files(self, paths, path):
+        '''Merges the runs of names at paths into a run at path'''
+        with io.open(path, 'wb') as run:
+            for (name_bytes, docid) in heapq.merge(*[_read_names(name_path)
+                                                     for name_path in paths]):
+                run.write(_NAME_RECORD.pack(len(name_bytes), docid))
+                run.write(name_bytes)
+    
+    def _iter_terms(self, paths):
+        '''
+        K-way merges the runs at paths, yielding (term bytes, readers) for
+        each term, where readers are positioned at the term's records, in
+        run (docid) order.  Readers are advanced once the caller resumes.
+        '''
+        readers = [_RunReader(path) for path in paths]
+        heap = [(reader.term, i) for (i, reader) in enumerate(readers)
+                if reader.term is not None]
+        heapq.heapify(heap)
+        while heap:
+            # pop the runs holding the smallest term, in run (docid) order
+            (term_bytes, i) = heapq.heappop(heap)
+            group = [i]
+            while heap and heap[0][0] == term_bytes:
+                group.append(heapq.heappop(heap)[1])
+            
+            yield (term_bytes, [readers[i] for i in group])
+            
+            for i in group:
+                readers[i].advance()
+                if readers[i].term is not None:
+                    heapq.heappush(heap, (readers[i].term, i))
+    
+    def _merge_runs(self, writer):
+        '''K-way merges the runs, writing each term's postings to writer'''
+        for (term_bytes, readers) in self._iter_terms(self._runs):
+            term = term_bytes.decode('utf-8')
+            df = sum(reader.df for reader in readers)
+            max_score = max(reader.max_score for reader in readers)
+            if self._codec == CODEC_RAW:
+                writer.add_term_chunks(term, df, _postings_chunks(readers),
+                                       max_score)
+            else:
+                postings = PostingsList()
+                for reader in readers:
+                    postings.docids.extend(from_le_bytes(
+                        DOCID_TYPECODE, b''.join(reader.read_docids())))
+                    postings.freqs.extend(from_le_bytes(
+                        FREQ_TYPECODE, b''.join(reader.read_freqs())))
+                writer.add_term(term, postings, max_score)
+                    
+    def _docids(self):
+        '''Yields the docids section, which holds the dense docids'''
+        for start in xrange(0, self._num_docs, _CHUNK_SIZE // 4):
+            end = min(start + _CHUNK_SIZE // 4, self._num_docs)
+            yield to_le_bytes(array(DOCID_TYPECODE, xrange(start, end)))
+            
+    def _name_order(self):
+        '''Yields the name order section, by merging the runs of names'''
+        order = array(DOCID_TYPECODE)
+        names = heapq.merge(*[_read_names(path) for path in self._name_runs])
+        for (name_bytes, docid) in names:
+            order.append(docid)
+            if len(order) >= _CHUNK_SIZE // 4:
+                yield to_le_bytes(order)
+                order = array(DOCID_TYPECODE)
+        yield to_le_bytes(order)
+
+def build_segment(named_files, file, **kwargs):
+    '''Writes a segment over ``named_files`` to ``file``
+    
+    Params:
+        named_files: iterable of (filename, file) pairs
+        file: seekable binary file object to write the segment to
+        kwargs: passed on to :class:`SegmentBuilder`
+    '''
+    builder = SegmentBuilder(file, **kwargs)
+    try:
+        builder.index_files(named_files)
+    except:
+        builder.close()
+        raise
+    builder.finish()
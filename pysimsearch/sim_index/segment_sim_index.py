@@ -0,0 +1,361 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2011, Taher Haveliwala <oss@taherh.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#         * Redistributions of source code must retain the above copyright
+#           notice, this list of conditions and the following disclaimer.
+#         * Redistributions in binary form must reproduce the above copyright
+#           notice, this list of conditions and the following disclaimer in the
+#           documentation and/or other materials provided with the distribution.
+#         * The names of project contributors may not be used to endorse or
+#           promote products derived from this software without specific
+#           prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+'''
+SegmentSimIndex
+
+Read-only :class:`SimIndex` served directly from a memory-mapped segment
+file (see :mod:`pysimsearch.sim_index.segment` for the format).  Opening a
+segment only reads its header, so startup time does not depend on index
+size; postings, doc lengths and names are read from the mapping as queries
+touch them.  Raw postings are handed to the scorer as views on the mapping
+(see :class:`MappedPostingsList`), which the numpy scorer reads without
+copying; varint postings are decoded once, and kept in an LRU cache.
+Processes serving the same segment file share its pages in the OS page
+cache.
+
+Sample usage::
+
+    from pprint import pprint
+    from pysimsearch.sim_index import MemorySimIndex, SegmentSimIndex
+    from pysimsearch.sim_index.segment import write_segment
+
+    sim_index = MemorySimIndex()
+    sim_index.index_urls('http://www.stanford.edu/',
+                         'http://www.berkeley.edu',
+                         'http://www.ucla.edu',
+                         'http://www.mit.edu')
+    with open('myindex.seg', 'wb') as segment_file:
+        write_segment(sim_index, segment_file)
+
+    segment_index = SegmentSimIndex('myindex.seg')
+    pprint(list(segment_index.query("stanford university")))
+
+To share an index with forked worker processes, freeze it first.  Unlike
+the python objects of a :class:`MemorySimIndex`, whose pages are copied
+into each worker by refcount updates, the frozen index's data stays in
+pages shared by all of the workers::
+
+    frozen_index = SegmentSimIndex.freeze(sim_index, dir='/dev/shm')
+    worker = ProcessSimIndex(factory=lambda: frozen_index)
+
+'''
+
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+
+from bisect import bisect_left
+import json
+import mmap
+import tempfile
+
+from .term_id_sim_index import TermIdSimIndex
+from .cached_map import CachedMap
+from .postings import (CompressedPostingsList, MappedPostingsList,
+                       from_le_bytes, BIG_ENDIAN)
+from .segment import (HEADER, HEADER_SIZE, SEGMENT_MAGIC, SEGMENT_VERSION,
+                      CODEC_RAW, CODEC_VARINT, TERM_ENTRY, UINT32, UINT64,
+                      FLOAT64, write_segment)
+from ..exceptions import *
+
+class _MappedArray(object):
+    '''Read-only sequence view of fixed-size values packed in a buffer'''
+    
+    def __init__(self, buf, offset, count, item_struct):
+        self._buf = buf
+        self._offset = offset
+        self._count = count
+        self._struct = item_struct
+        
+    def __len__(self):
+        return self._count
+    
+    def __getitem__(self, i):
+        if not 0 <= i < self._count:
+            raise IndexError('index out of range')
+        return self._struct.unpack_from(self._buf,
+                                        self._offset + i * self._struct.size)[0]
+
+class _DecodedPostings(object):
+    '''Map from term id to decoded postings of a varint-coded segment'''
+    
+    def __init__(self, segment):
+        self._segment = segment
+        
+    def __getitem__(self, tid):
+        (_, postings_off, postings_len, _, _, _) = self._segment._term_entry(tid)
+        return CompressedPostingsList.frombytes(
+            self._segment._buf[postings_off:postings_off + postings_len]).decode()
+
+class SegmentSimIndex(TermIdSimIndex):
+    '''
+    Inherits from :class:`pysimsearch.sim_index.term_id_sim_index.TermIdSimIndex`.
+    
+    Read-only index over a segment.  Terms are looked up by binary search
+    over the segment's sorted term table, and term ids are positions in
+    that table.  Updates raise :class:`ReadOnlyIndexException`; global df
+    stats and query scorers may still be set.
+    '''
+    
+    thread_safe_reads = True
+    
+    def __init__(self, segment, postings_cache_size=1000000):
+        '''Open ``segment``
+        
+        Params:
+            segment: filename or open file of a segment, which is
+                     memory-mapped; or a buffer holding segment contents
+                     (e.g., a ``bytearray``, ``mmap``, or ``buffer``)
+            postings_cache_size: max number of postings held decoded in
+                                 the postings cache of a varint segment
+        '''
+        super(SegmentSimIndex, self).__init__()
+        self._mmap = None
+        if isinstance(segment, basestring):
+            with open(segment, 'rb') as file:
+                self._mmap = self._map_file(file)
+            buf = self._mmap
+        elif hasattr(segment, 'fileno'):
+            self._mmap = buf = self._map_file(segment)
+        else:
+            buf = segment
+        self._buf = buf
+        
+        if len(buf) < HEADER_SIZE:
+            raise FileFormatException('Truncated segment header')
+        (magic, version, codec, self._num_terms, num_docs, self._docid_limit,
+         self._postings_off, self._terms_off, self._term_strings_off,
+         docids_off, self._doc_lens_off, name_offsets_off, name_order_off,
+         self._names_off, config_off, config_len) = HEADER.unpack_from(buf)
+        if magic != SEGMENT_MAGIC:
+            raise FileFormatException('Not a segment file')
+        if version != SEGMENT_VERSION:
+            raise FileFormatException(
+                'Unsupported segment version: {}'.format(version))
+        if codec not in (CODEC_RAW, CODEC_VARINT):
+            raise FileFormatException(
+                'Unsupported postings codec: {}'.format(codec))
+        self._codec = codec
+        self._decoded_postings = None
+        if codec == CODEC_VARINT:
+            self._decoded_postings = CachedMap(_DecodedPostings(self),
+                                               max_weight=postings_cache_size,
+                                               weigh=len)
+        
+        self._docids = _MappedArray(buf, docids_off, num_docs, UINT32)
+        self._name_offsets = _MappedArray(buf, name_offsets_off, num_docs + 1,
+                                          UINT64)
+        self._name_order = _MappedArray(buf, name_order_off, num_docs, UINT32)
+        
+        self.update_config(**json.loads(
+            buf[config_off:config_off + config_len].decode('utf-8')))
+        self._N = num_docs
+        self._next_docid = self._docid_limit
+        self._global_df_map = None
+        self.set_query_scorer('tfidf')
+        
+    @staticmethod
+    def freeze(sim_index, codec=CODEC_RAW, dir=None):
+        '''
+        Returns a read-only ``SegmentSimIndex`` copy of ``sim_index``, whose
+        contents are shared with processes forked afterwards
+        
+        The segment is written to an unlinked temporary file and mapped
+        shared, so it needs no cleanup: its space is released once every
+        process has closed the index (or exited).  The query scorer of
+        ``sim_index`` is carried over.
+        
+        Params:
+            sim_index: A :class:`pysimsearch.sim_index.MemorySimIndex`
+            codec: postings codec, ``CODEC_RAW`` or ``CODEC_VARINT``
+            dir: directory for the temporary file, e.g., ``/dev/shm`` to
+                 keep the segment in shared memory rather than on disk
+        '''
+        with tempfile.TemporaryFile(dir=dir) as file:
+            write_segment(sim_index, file, codec=codec)
+            file.flush()
+            # the mapping remains valid after the file is closed
+            frozen_index = SegmentSimIndex(file)
+        if sim_index.query_scorer is not None:
+            frozen_index.query_scorer = sim_index.query_scorer
+            frozen_index._query_scorer_name = sim_index._query_scorer_name
+        return frozen_index
+        
+    @staticmethod
+    def _map_file(file):
+        try:
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files can't be mapped
+            raise FileFormatException('Truncated segment header')
+        
+    def close(self):
+        '''Unmaps the segment file'''
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        
+    def set_global_df_map(self, df_map):
+        self._global_df_map = df_map
+        self._bump_generation()
+        
+    def get_local_df_map(self):
+        return { self._term(tid): self._term_entry(tid)[4]
+                 for tid in xrange(self._num_terms) }
+    
+    def get_name_to_docid_map(self):
+        return { self._doc_name(i): self._docids[i]
+                 for i in xrange(len(self._docids)) }
+    
+    def get_doc_freq(self, tid):
+        '''Returns document frequency for term id ``tid``'''
+        if self._global_df_map:
+            return self._global_df_map.get(self._term(tid), 1)
+        return self._term_entry(tid)[4] or 1
+        
+    def get_doc_len(self, docid):
+        if not 0 <= docid < self._docid_limit:
+            return 0
+        return FLOAT64.unpack_from(self._buf, self._doc_lens_off + 8 * docid)[0]
+    
+    def get_doc_len_array(self):
+        '''
+        Returns a buffer of doc lengths (as doubles) indexed by docid, with
+        0 for absent docids.  On little-endian hosts this is a view of the
+        mapping itself.
+        '''
+        size = 8 * self._docid_limit
+        if BIG_ENDIAN:
+            return from_le_bytes(str('d'), self._buf[self._doc_lens_off:
+                                                     self._doc_lens_off + size])
+        return buffer(self._buf, self._doc_lens_off, size)
+        
+    def get_term_max_score(self, tid):
+        '''
+        Returns an upper bound on ``freq / doc_len`` over the postings of
+        term id ``tid``.
+        '''
+        return self._term_entry(tid)[5]
+        
+    def index_files(self, named_files):
+        raise ReadOnlyIndexException('SegmentSimIndex is read-only')
+        
+    def del_docids(self, *docids):
+        raise ReadOnlyIndexException('SegmentSimIndex is read-only')
+        
+    def docid_to_name(self, docid):
+        i = bisect_left(self._docids, docid)
+        if i == len(self._docids) or self._docids[i] != docid:
+            raise KeyError(docid)
+        return self._doc_name(i)
+        
+    def name_to_docid(self, name):
+        name_bytes = name.encode('utf-8')
+        (lo, hi) = (0, len(self._name_order))
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._doc_name_bytes(self._name_order[mid]) < name_bytes:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self._name_order):
+            i = self._name_order[lo]
+            if self._doc_name_bytes(i) == name_bytes:
+                return self._docids[i]
+        raise KeyError(name)
+
+    def postings_list(self, term):
+        '''
+        Returns list of (docid, freq) tuples for documents containing term
+        '''
+        if self.config('lowercase'):
+            term = term.lower()
+
+        tid = self._term_id(term)
+        if tid is None:
+            return []
+        return self._postings(tid)
+    
+    def iter_terms(self):
+        '''
+        Yields (term, postings, max_score) for each term in the segment, in
+        order of utf-8 term bytes
+        '''
+        for tid in xrange(self._num_terms):
+            yield (self._term(tid), self._postings(tid),
+                   self.get_term_max_score(tid))
+    
+    def _term_entry(self, tid):
+        '''Returns the term table entry for term id ``tid``'''
+        return TERM_ENTRY.unpack_from(self._buf,
+                                      self._terms_off + tid * TERM_ENTRY.size)
+    
+    def _term_bytes(self, tid):
+        (string_off, _, _, string_len, _, _) = self._term_entry(tid)
+        start = self._term_strings_off + string_off
+        return self._buf[start:start + string_len]
+    
+    def _term(self, tid):
+        return self._term_bytes(tid).decode('utf-8')
+    
+    def _term_id(self, term):
+        '''Returns term id for term, or None if it isn't in the segment'''
+        term_bytes = term.encode('utf-8')
+        (lo, hi) = (0, self._num_terms)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term_bytes(mid) < term_bytes:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._num_terms and self._term_bytes(lo) == term_bytes:
+            return lo
+        return None
+    
+    def _query_postings(self, tid):
+        return self._postings(tid)
+    
+    def _postings(self, tid):
+        '''
+        Returns postings for term id ``tid``: a :class:`MappedPostingsList`
+        view on the mapping, or for compressed segments, a cached decoded
+        :class:`PostingsList`, which must not be modified
+        '''
+        if self._decoded_postings is not None:
+            return self._decoded_postings[tid]
+        (_, postings_off, postings_len, _, df, _) = self._term_entry(tid)
+        return MappedPostingsList(self._buf, postings_off, df)
+    
+    def _doc_name_bytes(self, i):
+        '''Returns utf-8 name of the ``i``-th document in the doc table'''
+        start = self._names_off + self._name_offsets[i]
+        return self._buf[start:self._names_off + self._name_offsets[i + 1]]
+    
+    def _doc_name(self, i):
+        return self._doc_name_bytes(i).decode('utf-8')
@@ -0,0 +1,700 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2011, Taher Haveliwala <oss@taherh.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#         * Redistributions of source code must retain the above copyright
+#           notice, this list of conditions and the following disclaimer.
+#         * Redistributions in binary form must reproduce the above copyright
+#           notice, this list of conditions and the following disclaimer in the
+#           documentation and/or other materials provided with the distribution.
+#         * The names of project contributors may not be used to endorse or
+#           promote products derived from this software without specific
+#           prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+'''
+SegmentedSimIndex
+
+New documents are added to a small, mutable in-memory segment.  Once it
+holds ``segment_size`` documents, it is sealed into an immutable segment
+in the compact segment format (see :mod:`pysimsearch.sim_index.segment`),
+and a fresh in-memory segment is started.  Queries fan out across all
+segments: each segment is scored on its own, with document frequencies
+summed across segments, and the per-segment top hits are merged (segments
+cover disjoint docid ranges), so results match a single index over the
+same documents.
+
+Sealed segments are merged by a background thread, using a tiered merge
+policy: each segment is assigned a tier by its size (tier ``t`` holds
+segments of at least ``segment_size * merge_factor**t`` documents), and
+whenever ``merge_factor`` adjacent segments are in the same tier, they are
+merged into one segment of the next tier.  Each document is therefore
+rewritten O(log N) times, and the number of segments stays logarithmic in
+the size of the index.  Merges only read immutable segments, and the
+merged segment is swapped in atomically, so they don't block indexing or
+queries.
+
+Deleted documents are tombstoned in their segment, skipped by the query
+scorer, and physically dropped, along with their tombstones, when their
+segment is next merged.  Tiers are based on
+the number of documents a segment was written with, so deletes don't
+trigger merges on their own; once tombstones exceed the ``compact_ratio``
+config value (as a fraction of live documents), :meth:`compact()` is run.
+
+Sample usage::
+
+    from pprint import pprint
+    from pysimsearch.sim_index import SegmentedSimIndex
+
+    sim_index = SegmentedSimIndex(segment_size=2, merge_factor=2)
+    sim_index.index_urls('http://www.stanford.edu/',
+                         'http://www.berkeley.edu',
+                         'http://www.ucla.edu',
+                         'http://www.mit.edu')
+    pprint(list(sim_index.query("stanford university")))
+    pprint(sim_index.segment_stats())
+    sim_index.close()
+
+'''
+
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+import heapq
+import io
+import sys
+import threading
+
+from . import SimIndex
+from .postings import PostingsList, DocidBitset
+from .segment import SegmentWriter, CODEC_RAW
+from .segment_sim_index import SegmentSimIndex
+from .. import term_vec
+from ..exceptions import *
+
+class _Segment(object):
+    '''
+    Base class for the segments of a :class:`SegmentedSimIndex`.  A segment
+    holds the postings of the docids in ``[first_docid, end_docid)``.
+    
+    Instance Attributes:
+        num_docs: number of docs added to the segment, including deleted ones
+        deleted: :class:`DocidBitset` of the tombstoned docids in the segment
+        deleted_docids: sorted list of the same docids
+    
+    The tombstones are replaced (see :meth:`set_deleted()`) rather than
+    modified, so queries can keep reading the ones they started with.
+    '''
+    
+    def __init__(self, first_docid):
+        self.first_docid = first_docid
+        self.num_docs = 0
+        self.set_deleted(())
+        
+    @property
+    def num_deleted(self):
+        '''Number of tombstoned docs in the segment'''
+        return len(self.deleted_docids)
+    
+    def set_deleted(self, docids):
+        '''Replaces the segment's tombstones with ``docids``'''
+        docids = sorted(docids)
+        self.deleted = DocidBitset(docids)
+        self.deleted_docids = docids
+        
+    def live_df(self, postings):
+        '''Returns the number of postings in ``postings`` that aren't deleted'''
+        df = len(postings)
+        deleted_docids = self.deleted_docids
+        if not deleted_docids:
+            return df
+        docids = postings.docids
+        if len(deleted_docids) > df:
+            return sum(1 for docid in docids if docid not in self.deleted)
+        # postings are sorted by docid, so look each tombstone up
+        for docid in deleted_docids:
+            i = bisect_left(docids, docid)
+            if i < len(docids) and docids[i] == docid:
+                df -= 1
+        return df
+        
+    def live_postings(self, term):
+        '''
+        Returns (postings, max_score) for term, skipping deleted docids,
+        or ``None`` if the term isn't in the segment
+        '''
+        entry = self.term_postings(term)
+        if entry is None:
+            return None
+        (postings, max_score) = entry
+        if self.num_deleted:
+            deleted = self.deleted
+            postings = PostingsList((docid, freq) for (docid, freq) in postings
+                                    if docid not in deleted)
+        return (postings, max_score)
+    
+    def doc_freqs(self):
+        '''Returns dict mapping each term to its number of live postings'''
+        if not self.num_deleted:
+            return self.get_df_map()
+        df_map = {}
+        for (term, postings, max_score) in self.iter_terms():
+            df = self.live_df(postings)
+            if df:
+                df_map[term] = df
+        return df_map
+
+class _MemorySegment(_Segment):
+    '''
+    Mutable in-memory segment, which new documents are added to
+    
+    Documents are added under the segment's lock, and readers get copies
+    of its postings taken under the same lock, so they never see a
+    partially added document.  The segment holds at most ``segment_size``
+    documents, so the copies are small.
+    '''
+    
+    def __init__(self, first_docid):
+        super(_MemorySegment, self).__init__(first_docid)
+        self._postings = {}
+        self._max_scores = {}
+        self._lock = threading.Lock()
+        
+    def add_doc(self, docid, t_vec, doc_len):
+        with self._lock:
+            for (term, freq) in t_vec.iteritems():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = PostingsList()
+                postings.append((docid, freq))
+                if freq / doc_len > self._max_scores.get(term, 0):
+                    self._max_scores[term] = freq / doc_len
+            self.num_docs += 1
+        
+    def term_postings(self, term):
+        '''Returns (postings, max_score) for term, or ``None``'''
+        with self._lock:
+            postings = self._postings.get(term)
+            if postings is None:
+                return None
+            return (postings[:], self._max_scores[term])
+    
+    def get_df_map(self):
+        with self._lock:
+            return { term: len(postings)
+                     for (term, postings) in self._postings.iteritems() }
+    
+    def iter_terms(self):
+        '''Yields (term, postings, max_score) in order of utf-8 term bytes'''
+        with self._lock:
+            terms = [(term, postings[:], self._max_scores[term])
+                     for (term, postings) in self._postings.iteritems()]
+        terms.sort(key=lambda entry: entry[0].encode('utf-8'))
+        return iter(terms)
+
+class _SealedSegment(_Segment):
+    '''
+    Immutable segment, held in memory in the segment format.  Only the
+    term table and postings are used; doc names and lengths are kept by
+    the :class:`SegmentedSimIndex`.
+    '''
+    
+    def __init__(self, first_docid, end_docid, num_docs, terms, codec):
+        '''Writes ``terms``, an iterable of (term, postings, max_score)
+        tuples in order of utf-8 term bytes, out as a segment'''
+        super(_SealedSegment, self).__init__(first_docid)
+        self.end_docid = end_docid
+        self.num_docs = num_docs
+        file = io.BytesIO()
+        writer = SegmentWriter(file, codec=codec)
+        for (term, postings, max_score) in terms:
+            writer.add_term(term, postings, max_score)
+        writer.finish()
+        self._segment = SegmentSimIndex(buffer(file.getvalue()))
+        
+    def term_postings(self, term):
+        '''Returns (postings, max_score) for term, or ``None``'''
+        tid = self._segment._term_id(term)
+        if tid is None:
+            return None
+        return (self._segment._postings(tid),
+                self._segment.get_term_max_score(tid))
+    
+    def get_df_map(self):
+        return self._segment.get_local_df_map()
+    
+    def iter_terms(self):
+        return self._segment.iter_terms()
+
+def _merge_terms(segments, deleted):
+    '''
+    Merges the sorted term streams of ``segments``, which must be adjacent
+    and in docid order.  Yields (term, postings, max_score) for each term,
+    skipping the docids in ``deleted``, a list of each segment's tombstones.
+    '''
+    def term_stream(i, segment):
+        for (term, postings, max_score) in segment.iter_terms():
+            yield (term.encode('utf-8'), i, term, postings, max_score)
+    
+    streams = [term_stream(i, segment) for (i, segment) in enumerate(segments)]
+    (current, merged, max_score) = (None, None, 0)
+    for (term_bytes, i, term, postings, term_max_score) in heapq.merge(*streams):
+        if term != current:
+            if merged:
+                yield (current, merged, max_score)
+            (current, merged, max_score) = (term, PostingsList(), 0)
+        # postings arrive in segment order, so docids stay sorted
+        if deleted[i]:
+            segment_deleted = deleted[i]
+            merged.extend((docid, freq) for (docid, freq) in postings
+                          if docid not in segment_deleted)
+        else:
+            merged.extend(postings)
+        max_score = max(max_score, term_max_score)
+    if merged:
+        yield (current, merged, max_score)
+
+class SegmentedSimIndex(SimIndex):
+    '''
+    Inherits from :class:`pysimsearch.sim_index.SimIndex`.
+    
+    In-memory index made up of immutable segments, which are merged in the
+    background, plus a small mutable segment for new documents.
+    
+    The ``segment_size`` and ``merge_factor`` config values control when
+    the in-memory segment is sealed and how many segments of a tier are
+    merged at once, and ``compact_ratio`` controls when deleted docs are
+    purged.
+    '''
+    
+    def __init__(self, segment_size=10000, merge_factor=10,
+                 background_merges=True, codec=CODEC_RAW):
+        '''
+        Params:
+            segment_size: number of docs at which the in-memory segment
+                          is sealed
+            merge_factor: number of adjacent segments of the same tier
+                          that are merged into one
+            background_merges: if True, merges run in a background thread,
+                               otherwise they run when a segment is sealed
+            codec: postings codec used for sealed segments (see
+                   :mod:`pysimsearch.sim_index.segment`)
+        '''
+        super(SegmentedSimIndex, self).__init__()
+        if merge_factor < 2:
+            raise ValueError('merge_factor must be at least 2')
+        self.set_config('segment_size', segment_size)
+        self.set_config('merge_factor', merge_factor)
+        self.set_config('compact_ratio', 0.1)
+        self._codec = codec
+        
+        self._name_to_docid_map = {}
+        self._docid_to_name_map = {}
+        
+        # doc lengths indexed by docid, with 0 for deleted docids
+        self._doc_lens = array(str('d'))
+        
+        # sealed segments in docid order, followed by the active segment.
+        # The list is replaced rather than mutated, under self._lock, so
+        # readers can take a snapshot of it.
+        self._lock = threading.Lock()
+        self._segments = [_MemorySegment(0)]
+        self._global_df_map = None
+        
+        # background merge state, also guarded by self._lock
+        self._merge_cond = threading.Condition(self._lock)
+        self._merging = False
+        self._merge_error = None
+        self._num_merges = 0
+        self._closed = False
+        self._merge_thread = None
+        if background_merges:
+            self._merge_thread = threading.Thread(target=self._merge_loop,
+                                                  name='SegmentedSimIndex-merge')
+            self._merge_thread.daemon = True
+            self._merge_thread.start()
+        
+        self.set_query_scorer('tfidf')
+        
+    def close(self):
+        '''
+        Waits for any running merge, and stops the merge thread and the
+        tokenizer pool
+        '''
+        super(SegmentedSimIndex, self).close()
+        with self._lock:
+            self._closed = True
+            self._merge_cond.notify_all()
+        if self._merge_thread is not None:
+            self._merge_thread.join()
+            self._merge_thread = None
+        
+    def set_global_df_map(self, df_map):
+        self._global_df_map = df_map
+        self._bump_generation()
+        
+    def get_local_df_map(self):
+        df_map = defaultdict(int)
+        for segment in self._snapshot():
+            for (term, df) in segment.doc_freqs().iteritems():
+                df_map[term] += df
+        return dict(df_map)
+    
+    def get_name_to_docid_map(self):
+        return self._name_to_docid_map
+    
+    def get_doc_len(self, docid):
+        return self._doc_lens[docid] if docid < len(self._doc_lens) else 0
+    
+    def get_doc_len_array(self):
+        '''
+        Returns an ``array('d')`` of doc lengths indexed by docid, with 0
+        for deleted docids.  The array must not be held onto across updates.
+        '''
+        return self._doc_lens
+    
+    def segment_stats(self):
+        '''
+        Returns dict with the number of docs (including deleted ones) in
+        each segment, in docid order and ending with the in-memory segment,
+        and the number of merges done so far.
+        '''
+        segments = self._snapshot()
+        return {'segments': [segment.num_docs for segment in segments],
+                'deleted': [segment.num_deleted for segment in segments],
+                'merges': self._num_merges}
+        
+    def index_files(self, named_files):
+        '''
+        Build a similarity index over collection given in named_files
+        named_files is a list iterable of (filename, file) pairs
+        '''
+        try:
+            for (name, t_vec) in self._term_vecs(named_files):
+                self._index_term_vec(name, t_vec)
+        finally:
+            self._bump_generation()
+            
+    def _index_term_vec(self, name, t_vec):
+        '''Adds document ``name``, with term vector ``t_vec``, to the index'''
+        docid = self._next_docid
+        doc_len = term_vec.l2_norm(t_vec)
+        self._name_to_docid_map[name] = docid
+        self._docid_to_name_map[docid] = name
+        self._doc_lens.append(doc_len)
+        active = self._segments[-1]
+        active.add_doc(docid, t_vec, doc_len)
+        self._N += 1
+        self._next_docid += 1
+        
+        if active.num_docs >= self.config('segment_size'):
+            self._seal()
+            
+    def _seal(self):
+        '''Seals the in-memory segment and schedules merges'''
+        active = self._segments[-1]
+        if not active.num_docs:
+            return
+        sealed = _SealedSegment(active.first_docid, self._next_docid,
+                                active.num_docs, active.iter_terms(),
+                                self._codec)
+        with self._lock:
+            sealed.set_deleted(active.deleted_docids)
+            self._segments = (self._segments[:-1] +
+                              [sealed, _MemorySegment(self._next_docid)])
+            self._merge_cond.notify_all()
+        if self._merge_thread is None:
+            self._merge_all()
+            
+    def del_docids(self, *docids):
+        '''Delete docids from index
+        
+        Docids are tombstoned, and dropped from the postings lists when
+        their segment is next merged, or by :meth:`compact()` once the
+        number of tombstones exceeds ``compact_ratio`` times the number of
+        live docs.
+        
+        Raises KeyError, without deleting anything, if any docid is unknown.
+        '''
+        # check every docid up front, so a bad one doesn't leave earlier
+        # docs without names or doc lengths, but not tombstoned
+        for docid in docids:
+            if docid not in self._docid_to_name_map:
+                raise KeyError(docid)
+        for docid in docids:
+            name = self._docid_to_name_map.pop(docid)
+            if self._name_to_docid_map.get(name) == docid:
+                del self._name_to_docid_map[name]
+            self._doc_lens[docid] = 0
+            self._N -= 1
+        with self._lock:
+            segments = self._segments
+            first_docids = [segment.first_docid for segment in segments]
+            segment_deletes = defaultdict(list)
+            for docid in docids:
+                segment = segments[bisect_right(first_docids, docid) - 1]
+                segment_deletes[segment].append(docid)
+            for (segment, deletes) in segment_deletes.iteritems():
+                segment.set_deleted(segment.deleted_docids + deletes)
+        self._bump_generation()
+        
+        with self._lock:
+            num_deleted = sum(segment.num_deleted for segment in self._segments)
+        if num_deleted > self.config('compact_ratio') * self._N:
+            self.compact()
+        
+    def compact(self):
+        '''
+        Seals the in-memory segment and merges all segments into one,
+        dropping deleted docs
+        '''
+        self._seal()
+        self.wait_for_merges()
+        with self._lock:
+            while self._merging:
+                self._merge_cond.wait()
+            self._merging = True
+            segments = self._segments[:-1]
+        try:
+            if len(segments) > 1 or (segments and segments[0].num_deleted):
+                self._merge(segments)
+        finally:
+            with self._lock:
+                self._merging = False
+                self._merge_cond.notify_all()
+
+    def wait_for_merges(self):
+        '''Blocks until no merges are running or pending'''
+        with self._lock:
+            while (self._merge_error is None and self._merge_thread is not None
+                   and (self._merging or self._find_merge() is not None)):
+                self._merge_cond.wait()
+            if self._merge_error is not None:
+                raise self._merge_error
+            
+    def _find_merge(self):
+        '''
+        Returns the run of adjacent sealed segments to merge next (the
+        lowest-tier run of ``merge_factor`` segments in the same tier),
+        or ``None``.  Called with self._lock held.
+        '''
+        segment_size = self.config('segment_size')
+        merge_factor = self.config('merge_factor')
+        
+        def tier(num_docs):
+            (t, size) = (0, segment_size * merge_factor)
+            while num_docs >= size:
+                (t, size) = (t + 1, size * merge_factor)
+            return t
+        
+        # tombstones don't demote a segment, which would cause deletes to
+        # keep re-merging large segments; they're purged by compact()
+        segments = self._segments[:-1]
+        tiers = [tier(segment.num_docs) for segment in segments]
+        best = None
+        for start in xrange(len(segments) - merge_factor + 1):
+            run = tiers[start:start + merge_factor]
+            if min(run) == max(run) and (best is None or run[0] < tiers[best]):
+                best = start
+        if best is None:
+            return None
+        return segments[best:best + merge_factor]
+    
+    def _merge_loop(self):
+        '''Body of the background merge thread'''
+        while True:
+            with self._lock:
+                while not self._closed:
+                    segments = None if self._merging else self._find_merge()
+                    if segments is not None:
+                        break
+                    self._merge_cond.wait()
+                if self._closed:
+                    return
+                self._merging = True
+            try:
+                self._merge(segments)
+            except Exception as e:
+                self._merge_error = e
+                sys.stderr.write("SegmentedSimIndex merge failed: {}\n".format(e))
+                return
+            finally:
+                with self._lock:
+                    self._merging = False
+                    self._merge_cond.notify_all()
+
+    def _merge_all(self):
+        '''Runs merges in the calling thread until none are pending'''
+        while True:
+            with self._lock:
+                segments = self._find_merge()
+            if segments is None:
+                return
+            self._merge(segments)
+        
+    def _merge(self, segments):
+        '''
+        Merges ``segments``, a run of adjacent sealed segments, into one,
+        and swaps it in for them
+        '''
+        (first_docid, end_docid) = (segments[0].first_docid,
+                                    segments[-1].end_docid)
+        with self._lock:
+            deleted = [segment.deleted for segment in segments]
+        num_docs = (sum(segment.num_docs for segment in segments) -
+                    sum(len(segment_deleted) for segment_deleted in deleted))
+        merged = _SealedSegment(first_docid, end_docid, num_docs,
+                                _merge_terms(segments, deleted), self._codec)
+        
+        with self._lock:
+            # docs deleted while we were merging are still in merged, so
+            # only their tombstones carry over
+            merged.set_deleted(docid
+                               for (segment, segment_deleted)
+                               in zip(segments, deleted)
+                               for docid in segment.deleted_docids
+                               if docid not in segment_deleted)
+            current = self._segments
+            start = current.index(segments[0])
+            assert current[start:start + len(segments)] == segments
+            self._segments = (current[:start] + [merged] +
+                              current[start + len(segments):])
+            self._num_merges += 1
+            
+    def _snapshot(self):
+        '''Returns the current list of segments'''
+        with self._lock:
+            return self._segments
+        
+    def docid_to_name(self, docid):
+        return self._docid_to_name_map[docid]
+        
+    def name_to_docid(self, name):
+        return self._name_to_docid_map[name]
+
+    def postings_list(self, term):
+        '''
+        Returns list of (docid, freq) tuples for documents containing term
+        '''
+        if self.config('lowercase'):
+            term = term.lower()
+        postings = PostingsList()
+        for segment in self._snapshot():
+            entry = segment.live_postings(term)
+            if entry is not None:
+                postings.extend(entry[0])
+        return postings
+    
+    def _term_postings(self, segments, term):
+        '''
+        Returns ([(segment, postings, max_score), ...], df) for term, with
+        the unfiltered postings of each of ``segments`` containing it, and
+        its number of live postings across them
+        '''
+        parts = []
+        df = 0
+        for segment in segments:
+            entry = segment.term_postings(term)
+            if entry is not None:
+                (postings, max_score) = entry
+                parts.append((segment, postings, max_score))
+                df += segment.live_df(postings)
+        return (parts, df)
+    
+    def _query(self, query_vec, k=None):
+        '''Finds documents similar to query_vec
+        
+        Params:
+            query_vec: term vector representing query document
+            k: if given, only the top ``k`` results are returned
+        
+        Returns:
+            A iterable of (docname, score) tuples sorted by score
+        '''
+        return self._query_many([query_vec], k)[0]
+        
+    def _query_many(self, query_vecs, k=None):
+        '''Finds documents similar to each of query_vecs
+        
+        All queries in the batch see the same set of segments, and postings
+        are fetched once for terms shared across the batch.
+        '''
+        segments = self._snapshot()
+        lowercase = self.config('lowercase')
+        postings_cache = {}
+        results = []
+        for query_vec in query_vecs:
+            # terms that are not in the index are dropped, since they
+            # can't match
+            t_vec = {}
+            for (term, freq) in query_vec.iteritems():
+                if lowercase:
+                    term = term.lower()
+                if term not in postings_cache:
+                    postings_cache[term] = self._term_postings(segments, term)
+                if postings_cache[term][1]:
+                    t_vec[term] = t_vec.get(term, 0) + freq
+            results.append(list(self._score(segments, t_vec, postings_cache, k)))
+        return results
+        
+    def _score(self, segments, t_vec, postings_cache, k):
+        '''Scores each of ``segments`` for t_vec with the query scorer, and
+        merges their hits
+        
+        Returns:
+            A iterable of (docname, score) tuples sorted by score, with ties
+            broken by docid
+        '''
+        def get_doc_freq(term):
+            if self._global_df_map:
+                return self._global_df_map.get(term, 1)
+            return postings_cache[term][1] or 1
+        
+        segment_terms = defaultdict(list)
+        for term in t_vec:
+            for (segment, postings, max_score) in postings_cache[term][0]:
+                segment_terms[segment].append((term, postings, max_score))
+        
+        N = self._global_N or self._N
+        hits = []
+        for segment in segments:
+            terms = segment_terms.get(segment)
+            if not terms:
+                continue
+            max_scores = {term: max_score for (term, postings, max_score) in terms}
+            segment_hits = self.query_scorer.score_docs(
+                query_vec=t_vec,
+                postings_lists=[(term, postings)
+                                for (term, postings, max_score) in terms],
+                N=N,
+                get_doc_freq=get_doc_freq,
+                get_doc_len=self.get_doc_len,
+                get_term_max_score=max_scores.get,
+                get_doc_len_array=self.get_doc_len_array,
+                deleted=segment.deleted or None,
+                k=k)
+            hits.extend((-score, docid) for (docid, score) in segment_hits)
+        
+        # segments hold disjoint docids, so the top k hits overall are
+        # among the top k of each segment
+        hits = sorted(hits) if k is None else heapq.nsmallest(k, hits)
+        return ((self.docid_to_name(docid), -neg_score)
+                for (neg_score, docid) in hits)
@@ -56,6 +56,9 @@ from collections import defaultdict, MutableMapping
 from shelve import DbfilenameShelf as DBShelf
 
 from . import MapSimIndex
+from .cached_map import CachedMap
+from .postings import PostingsList, CompressedPostingsList
+from .term_dictionary import TermDictionary
 from ..exceptions import *
 
 class ShelfSimIndex(MapSimIndex):
@@ -64,23 +67,62 @@ class ShelfSimIndex(MapSimIndex):
     
     Shelf-based implementation of :class:`SimIndex`.  Indexes are backed with
     persistent :class:`shelve.DbfilenameShelf` objects.
+    
+    Since every postings list assignment re-pickles the whole list, new
+    postings and df deltas are held in a write-back buffer of up to
+    ``write_buffer_size`` postings (see :class:`MapSimIndex`).  Call
+    :meth:`commit()` (or :meth:`close()`) to write them to disk.
+    
+    On the read side, recently used postings lists and dfs are kept
+    decoded in LRU caches (see :class:`CachedMap`), and doc lengths are
+    served from a dense in-memory array rather than the shelf.  Postings
+    lists are stored as :class:`PostingsList` objects, which unpickle much
+    faster than lists of tuples (shelves written with lists of tuples
+    remain readable).  With ``compress_postings=True``, new postings lists
+    are stored as :class:`CompressedPostingsList` objects instead.
+    
+    The on-disk format is versioned (see ``FORMAT_VERSION``).  Shelves in
+    an unknown format, or written before terms were keyed by term id,
+    raise :class:`FileFormatException` when opened, and must be rebuilt.
     '''
     
+    # version 2: term index, dfs and doc vectors are keyed by term id
+    FORMAT_VERSION = 2
     
-    def __init__(self, filename, flag):
+    def __init__(self, filename, flag, postings_cache_size=1000000,
+                 df_cache_size=100000, compress_postings=False):
+        '''
+        Params:
+            filename: base filename for the shelves
+            flag: flag passed to :class:`shelve.DbfilenameShelf`
+            postings_cache_size: max number of postings held decoded in
+                                 the postings cache
+            df_cache_size: max number of terms held in the df cache
+            compress_postings: if True, store postings lists compressed
+        '''
         name_to_docid_map = StrKeyMap(DBShelf(filename + '_n2d', flag))
         docid_to_name_map = StrKeyMap(DBShelf(filename + '_d2n', flag))
         docid_to_feature_map = StrKeyMap(DBShelf(filename + '_feat', flag))
 
+        # term dictionary
+        term_to_id_map = StrKeyMap(DBShelf(filename + '_t2id', flag))
+        id_to_term_map = StrKeyMap(DBShelf(filename + '_id2t', flag))
+
         # term index
-        term_index = StrKeyMap(DBShelf(filename + '_term', flag))
+        term_index = CachedMap(StrKeyMap(DBShelf(filename + '_term', flag)),
+                               max_weight=postings_cache_size, weigh=len)
 
         # document vectors
         doc_vectors = StrKeyMap(DBShelf(filename + '_doc_vec', flag))
 
         # additional stats used for scoring
-        df_map = StrKeyMap(DBShelf(filename + '_df', flag))
+        df_map = CachedMap(StrKeyMap(DBShelf(filename + '_df', flag)),
+                           max_weight=df_cache_size)
         doc_len_map = StrKeyMap(DBShelf(filename + '_dl', flag))
+        max_score_map = StrKeyMap(DBShelf(filename + '_maxs', flag))
+
+        # index-wide values (e.g., the next docid to assign)
+        self._meta = StrKeyMap(DBShelf(filename + '_meta', flag))
 
         self._maps = dict(name_to_docid_map=name_to_docid_map,
                           docid_to_name_map=docid_to_name_map,
@@ -88,32 +130,103 @@ class ShelfSimIndex(MapSimIndex):
                           term_index=term_index,
                           doc_vectors=doc_vectors,
                           df_map=df_map,
-                          doc_len_map=doc_len_map)
-        
-        super(ShelfSimIndex, self).__init__(**self._maps)
+                          doc_len_map=doc_len_map,
+                          max_score_map=max_score_map)
         
+        super(ShelfSimIndex, self).__init__(
+            term_dict=TermDictionary(term_to_id_map, id_to_term_map),
+            postings_type=(CompressedPostingsList if compress_postings
+                           else PostingsList),
+            **self._maps)
+        self._maps.update(term_to_id_map=term_to_id_map,
+                          id_to_term_map=id_to_term_map,
+                          meta=self._meta)
+        try:
+            self._check_format()
+        except FileFormatException:
+            for map in self._maps.values():
+                map.close()
+            raise
+
         self._N = len(docid_to_name_map)
+        self._next_docid = self._meta.get('next_docid')
+        if self._next_docid is None:
+            # shelves written before next_docid was stored: docids are
+            # assigned sequentially, so resume after the largest one
+            docids = [int(docid) for docid in docid_to_name_map._map.keys()]
+            self._next_docid = max(docids or [-1]) + 1
+        self.set_config('write_buffer_size', 200000)
+
+    def _check_format(self):
+        '''Raises :class:`FileFormatException` if the shelves can't be read'''
+        version = self._meta.get('format_version')
+        if version is None:
+            # shelves from before the format was versioned.  Term-keyed
+            # shelves have docs but no term dictionary.
+            if (len(self._docid_to_name_map) and
+                not len(self._term_dict)):
+                raise FileFormatException(
+                    'ShelfSimIndex shelves use the unversioned term-keyed '
+                    'format, and must be rebuilt')
+        elif version != self.FORMAT_VERSION:
+            raise FileFormatException(
+                'Unsupported ShelfSimIndex format version: {}'.format(version))
+
+    def get_doc_len(self, docid):
+        # served from the dense in-memory copy, rather than the shelf
+        doc_lens = self.get_doc_len_array()
+        if docid < len(doc_lens):
+            return doc_lens[docid]
+        return super(ShelfSimIndex, self).get_doc_len(docid)
+
+    def commit(self):
+        '''
+        Flushes the write-back buffer, applies tombstones, and syncs the
+        shelves to disk
+        
+        Tombstones are only kept in memory, and deleted docs are already
+        gone from the name maps, so they're purged from the postings before
+        syncing; otherwise a reopened shelf would have postings for docids
+        without names.
+        '''
+        self.compact()
+        self._meta['format_version'] = self.FORMAT_VERSION
+        self._meta['next_docid'] = self._next_docid
+        for map in self._maps.values():
+            map.sync()
 
     def close(self):
+        # tombstones and the write-back buffer are kept in memory, so apply
+        # them before closing
+        self.compact()
+        self._meta['format_version'] = self.FORMAT_VERSION
+        self._meta['next_docid'] = self._next_docid
         for (mapname, map) in self._maps.items():
             map.close()
+        super(ShelfSimIndex, self).close()
 
 class StrKeyMap(MutableMapping):
     '''
     Ensure that key is converted to str type that is compatible with keys
-    for underlying map.
+    for underlying map.  Unicode keys are utf-8 encoded.
     '''
     def __init__(self, map):
         self._map = map
         
+    @staticmethod
+    def _str_key(key):
+        if isinstance(key, unicode):
+            return key.encode('utf-8')
+        return str(key)
+        
     def __getitem__(self, key):
-        return self._map[str(key)]
+        return self._map[self._str_key(key)]
         
     def __setitem__(self, key, value):
-        self._map[str(key)] = value
+        self._map[self._str_key(key)] = value
         
     def __delitem__(self, key):
-        del self._map[str(key)]
+        del self._map[self._str_key(key)]
         
     def __iter__(self):
         raise Exception('Unsupported')
@@ -122,5 +235,8 @@ class StrKeyMap(MutableMapping):
     def __len__(self):
         return len(self._map)
         
+    def sync(self):
+        return self._map.sync()
+        
     def close(self):
         return self._map.close()
@@ -45,6 +45,8 @@ from .. import doc_reader
 from .. import term_vec
 from ..exceptions import *
 from ..query_scorer import QueryScorer
+from .ingest import get_tokenizer, iter_term_vecs
+from .query_cache import QueryCache
 
 class SimIndex(object):
     '''
@@ -60,15 +62,33 @@ class SimIndex(object):
 
     __metaclass__ = abc.ABCMeta
     
+    # True if read methods (e.g., query()) may be called from several
+    # threads at once.  See ConcurrentSimIndex.
+    thread_safe_reads = False
+    
     def __init__(self):
         self._config = {
             'lowercase': True,
-            'stoplist': {}  # using dict instead of set, for rpc support
+            'stoplist': {},  # using dict instead of set, for rpc support
+            # if set, docs are tokenized by a pool of this many processes
+            # (see pysimsearch.sim_index.ingest)
+            'ingest_workers': 0,
+            'ingest_batch_size': 100,
+            'ingest_max_pending': 0,
         }
         self.query_scorer = None
+        self._query_scorer_name = None
         self._N = 0
         self._global_N = None
         self._next_docid = 0
+        
+        # bumped on any update that can change query results
+        self._generation = 0
+        self._query_cache = None
+        
+        # pool of tokenizer processes, kept across index_files() calls
+        # if ingest_workers is set
+        self._tokenizer = None
 
     def config(self, key):
         return self._config[key]
@@ -103,6 +123,7 @@ class SimIndex(object):
     def set_global_N(self, N):
         '''Set global number of documents'''
         self._global_N = N
+        self._bump_generation()
     
     def get_local_N(self):
         '''Return local number of documents'''
@@ -118,8 +139,39 @@ class SimIndex(object):
         '''
         if isinstance(query_scorer, basestring):
             self.query_scorer = QueryScorer.make_scorer(query_scorer)
+            self._query_scorer_name = query_scorer
         else:
             self.query_scorer = query_scorer
+            self._query_scorer_name = type(query_scorer).__name__
+        self._bump_generation()
+
+    def enable_query_cache(self, max_entries=1024, max_bytes=None):
+        '''Cache results of recent queries
+        
+        See :mod:`pysimsearch.sim_index.query_cache`.
+        
+        Params:
+            max_entries: maximum number of cached queries
+            max_bytes: if given, bound on approximate memory used by the cache
+        '''
+        self._query_cache = QueryCache(max_entries, max_bytes)
+        
+    def disable_query_cache(self):
+        '''Turn off query result caching'''
+        self._query_cache = None
+        
+    def query_cache_stats(self):
+        '''
+        Returns dict of query cache counters (hits, misses, evictions,
+        invalidations, entries, bytes), or an empty dict if caching is off
+        '''
+        if self._query_cache is None:
+            return {}
+        return self._query_cache.stats()
+    
+    def _bump_generation(self):
+        '''Invalidates cached query results.  Called by updates to the index'''
+        self._generation += 1
 
     @abc.abstractmethod
     def index_files(self, named_files):
@@ -166,6 +218,28 @@ class SimIndex(object):
             named_files.append((name, io.StringIO(string_buffer)))
         self.index_files(named_files)
         
+    def commit(self):
+        '''Makes pending updates durable.  Default implementation does nothing'''
+        return
+        
+    def close(self):
+        '''Shuts down the tokenizer pool, if one was started'''
+        if self._tokenizer is not None:
+            self._tokenizer.close()
+            self._tokenizer = None
+            
+    def _term_vecs(self, named_files):
+        '''
+        Yields (name, term vector) for each of ``named_files``, tokenized
+        per the index config (see :mod:`pysimsearch.sim_index.ingest`)
+        '''
+        self._tokenizer = get_tokenizer(self._tokenizer, self._config)
+        return iter_term_vecs(named_files, self._config, self._tokenizer)
+
+    def compact(self):
+        '''Purges deleted docs from the index.  Default implementation does nothing'''
+        return
+        
     @abc.abstractmethod
     def del_docids(self, *docids):
         '''Deletes documents corresponding to docids from the index'''
@@ -208,31 +282,123 @@ class SimIndex(object):
             terms = [term.lower() for term in terms]
         return (self.docid_to_name(docid) for docid in self.docids_with_terms(terms))
         
-    def query(self, q):
+    def query(self, q, k=None):
         '''Finds documents similar to q.
         
         Params:
             query: the query given as either a string or query vector
+            k: if given, only the top ``k`` results are returned
             
         Returns:
             A iterable of (docname, score) tuples sorted by score
         '''
+        query_vec = self._to_query_vec(q)
+        if self._query_cache is None:
+            return self._query(query_vec, k)
+        return self._cached_query(
+            query_vec, k, lambda: (list(self._query(query_vec, k)), True))
+        
+    def _cached_query(self, query_vec, k, compute):
+        '''
+        Returns the results of ``compute()`` for query_vec, via the query cache
+        
+        ``compute()`` is only called on a cache miss, and returns
+        (results, cacheable); results that aren't cacheable (e.g., partial
+        results) are returned, but not cached.
+        '''
+        cache = self._query_cache
+        if cache is None:
+            return list(compute()[0])
+        
+        key = self._query_cache_key(query_vec, k)
+        generation = self._generation
+        results = cache.get(key, generation)
+        if results is None:
+            (results, cacheable) = compute()
+            results = list(results)
+            if cacheable:
+                cache.put(key, results, generation)
+        return list(results)
+        
+    def query_with_status(self, q, k=None, timeout=None):
+        '''Finds documents similar to q, and reports whether results are partial
+        
+        A single index always returns all of its results, so ``timeout`` is
+        ignored.  See :meth:`SimIndexCollection.query_with_status()`, which
+        calls this on its shards so that results from remote collections
+        report their missing shards.
+        
+        Returns:
+            (hits, status), where ``hits`` is a list of (docname, score)
+            tuples sorted by score, and ``status`` is a dict with empty
+            ``'responded'`` and ``'missing'`` shard lists, and ``'partial'``
+            set to False
+        '''
+        return (list(self.query(q, k)),
+                {'responded': [], 'missing': [], 'partial': False})
+        
+    def query_many(self, queries, k=None):
+        '''Finds documents similar to each of the queries.
+        
+        Implementations may share work across the batch (e.g., fetching
+        the postings of a term once), and remote indexes handle the whole
+        batch in a single rpc.
+        
+        Params:
+            queries: list of queries, each given as a string or query vector
+            k: if given, only the top ``k`` results are returned per query
+            
+        Returns:
+            A list with a list of (docname, score) tuples sorted by score
+            for each query
+        '''
+        query_vecs = [self._to_query_vec(q) for q in queries]
+        if self._query_cache is None:
+            return self._query_many(query_vecs, k)
+        
+        # look up each query in the cache, then issue the misses as a batch
+        keys = [self._query_cache_key(query_vec, k) for query_vec in query_vecs]
+        generation = self._generation
+        results = [self._query_cache.get(key, generation) for key in keys]
+        misses = [i for (i, hits) in enumerate(results) if hits is None]
+        if misses:
+            computed = self._query_many([query_vecs[i] for i in misses], k)
+            for (i, hits) in zip(misses, computed):
+                hits = list(hits)
+                self._query_cache.put(keys[i], hits, generation)
+                results[i] = hits
+        return [list(hits) for hits in results]
+        
+    def _to_query_vec(self, q):
+        '''Returns query vector for q, given as either a string or vector'''
         if isinstance(q, basestring):
             if isinstance(q, str):
                 q = unicode(q)
-            return self._query(
-                term_vec.term_vec(q,
-                                  stoplist=self.config('stoplist'),
-                                  lowercase=self.config('lowercase')))
+            return term_vec.term_vec(q,
+                                     stoplist=self.config('stoplist'),
+                                     lowercase=self.config('lowercase'))
         else:
-            return self._query(q)
+            return q
+        
+    def _query_cache_key(self, query_vec, k):
+        '''Returns query cache key for query_vec'''
+        return QueryCache.make_key(query_vec, self._query_scorer_name, k,
+                                   lowercase=self.config('lowercase'))
+        
+    def _query_many(self, query_vecs, k=None):
+        '''Finds documents similar to each of query_vecs
+        
+        Default implementation issues the queries one at a time.
+        '''
+        return [list(self._query(query_vec, k)) for query_vec in query_vecs]
         
     @abc.abstractmethod
-    def _query(self, query_vec):
+    def _query(self, query_vec, k=None):
         '''Finds documents similar to query_vec
         
         Params:
             query_vec: term vector representing query document
+            k: if given, only the top ``k`` results are returned
         
         Returns:
             A iterable of (docname, score) tuples sorted by score
@@ -51,13 +51,21 @@ Sample usage::
 from __future__ import (division, absolute_import, print_function,
                         unicode_literals)
 
-from collections import defaultdict
-import operator
+from collections import defaultdict, deque
+from concurrent import futures
+import heapq
 import os
+import threading
+import time
 
 from . import SimIndex
 from ..exceptions import *
 
+# Fraction of a query deadline that a collection keeps for itself when
+# passing the deadline down to child collections, so that their (possibly
+# partial) results arrive in time to be merged
+DEADLINE_MARGIN = 0.1
+
 class SimIndexCollection(SimIndex):
     '''
     Inherits from :class:`pysimsearch.sim_index.SimIndex`.
@@ -80,6 +88,31 @@ class SimIndexCollection(SimIndex):
     
     The shard-function is only used for ``index_*()`` operations.  If you
     have a read-only collection, you don't need a sharding function.
+    
+    ``index_files()`` and ``index_string_buffers()`` stream their input:
+    documents are read lazily and grouped into per-shard batches of at most
+    ``shard_batch_size`` docs or ``shard_batch_bytes`` bytes, and each batch
+    is sent as soon as it fills.  Each shard has a single dispatch thread,
+    so shards are indexed concurrently but each sees its batches in order,
+    and at most ``shard_max_inflight`` batches per shard are queued or
+    running at a time, so memory use doesn't grow with the input.
+    
+    Queries, postings lookups and stats gathering are sent to all shards
+    concurrently, from a thread pool of at most ``shard_max_concurrency``
+    threads, so their latency is roughly that of the slowest shard rather
+    than the sum over shards.
+    
+    If ``shard_timeout`` is set (in seconds), ``query()`` only waits that
+    long for the shards, and leaves out the results of shards that miss
+    the deadline or fail.  :meth:`query_with_status()` also reports which
+    shards responded.  Each shard is queried with what's left of the
+    deadline, so child collections (local or remote) leave out their own
+    slow shards in time, and report it; for remote shards, also give each
+    :class:`RemoteSimIndex` a ``query_timeout``, so that abandoned calls
+    don't tie up the shard thread pool.  A shard is not queried again
+    while a call that missed its deadline is still running, so hung
+    shards tie up at most one pool thread each; if ``shard_max_concurrency``
+    or more shards hang, queries to the other shards stall as well.
     '''
     
     def __init__(self, shards=(), root=True):
@@ -93,7 +126,20 @@ class SimIndexCollection(SimIndex):
         
         self._dirty = False
         
+        self._executor = None
+        self._executor_key = None
+        self._executor_lock = threading.Lock()
+        # id(shard) -> shard, for shards with a call still running past
+        # its deadline
+        self._stragglers = {}
+        self._stragglers_lock = threading.Lock()
+        
         self.set_config('root', root, passthrough=False)
+        self.set_config('shard_batch_size', 100, passthrough=False)
+        self.set_config('shard_batch_bytes', 1 << 20, passthrough=False)
+        self.set_config('shard_max_inflight', 2, passthrough=False)
+        self.set_config('shard_max_concurrency', 16, passthrough=False)
+        self.set_config('shard_timeout', None, passthrough=False)
         
         if shards:
             self.add_shards(*shards)
@@ -112,8 +158,89 @@ class SimIndexCollection(SimIndex):
             for shard in self._shards:
                 shard.update_config(**d)
 
+    def _map_shards(self, func):
+        '''
+        Returns ``[func(shard) for shard in shards]``, with up to
+        ``shard_max_concurrency`` shards called at a time
+        '''
+        shards = list(self._shards)
+        if len(shards) <= 1 or self.config('shard_max_concurrency') <= 1:
+            return [func(shard) for shard in shards]
+        return list(self._get_executor().map(func, shards))
+    
+    def _map_shards_with_deadline(self, func, timeout):
+        '''
+        Like :meth:`_map_shards()`, but waits at most ``timeout`` seconds
+        
+        A shard whose call missed an earlier deadline, and is still
+        running, isn't called again until that call returns; it's counted
+        as missing instead.  So a hung shard holds at most one thread of
+        the pool, and queries still get answers from the other shards as
+        long as fewer than ``shard_max_concurrency`` shards hang.
+        
+        Returns:
+            (results, missing), where ``results`` has None in place of the
+            results of shards that raised, missed the deadline or were
+            skipped, and ``missing`` lists their shard ids
+        '''
+        executor = self._get_executor()
+        shards = list(self._shards)
+        with self._stragglers_lock:
+            fs = [None if id(shard) in self._stragglers
+                  else executor.submit(func, shard)
+                  for shard in shards]
+        (done, not_done) = futures.wait([future for future in fs
+                                         if future is not None],
+                                        timeout=timeout)
+        results = []
+        missing = []
+        for (shard, future) in zip(shards, fs):
+            if future in done and future.exception() is None:
+                results.append(future.result())
+                continue
+            # don't start shard calls that are still queued
+            if future is not None and not future.cancel() and not future.done():
+                self._add_straggler(shard, future)
+            results.append(None)
+            missing.append(len(results) - 1)
+        return (results, missing)
+    
+    def _add_straggler(self, shard, future):
+        '''Skips ``shard`` in deadline calls until ``future`` is done'''
+        with self._stragglers_lock:
+            self._stragglers[id(shard)] = shard
+        def remove(future):
+            with self._stragglers_lock:
+                self._stragglers.pop(id(shard), None)
+        future.add_done_callback(remove)
+    
+    def _get_executor(self):
+        '''
+        Returns thread pool for shard calls
+        
+        A new pool is started after a fork, since the pool's threads
+        don't exist in the child process (e.g., a collection passed as a
+        backend to a forked :func:`sim_server.start_sim_index_server()`).
+        '''
+        max_concurrency = max(1, self.config('shard_max_concurrency'))
+        key = (max_concurrency, os.getpid())
+        with self._executor_lock:
+            if self._executor_key != key:
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False)
+                self._executor = futures.ThreadPoolExecutor(
+                    max_workers=max_concurrency)
+                self._executor_key = key
+            return self._executor
+
+    @property
+    def thread_safe_reads(self):
+        '''Reads are fanned out to the shards, so must be safe for each'''
+        return all(shard.thread_safe_reads for shard in self._shards)
+
     def clear_shards(self):
         self._shards = []
+        self._bump_generation()
         
     def add_shards(self, *sim_index_shards):
         for shard in sim_index_shards:
@@ -134,10 +261,12 @@ class SimIndexCollection(SimIndex):
     def set_global_N(self, N):
         for shard in self._shards:
             shard.set_global_N(N)
+        self._bump_generation()
 
     def set_global_df_map(self, df_map):
         for shard in self._shards:
             shard.set_global_df_map(df_map)
+        self._bump_generation()
         
     def get_local_df_map(self):
         return self._df_map
@@ -163,38 +292,76 @@ class SimIndexCollection(SimIndex):
     @update_trigger
     def index_files(self, named_files):
         '''
-        Translate to index_string_buffers() call, since file objects
-        can't be serialized for rpcs to backends.  Note: we
-        currently read in all files in memory, and make one call to
-        index_string_buffers() -- this can be memory-intesive
-        if named_files represents a large number of files.
-        
-        TODO: read in files in smaller batches, and then make mutiple
-        calls to index_string_buffers().
+        Translate to index_string_buffers() calls, since file objects
+        can't be serialized for rpcs to backends.  Files are read lazily,
+        as batches for the shards are filled.
         '''
-        named_string_buffers = [(name, file.read())
-            for (name, file) in named_files]
-        self.index_string_buffers(named_string_buffers)
+        def read_files():
+            for (name, file) in named_files:
+                with file:
+                    yield (name, file.read())
+        self._index_batches(read_files())
 
     @update_trigger
     def index_string_buffers(self, named_string_buffers):
-        '''Routes index_string_buffers() call to appropriate shard.'''
-        # minimize rpcs by collecting (name, buffer) tuples for
-        # different shards up-front
-        sharded_input_map = defaultdict(list)
-        for (name, buffer) in named_string_buffers:
-            sharded_input_map[self.shard_func(name)].append((name, buffer))
-
-        # issue an indexing rpc to each sharded backend that has some input
-        # TODO: use non-blocking rpc's
-        for shard_id in sharded_input_map:
-            self._shards[shard_id].index_string_buffers(
-                sharded_input_map[shard_id]
-            )
+        '''Routes index_string_buffers() calls to appropriate shards.'''
+        self._index_batches(named_string_buffers)
+        
+    def _index_batches(self, named_string_buffers):
+        '''
+        Streams ``named_string_buffers`` to the shards, in bounded batches
+        '''
+        num_shards = len(self._shards)
+        batch_size = self.config('shard_batch_size')
+        batch_bytes = self.config('shard_batch_bytes')
+        max_inflight = self.config('shard_max_inflight')
+        
+        # one single-threaded executor per shard keeps each shard's
+        # batches in order
+        executors = [futures.ThreadPoolExecutor(max_workers=1)
+                     for shard_id in range(num_shards)]
+        inflight = [deque() for shard_id in range(num_shards)]
+        batches = [[] for shard_id in range(num_shards)]
+        sizes = [0] * num_shards
+        
+        def dispatch(shard_id):
+            # reap finished batches (raising any shard errors), and wait
+            # for the oldest if the shard has too many in flight
+            queue = inflight[shard_id]
+            while queue and (queue[0].done() or len(queue) >= max_inflight):
+                queue.popleft().result()
+            queue.append(executors[shard_id].submit(
+                self._shards[shard_id].index_string_buffers, batches[shard_id]))
+            batches[shard_id] = []
+            sizes[shard_id] = 0
+            
+        try:
+            for (name, buffer) in named_string_buffers:
+                shard_id = self.shard_func(name)
+                batches[shard_id].append((name, buffer))
+                sizes[shard_id] += len(buffer)
+                if (len(batches[shard_id]) >= batch_size or
+                    sizes[shard_id] >= batch_bytes):
+                    dispatch(shard_id)
+            for shard_id in range(num_shards):
+                if batches[shard_id]:
+                    dispatch(shard_id)
+            for queue in inflight:
+                while queue:
+                    queue.popleft().result()
+        finally:
+            for executor in executors:
+                executor.shutdown(wait=True)
 
     @update_trigger
     def index_urls(self, *urls):
-        '''Index web pages given by urls'''
+        '''
+        Index web pages given by urls
+        
+        Shards that index in the background (e.g., ConcurrentSimIndexes)
+        are waited on, so that the stats gathered afterwards include the
+        new pages.
+        '''
         # minimize rpcs by collecting (name, buffer) tuples for
         # different shards up-front
         sharded_input_map = defaultdict(list)
@@ -203,12 +370,19 @@ class SimIndexCollection(SimIndex):
 
         # Issue an indexing call to each sharded backend that has some input
         # Generally the sharded servers should be backed with
-        # ConcurrentSimIndexes so that the index_urls() call will generally
-        # be non-blocking.
+        # ConcurrentSimIndexes so that the shards fetch and index their
+        # urls in parallel.
+        tokens = {}
         for shard_id in sharded_input_map:
-            self._shards[shard_id].index_urls(
+            tokens[shard_id] = self._shards[shard_id].index_urls(
                 *sharded_input_map[shard_id]
             )
+        
+        # background jobs return a token: wait for them (and raise any
+        # errors) before the update trigger gathers the new stats
+        for (shard_id, token) in tokens.iteritems():
+            if token is not None:
+                self._shards[shard_id].wait(token)
 
     @update_trigger
     def del_docids(self, *docids):
@@ -230,6 +404,16 @@ class SimIndexCollection(SimIndex):
         for (shard_id, remote_docids) in sharded_del_map.items():
             self._shards[shard_id].del_docids(*remote_docids)
     
+    def compact(self):
+        '''Passes ``compact()`` request to all shards'''
+        for shard in self._shards:
+            shard.compact()
+
+    def commit(self):
+        '''Passes ``commit()`` request to all shards'''
+        for shard in self._shards:
+            shard.commit()
+
     @staticmethod
     def make_node_docid(shard_id, docid):
         return "{}-{}".format(shard_id, docid)
@@ -245,15 +429,32 @@ class SimIndexCollection(SimIndex):
     def postings_list(self, term):
         '''Returns aggregated postings list in terms of global docids'''
 
+        shard_postings = self._map_shards(
+            lambda shard: list(shard.postings_list(term)))
         merged_postings_list = []
-        for shard_id in range(len(self._shards)):
+        for (shard_id, postings) in enumerate(shard_postings):
             merged_postings_list.extend(
                  [(self.make_node_docid(shard_id, docid), freq) for
-                  (docid, freq) in self._shards[shard_id].postings_list(term)]
+                  (docid, freq) in postings]
                 )
         
         return merged_postings_list
     
+    def docids_with_terms(self, terms):
+        '''Returns sorted list of global docids of docs containing all terms
+        
+        Each shard intersects its own postings, so only matching docids
+        are returned by shards.
+        '''
+        terms = list(terms)
+        shard_docids = self._map_shards(
+            lambda shard: shard.docids_with_terms(terms))
+        docids = []
+        for (shard_id, shard_docid_list) in enumerate(shard_docids):
+            docids.extend(self.make_node_docid(shard_id, docid)
+                          for docid in shard_docid_list)
+        return sorted(docids)
+    
     def set_query_scorer(self, query_scorer):
         '''Passes ``set_query_scorer()`` request to all shards.
         
@@ -265,21 +466,128 @@ class SimIndexCollection(SimIndex):
         '''
         for shard in self._shards:
             shard.set_query_scorer(query_scorer)
+        if isinstance(query_scorer, basestring):
+            self._query_scorer_name = query_scorer
+        else:
+            self._query_scorer_name = type(query_scorer).__name__
+        self._bump_generation()
             
-    def _query(self, query_vec):
+    def query(self, q, k=None):
+        '''Finds documents similar to q.
+        
+        See :meth:`SimIndex.query()`.  If the ``shard_timeout`` config is
+        set, results of shards that miss it are left out.
+        '''
+        return self.query_with_status(q, k)[0]
+    
+    def query_with_status(self, q, k=None, timeout=None):
+        '''Finds documents similar to q, and reports which shards responded
+        
+        Params:
+            q: the query given as either a string or query vector
+            k: if given, only the top ``k`` results are returned
+            timeout: seconds to wait for shards (by default, the
+                     ``shard_timeout`` config, and if that's None, wait
+                     for all shards)
+            
+        Returns:
+            (hits, status), where ``hits`` is a list of (docname, score)
+            tuples sorted by score, and ``status`` is a dict with lists of
+            shard ids that ``'responded'`` and that are ``'missing'``
+            (failed or timed out), and ``'partial'``, which is True if
+            results from any shard (or from a child collection's shard)
+            are missing.  Partial results are not cached.
+        '''
+        query_vec = self._to_query_vec(q)
+        if timeout is None:
+            timeout = self.config('shard_timeout')
+        status = {'responded': range(len(self._shards)),
+                  'missing': [],
+                  'partial': False}
+        
+        def compute():
+            if timeout is None:
+                return (self._query(query_vec, k), True)
+            (results, deadline_status) = self._query_with_deadline(
+                query_vec, k, timeout)
+            status.update(deadline_status)
+            return (results, not status['partial'])
+        
+        return (self._cached_query(query_vec, k, compute), status)
+    
+    def _query_with_deadline(self, query_vec, k, timeout):
+        '''Returns (hits, status) for :meth:`query_with_status()`'''
+        child_deadline = time.time() + (1 - DEADLINE_MARGIN) * timeout
+        partial = [False]
+        def query_shard(shard):
+            # pass down what's left of the deadline
+            (hits, status) = shard.query_with_status(
+                query_vec, k, max(0, child_deadline - time.time()))
+            if status['partial']:
+                partial[0] = True
+            return hits
+        
+        (shard_results, missing) = self._map_shards_with_deadline(query_shard,
+                                                                  timeout)
+        status = {'responded': [shard_id for shard_id in range(len(self._shards))
+                                if shard_id not in missing],
+                  'missing': missing,
+                  'partial': bool(missing) or partial[0]}
+        return (self._merge_hits(shard_results, k), status)
+        
+    def _query(self, query_vec, k=None):
         '''Issues query to collection and returns merged results
         
+        If ``k`` is given, each shard returns only its own top ``k``, and
+        the top ``k`` of those are selected with a heap.
+        
         TODO: use a merge alg. (heapq.merge doesn't have a key= arg yet)
         TODO: add support for rank-aggregation in the case of heterogenous
               collections where ir scores are not directly comparable
         '''
-        results = []
-        for shard in self._shards:
-            results.extend(shard.query(query_vec))
-        results.sort(key=operator.itemgetter(1), reverse=True)
-        return results
+        return self._merge_hits(
+            self._map_shards(lambda shard: shard.query(query_vec, k)), k)
+
+    def _query_many(self, query_vecs, k=None):
+        '''Issues a batch of queries to collection and returns merged results
+        
+        Each shard gets the whole batch in a single call (and so in a single
+        rpc for remote shards), and shards are queried concurrently.
+        '''
+        if not self._shards:
+            return [[] for query_vec in query_vecs]
+        shard_results = self._map_shards(
+            lambda shard: shard.query_many(query_vecs, k))
+        
+        return [self._merge_hits([shard_result[i]
+                                  for shard_result in shard_results], k)
+                for i in range(len(query_vecs))]
+
+    @staticmethod
+    def _merge_hits(shard_hits, k=None):
+        '''Returns hits from shards sorted by score, keeping the top k
+        
+        Params:
+            shard_hits: list with the hits of each shard (or None, for
+                        shards that are missing), in shard id order
+            k: if given, only the top ``k`` hits are returned
+        
+        Ties are broken by shard id, and then by rank within the shard
+        (i.e., by docid for leaf shards), so that results don't depend on
+        the order in which shards reply.
+        '''
+        keyed_hits = [(-hit[1], shard_id, rank, hit)
+                      for (shard_id, hits) in enumerate(shard_hits)
+                      if hits is not None
+                      for (rank, hit) in enumerate(hits)]
+        if k is not None:
+            keyed_hits = heapq.nsmallest(k, keyed_hits)
+        else:
+            keyed_hits.sort()
+        return [hit for (neg_score, shard_id, rank, hit) in keyed_hits]
 
     def update_trigger_helper(self):
+        self._bump_generation()
         self.update_node_stats()
 
         # If we're the root of the collection, then propogate back node
@@ -305,14 +613,17 @@ class SimIndexCollection(SimIndex):
                 target[term] += df
 
         # Collect global stats
+        shard_stats = self._map_shards(
+            lambda shard: (shard.get_local_N(),
+                           shard.get_local_df_map(),
+                           shard.get_name_to_docid_map()))
         self._N = 0
         self._df_map = {}
         name_to_docid_maps = {}
-        for shard_id in range(len(self._shards)):
-            shard = self._shards[shard_id]
-            self._N += shard.get_local_N()
-            merge_df_map(self._df_map, shard.get_local_df_map())
-            name_to_docid_maps[shard_id] = shard.get_name_to_docid_map()
+        for (shard_id, (N, df_map, name_to_docid_map)) in enumerate(shard_stats):
+            self._N += N
+            merge_df_map(self._df_map, df_map)
+            name_to_docid_maps[shard_id] = name_to_docid_map
 
         # Update our name <-> node_docid mapping
         for (shard_id, name_to_docid_map) in name_to_docid_maps.iteritems():
@@ -323,7 +634,8 @@ class SimIndexCollection(SimIndex):
 
     def broadcast_node_stats(self):  
         # Broadcast global stats.  Only called by collection root node.
-        for shard in self._shards:
+        def broadcast(shard):
             shard.set_global_N(self._N)
             shard.set_global_df_map(self._df_map)
+        self._map_shards(broadcast)
 
@@ -0,0 +1,448 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2011, Taher Haveliwala <oss@taherh.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#         * Redistributions of source code must retain the above copyright
+#           notice, this list of conditions and the following disclaimer.
+#         * Redistributions in binary form must reproduce the above copyright
+#           notice, this list of conditions and the following disclaimer in the
+#           documentation and/or other materials provided with the distribution.
+#         * The names of project contributors may not be used to endorse or
+#           promote products derived from this software without specific
+#           prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+'''
+SqliteSimIndex
+
+Sample usage::
+
+    from pprint import pprint
+    from pysimsearch.sim_index import SqliteSimIndex
+
+    sim_index = SqliteSimIndex('myindex.db')
+    sim_index.index_urls('http://www.stanford.edu/',
+                         'http://www.berkeley.edu',
+                         'http://www.ucla.edu',
+                         'http://www.mit.edu')
+    sim_index.commit()
+
+    # meanwhile, in any number of other processes
+    reader = SqliteSimIndex('myindex.db', readonly=True)
+    pprint(list(reader.query("stanford university")))
+
+'''
+
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+
+from array import array
+from collections import MutableMapping
+from contextlib import contextmanager
+import json
+import os
+import sqlite3
+from urllib import pathname2url
+
+from . import MapSimIndex
+from .cached_map import CachedMap
+from .postings import PostingsList, pack_postings, unpack_postings
+from .term_dictionary import TermDictionary
+from ..exceptions import *
+
+class SqliteSimIndex(MapSimIndex):
+    '''
+    Inherits from :class:`pysimsearch.sim_index.MapSimIndex`.
+    
+    SQLite-backed implementation of :class:`SimIndex`.  Each index map is a
+    two-column table in a single database file, with postings lists and doc
+    vectors stored as packed BLOBs (see
+    :func:`pysimsearch.sim_index.postings.pack_postings`).
+    
+    The database runs in WAL mode, so one writer process can keep indexing
+    while any number of reader processes (opened with ``readonly=True``)
+    query it.  Updates are buffered in memory and written in bulk with
+    ``executemany()``; they become durable, and visible to readers, on
+    :meth:`commit()`.  Readers pick up commits automatically before each
+    query.
+    
+    Readers open the database read-only, so opening a missing file fails
+    rather than creating it, and never write to it.  Each read runs in a
+    single transaction, so it sees one committed version of the index even
+    if the writer commits midway.
+    '''
+    
+    def __init__(self, filename, readonly=False, postings_cache_size=1000000):
+        '''
+        Params:
+            filename: database filename
+            readonly: if True, open as a reader; updates raise
+                      :class:`ReadOnlyIndexException`
+            postings_cache_size: max number of postings held decoded in
+                                 the postings cache
+        '''
+        self._readonly = readonly
+        if readonly:
+            # transactions are begun explicitly, by _snapshot()
+            self._conn = _connect_readonly(filename)
+            self._conn.isolation_level = None
+        else:
+            self._conn = sqlite3.connect(filename, **_CONNECT_ARGS)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._in_snapshot = False
+        if readonly:
+            # load the maps and stats from one committed version
+            self._conn.execute('BEGIN')
+        
+        def make_map(table, key_type, **kwargs):
+            return SqliteMap(self._conn, table, key_type,
+                             create=not readonly, **kwargs)
+        
+        self._sqlite_maps = dict(
+            name_to_docid_map=make_map('name_to_docid', 'TEXT'),
+            docid_to_name_map=make_map('docid_to_name', 'INTEGER'),
+            docid_to_feature_map=make_map('docid_to_feature', 'INTEGER'),
+            term_index=make_map('term_index', 'INTEGER',
+                                encode=pack_postings, decode=unpack_postings),
+            doc_vectors=make_map('doc_vectors', 'INTEGER',
+                                 encode=_pack_doc_vec, decode=_unpack_doc_vec),
+            df_map=make_map('df', 'INTEGER'),
+            doc_len_map=make_map('doc_len', 'INTEGER'),
+            max_score_map=make_map('max_score', 'INTEGER'),
+            term_to_id_map=make_map('term_to_id', 'TEXT'),
+            id_to_term_map=make_map('id_to_term', 'INTEGER'))
+        self._meta = make_map('meta', 'TEXT')
+        if not readonly:
+            self._conn.commit()
+        
+        maps = dict(self._sqlite_maps)
+        maps['term_index'] = CachedMap(maps['term_index'],
+                                       max_weight=postings_cache_size,
+                                       weigh=len)
+        term_dict = TermDictionary(maps.pop('term_to_id_map'),
+                                   maps.pop('id_to_term_map'))
+        super(SqliteSimIndex, self).__init__(term_dict=term_dict,
+                                             postings_type=PostingsList,
+                                             **maps)
+        self.set_config('write_buffer_size', 200000)
+        
+        self._data_version = None
+        self._load_meta()
+        if readonly:
+            self._conn.execute('COMMIT')
+        
+    def _load_meta(self):
+        '''Loads index stats and config saved by :meth:`commit()`'''
+        meta = self._meta
+        self._N = meta.get('N', 0)
+        self._next_docid = meta.get('next_docid', 0)
+        if 'config' in meta:
+            self.update_config(**json.loads(meta['config']))
+        self._data_version = self._conn.execute(
+            'PRAGMA data_version').fetchone()[0]
+            
+    def _refresh(self):
+        '''Picks up changes committed by other connections (readers only)'''
+        if not self._readonly:
+            return
+        data_version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+        if data_version != self._data_version:
+            for map in self._sqlite_maps.values():
+                map.reload()
+            self._term_index.clear_cache()
+            with self._doc_len_array_lock:
+                self._doc_len_array = array(str('d'))
+            self._load_meta()
+            self._bump_generation()
+            
+    @contextmanager
+    def _snapshot(self):
+        '''
+        For readers, runs the enclosed reads in one transaction, after
+        picking up any new commits.  Nested uses share the transaction.
+        '''
+        if not self._readonly or self._in_snapshot:
+            yield
+            return
+        self._conn.execute('BEGIN')
+        self._in_snapshot = True
+        try:
+            self._refresh()
+            yield
+        finally:
+            self._in_snapshot = False
+            self._conn.execute('COMMIT')
+        
+    def query(self, q, k=None):
+        with self._snapshot():
+            return list(super(SqliteSimIndex, self).query(q, k))
+        
+    def query_many(self, queries, k=None):
+        with self._snapshot():
+            return super(SqliteSimIndex, self).query_many(queries, k)
+        
+    def postings_list(self, term):
+        with self._snapshot():
+            return super(SqliteSimIndex, self).postings_list(term)
+        
+    def get_local_N(self):
+        with self._snapshot():
+            return super(SqliteSimIndex, self).get_local_N()
+        
+    def get_local_df_map(self):
+        with self._snapshot():
+            return super(SqliteSimIndex, self).get_local_df_map()
+        
+    def get_name_to_docid_map(self):
+        with self._snapshot():
+            return dict(self._name_to_docid_map.iteritems())
+            
+    def get_doc_len(self, docid):
+        # served from the dense in-memory copy, rather than a query per hit
+        doc_lens = self.get_doc_len_array()
+        if docid < len(doc_lens):
+            return doc_lens[docid]
+        return super(SqliteSimIndex, self).get_doc_len(docid)
+        
+    def get_doc_len_array(self):
+        '''
+        Returns an ``array('d')`` of doc lengths indexed by docid, with 0
+        for deleted docids.  Doc lengths missing from the array are read
+        with a single range query.
+        '''
+        doc_lens = self._doc_len_array
+        if len(doc_lens) < self._next_docid:
+            with self._doc_len_array_lock:
+                doc_lens = self._doc_len_array
+                start = len(doc_lens)
+                missing = array(str('d'), [0]) * (self._next_docid - start)
+                doc_len_map = self._sqlite_maps['doc_len_map']
+                for (docid, doc_len) in doc_len_map.iteritems_between(
+                        start, self._next_docid):
+                    missing[docid - start] = doc_len
+                doc_lens.extend(missing)
+        return doc_lens
+        
+    def index_files(self, named_files):
+        if self._readonly:
+            raise ReadOnlyIndexException('SqliteSimIndex opened read-only')
+        return super(SqliteSimIndex, self).index_files(named_files)
+        
+    def del_docids(self, *docids):
+        if self._readonly:
+            raise ReadOnlyIndexException('SqliteSimIndex opened read-only')
+        return super(SqliteSimIndex, self).del_docids(*docids)
+        
+    def _flush_pending(self):
+        '''Applies buffered updates to the database, with bulk writes'''
+        super(SqliteSimIndex, self)._flush_pending()
+        for map in self._sqlite_maps.values():
+            map.flush()
+        
+    def commit(self):
+        '''Writes all buffered updates, and commits them to the database'''
+        if self._readonly:
+            return
+        # tombstones are kept in memory, so apply them before committing,
+        # since readers can't see them
+        if len(self._deleted):
+            self.compact()
+        self._flush_pending()
+        self._meta['N'] = self._N
+        self._meta['next_docid'] = self._next_docid
+        self._meta['config'] = json.dumps(self._config)
+        self._meta.flush()
+        self._conn.commit()
+        
+    def close(self):
+        self.commit()
+        self._conn.close()
+        super(SqliteSimIndex, self).close()
+
+_CONNECT_ARGS = dict(timeout=60, check_same_thread=False)
+
+def _connect_readonly(filename):
+    '''
+    Opens ``filename`` read-only, without creating it.
+    
+    Uses a ``mode=ro`` URI filename.  Python 2's ``sqlite3.connect()`` has
+    no ``uri`` argument, so there URIs are only understood if SQLite was
+    built with ``SQLITE_USE_URI``; otherwise, the file is checked for and
+    opened with ``PRAGMA query_only``.
+    '''
+    uri = 'file:{}?mode=ro'.format(pathname2url(os.path.abspath(filename)))
+    try:
+        return sqlite3.connect(uri, uri=True, **_CONNECT_ARGS)
+    except TypeError:
+        pass
+    if 'USE_URI' in _compile_options():
+        return sqlite3.connect(uri, **_CONNECT_ARGS)
+    if not os.path.isfile(filename):
+        raise sqlite3.OperationalError('unable to open database file')
+    conn = sqlite3.connect(filename, **_CONNECT_ARGS)
+    conn.execute('PRAGMA query_only=ON')
+    return conn
+
+def _compile_options():
+    '''Returns the set of options SQLite was built with'''
+    conn = sqlite3.connect(':memory:')
+    try:
+        return set(row[0].split('=')[0] for row in
+                   conn.execute('PRAGMA compile_options'))
+    finally:
+        conn.close()
+
+def _pack_doc_vec(doc_vec):
+    '''Packs a doc vector ({tid: freq}) like a postings list'''
+    return pack_postings(sorted(doc_vec.iteritems()))
+
+def _unpack_doc_vec(data):
+    return dict(unpack_postings(data))
+
+class SqliteMap(MutableMapping):
+    '''
+    Dict-like view of a (key, value) table in a SQLite database.
+    
+    Writes are buffered in memory until :meth:`flush()`, which applies them
+    with ``executemany()``; reads see buffered writes.  Flushing does not
+    commit the enclosing transaction.
+    '''
+    
+    # marks a buffered deletion
+    _DELETED = object()
+    
+    def __init__(self, conn, table, key_type, encode=None, decode=None,
+                 create=True):
+        '''
+        Params:
+            conn: ``sqlite3`` connection
+            table: table name
+            key_type: SQL type of keys (e.g., ``'INTEGER'`` or ``'TEXT'``)
+            encode: function mapping values to SQLite values (e.g., to BLOB
+                    data).  By default, values are stored as is.
+            decode: inverse of ``encode``
+            create: if True, the table is created if needed
+        '''
+        self._conn = conn
+        self._table = table
+        self._encode = encode
+        self._decode = decode
+        if create:
+            conn.execute('CREATE TABLE IF NOT EXISTS {} '
+                         '(key {} PRIMARY KEY, value)'.format(table, key_type))
+        self._select_sql = 'SELECT value FROM {} WHERE key = ?'.format(table)
+        self._pending = {}
+        self.reload()
+        
+    def reload(self):
+        '''Drops buffered writes, and re-reads the table size'''
+        self._pending = {}
+        self._len = self._conn.execute(
+            'SELECT COUNT(*) FROM {}'.format(self._table)).fetchone()[0]
+        
+    def _to_value(self, value):
+        if self._decode is not None:
+            return self._decode(value)
+        return value
+        
+    def __getitem__(self, key):
+        value = self._pending.get(key)
+        if value is not None:
+            if value is self._DELETED:
+                raise KeyError(key)
+            return value
+        row = self._conn.execute(self._select_sql, (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return self._to_value(row[0])
+        
+    def __contains__(self, key):
+        value = self._pending.get(key)
+        if value is not None:
+            return value is not self._DELETED
+        return self._conn.execute(self._select_sql, (key,)).fetchone() is not None
+        
+    def __setitem__(self, key, value):
+        if key not in self:
+            self._len += 1
+        self._pending[key] = value
+        
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._len -= 1
+        self._pending[key] = self._DELETED
+        
+    def __iter__(self):
+        for (key, value) in self.iteritems():
+            yield key
+            
+    def iteritems(self):
+        pending = self._pending
+        rows = self._conn.execute(
+            'SELECT key, value FROM {}'.format(self._table)).fetchall()
+        for (key, value) in rows:
+            if key not in pending:
+                yield (key, self._to_value(value))
+        for (key, value) in pending.items():
+            if value is not self._DELETED:
+                yield (key, value)
+                
+    def iteritems_between(self, lo, hi):
+        '''Yields (key, value) pairs with ``lo <= key < hi``'''
+        pending = self._pending
+        rows = self._conn.execute(
+            'SELECT key, value FROM {} WHERE key >= ? AND key < ?'.format(
+                self._table), (lo, hi)).fetchall()
+        for (key, value) in rows:
+            if key not in pending:
+                yield (key, self._to_value(value))
+        for (key, value) in pending.items():
+            if lo <= key < hi and value is not self._DELETED:
+                yield (key, value)
+                
+    def items(self):
+        return list(self.iteritems())
+        
+    def __len__(self):
+        return self._len
+        
+    def flush(self):
+        '''Writes buffered updates to the table'''
+        pending = self._pending
+        self._pending = {}
+        encode = self._encode
+        upserts = []
+        deletes = []
+        for (key, value) in pending.iteritems():
+            if value is self._DELETED:
+                deletes.append((key,))
+            else:
+                if encode is not None:
+                    value = encode(value)
+                    if isinstance(value, bytes):
+                        value = buffer(value)
+                upserts.append((key, value))
+        if upserts:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO {} (key, value) VALUES (?, ?)'.format(
+                    self._table), upserts)
+        if deletes:
+            self._conn.executemany(
+                'DELETE FROM {} WHERE key = ?'.format(self._table), deletes)
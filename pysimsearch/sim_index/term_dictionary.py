@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2011, Taher Haveliwala <oss@taherh.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#         * Redistributions of source code must retain the above copyright
+#           notice, this list of conditions and the following disclaimer.
+#         * Redistributions in binary form must reproduce the above copyright
+#           notice, this list of conditions and the following disclaimer in the
+#           documentation and/or other materials provided with the distribution.
+#         * The names of project contributors may not be used to endorse or
+#           promote products derived from this software without specific
+#           prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+'''
+TermDictionary
+
+Maps each term to a dense integer term id.  Index structures can then be
+keyed by term ids, so that each term string is stored only once, and
+hashing in the scoring loop is done on small ints rather than strings.
+
+Sample usage::
+
+    from pysimsearch.sim_index.term_dictionary import TermDictionary
+
+    term_dict = TermDictionary()
+    tid = term_dict.add('hello')    # 0
+    term_dict.get_id('hello')       # 0
+    term_dict.get_id('world')       # None
+    term_dict.term(tid)             # 'hello'
+
+'''
+
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+
+class TermDictionary(object):
+    '''
+    Bidirectional mapping between terms and dense integer term ids.
+    
+    Term ids are assigned sequentially starting from 0, and are never
+    reassigned.  By default the mapping is held in memory; persistent
+    dict-like objects may be given instead (see
+    :class:`pysimsearch.sim_index.ShelfSimIndex`).
+    '''
+
+    def __init__(self, term_to_id_map=None, id_to_term_map=None):
+        '''
+        Params:
+            term_to_id_map: dict-like object mapping terms to term ids
+            id_to_term_map: dict-like object mapping term ids to terms.
+                            Defaults to a ``list``, indexed by term id.
+        '''
+        self._term_to_id = term_to_id_map if term_to_id_map is not None else {}
+        self._id_to_term = id_to_term_map if id_to_term_map is not None else []
+
+    def add(self, term):
+        '''Returns the term id for ``term``, assigning a new one if needed'''
+        tid = self._term_to_id.get(term)
+        if tid is None:
+            tid = len(self._term_to_id)
+            self._term_to_id[term] = tid
+            if isinstance(self._id_to_term, list):
+                self._id_to_term.append(term)
+            else:
+                self._id_to_term[tid] = term
+        return tid
+
+    def get_id(self, term):
+        '''Returns the term id for ``term``, or ``None`` if unknown'''
+        return self._term_to_id.get(term)
+
+    def term(self, tid):
+        '''Returns the term for term id ``tid``'''
+        return self._id_to_term[tid]
+
+    def __contains__(self, term):
+        return term in self._term_to_id
+
+    def __len__(self):
+        return len(self._term_to_id)
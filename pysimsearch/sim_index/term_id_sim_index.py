@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2011, Taher Haveliwala <oss@taherh.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#         * Redistributions of source code must retain the above copyright
+#           notice, this list of conditions and the following disclaimer.
+#         * Redistributions in binary form must reproduce the above copyright
+#           notice, this list of conditions and the following disclaimer in the
+#           documentation and/or other materials provided with the distribution.
+#         * The names of project contributors may not be used to endorse or
+#           promote products derived from this software without specific
+#           prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''
+TermIdSimIndex
+
+Base class for indexes whose postings, document frequencies and term max
+scores are keyed by integer term id (see
+:class:`pysimsearch.sim_index.MapSimIndex` and
+:class:`pysimsearch.sim_index.SegmentSimIndex`).  Provides the query path
+shared by these indexes: translating query vectors to term ids, fetching
+postings, and scoring them with the query scorer.
+
+'''
+
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+
+import abc
+
+from .sim_index import SimIndex
+
+class TermIdSimIndex(SimIndex):
+    '''
+    Inherits from :class:`pysimsearch.sim_index.SimIndex`.
+    
+    Subclasses implement :meth:`_term_id()` and :meth:`_query_postings()`,
+    along with the stats passed to the query scorer: ``get_doc_freq()``,
+    ``get_doc_len()``, ``get_term_max_score()`` and
+    ``get_doc_len_array()``, all of which take term ids rather than terms.
+    '''
+    
+    @abc.abstractmethod
+    def _term_id(self, term):
+        '''Returns the term id for ``term``, or ``None`` if it isn't indexed'''
+        return
+    
+    @abc.abstractmethod
+    def _query_postings(self, tid):
+        '''
+        Returns postings for term id ``tid`` to be scored, which may
+        include docids returned by :meth:`_tombstones()`
+        '''
+        return
+    
+    def _tombstones(self):
+        '''
+        Returns the deleted docids that the scorer must skip, or ``None``.
+        Default implementation returns ``None``.
+        '''
+        return None
+    
+    def _tid_vec(self, query_vec):
+        '''
+        Translates query_vec to a term vector keyed by term id.  Terms
+        that are not in the index are dropped, since they can't match.
+        '''
+        lowercase = self.config('lowercase')
+        tid_vec = {}
+        for (term, freq) in query_vec.iteritems():
+            if lowercase:
+                term = term.lower()
+            tid = self._term_id(term)
+            if tid is not None:
+                tid_vec[tid] = tid_vec.get(tid, 0) + freq
+        return tid_vec
+        
+    def _query(self, query_vec, k=None):
+        '''Finds documents similar to query_vec
+        
+        Params:
+            query_vec: term vector representing query document
+            k: if given, only the top ``k`` results are returned
+        
+        Returns:
+            A iterable of (docname, score) tuples sorted by score
+        '''
+        tid_vec = self._tid_vec(query_vec)
+        postings_lists = []
+        for tid in tid_vec:
+            postings_lists.append((tid, self._query_postings(tid)))
+        return self._score(tid_vec, postings_lists, k)
+        
+    def _query_many(self, query_vecs, k=None):
+        '''Finds documents similar to each of query_vecs
+        
+        Postings are fetched once for terms shared across the batch, but
+        each query is still scored serially in this thread: the scorers are
+        GIL-bound Python, so threads would not speed this up.  Use
+        ProcessShardedSimIndex to score a batch in parallel.
+        '''
+        postings_cache = {}
+        results = []
+        for query_vec in query_vecs:
+            tid_vec = self._tid_vec(query_vec)
+            postings_lists = []
+            for tid in tid_vec:
+                if tid not in postings_cache:
+                    postings_cache[tid] = self._query_postings(tid)
+                postings_lists.append((tid, postings_cache[tid]))
+            results.append(list(self._score(tid_vec, postings_lists, k)))
+        return results
+        
+    def _score(self, tid_vec, postings_lists, k):
+        '''Scores postings_lists for tid_vec with the query scorer
+        
+        Returns:
+            A iterable of (docname, score) tuples sorted by score
+        '''
+        N = self._global_N or self._N
+        hits = self.query_scorer.score_docs(query_vec=tid_vec,
+                                            postings_lists=postings_lists,
+                                            N=N,
+                                            get_doc_freq=self.get_doc_freq,
+                                            get_doc_len=self.get_doc_len,
+                                            get_term_max_score=self.get_term_max_score,
+                                            get_doc_len_array=self.get_doc_len_array,
+                                            deleted=self._tombstones(),
+                                            k=k)
+        
+        return ((self.docid_to_name(docid), score) for (docid, score) in hits)
@@ -46,8 +46,8 @@ to sim_index.
 >>> from pprint import pprint
 >>> import jsonrpclib
 >>> server = jsonrpclib.Server('http://localhost:9001/RPC2')
->>> server.sim_index.index_urls('http://www.stanford.edu/', 'http://www.berkeley.edu', 'http://www.ucla.edu')
->>> pprint(server.sim_index.query('university'))
+>>> token = server.sim_index.index_urls('http://www.stanford.edu/', 'http://www.berkeley.edu', 'http://www.ucla.edu')
+>>> pprint(server.sim_index.query(q='university', wait_for=token))
 [[u'http://www.stanford.edu/', 0.10469570845856098],
  [u'http://www.ucla.edu', 0.04485065887313478],
  [u'http://www.berkeley.edu', 0.020464326883958977]]
@@ -56,8 +56,8 @@ to sim_index.
 >>> from pprint import pprint
 >>> from pysimsearch import sim_index
 >>> index = sim_index.RemoteSimIndex('http://localhost:9001/RPC2')
->>> index.index_urls('http://www.stanford.edu/', 'http://www.berkeley.edu', 'http://www.ucla.edu')
->>> pprint(index.query('stanford'))
+>>> token = index.index_urls('http://www.stanford.edu/', 'http://www.berkeley.edu', 'http://www.ucla.edu')
+>>> pprint(index.query(q='stanford', wait_for=token))
 [[u'http://www.stanford.edu/', 0.3612214953965162]]
 
 '''
@@ -77,6 +77,7 @@ if __name__ == "__main__" and __package__ is None:
 # external modules
 import argparse
 import logging
+import SocketServer
 import traceback
 import types
 
@@ -89,6 +90,7 @@ from jsonrpclib.SimpleJSONRPCServer import SimpleJSONRPCRequestHandler as Simple
 
 # our modules
 from .sim_index import *
+from .sim_index.postings import POSTINGS_LIST_TYPES
 from . import query_scorer
 
 class SimIndexService(object):
@@ -96,8 +98,11 @@ class SimIndexService(object):
 
     PREFIX = 'sim_index'
     EXPORTED_METHODS = {'index_urls',
+                        'wait',
                         'index_string_buffers',
                         'del_docids',
+                        'compact',
+                        'commit',
                         'docid_to_name',
                         'name_to_docid',
                         'docid_to_name',
@@ -106,11 +111,16 @@ class SimIndexService(object):
                         'docnames_with_terms',
                         'set_query_scorer',
                         'query',
+                        'query_many',
+                        'query_with_status',
                         'set_global_N',
                         'get_local_N',
                         'set_global_df_map',
                         'get_local_df_map',
                         'get_name_to_docid_map',
+                        'enable_query_cache',
+                        'disable_query_cache',
+                        'query_cache_stats',
                         'config',
                         'set_config',
                         'update_config'}
@@ -135,9 +145,9 @@ class SimIndexService(object):
                 r = func(*params)
             else:
                 r = func(**params)
-            # if we got back a generator, then let's materialize a list so it
-            # can serialize properly
-            if isinstance(r, types.GeneratorType):
+            # if we got back a generator (or compact postings list), then
+            # let's materialize a list so it can serialize properly
+            if isinstance(r, (types.GeneratorType,) + POSTINGS_LIST_TYPES):
                 r = list(r)
             return r
         except Exception as e:
@@ -148,30 +158,50 @@ class SimIndexService(object):
 class RequestHandler(SimpleRPCRequestHandler):
     rpc_paths = ('/RPC2',)
 
+class ThreadedRPCServer(SocketServer.ThreadingMixIn, SimpleRPCServer):
+    '''Handles each request in its own thread'''
+    daemon_threads = True
+
 def start_sim_index_server(port,
                            backends=(),
                            remote_urls=(),
                            root=True,
-                           logRequests=True):
+                           logRequests=True,
+                           snapshot=False,
+                           shard_timeout=None):
+    '''
+    Serve a :class:`ConcurrentSimIndex` on ``port``.
+    
+    Requests are handled concurrently.  If ``snapshot`` is True, the
+    local :class:`MemorySimIndex` (used when there are no backends) is
+    wrapped in snapshot mode, so queries never wait for updates.
+    
+    If ``shard_timeout`` is given, queries to a collection of backends
+    leave out shards that take longer than ``shard_timeout`` seconds, and
+    query rpcs to remote backends time out after ``shard_timeout`` seconds.
+    Update and stats rpcs to remote backends never time out.
+    '''
 
-    server = SimpleRPCServer(('localhost', port),
-                             logRequests=logRequests,
-                             requestHandler=RequestHandler)
+    server = ThreadedRPCServer(('localhost', port),
+                               logRequests=logRequests,
+                               requestHandler=RequestHandler)
     
     backend_list = list(backends)
     if remote_urls:
         backend_list.extend(
-            [RemoteSimIndex(url) for url in remote_urls])
+            [RemoteSimIndex(url, query_timeout=shard_timeout)
+             for url in remote_urls])
 
     if backend_list:
         if len(backend_list) == 1:
             index = ConcurrentSimIndex(backend_list[0])
         else:
-            index = ConcurrentSimIndex(
-                        SimIndexCollection(
-                            shards=backend_list, root=root))
+            collection = SimIndexCollection(shards=backend_list, root=root)
+            collection.set_config('shard_timeout', shard_timeout,
+                                  passthrough=False)
+            index = ConcurrentSimIndex(collection)
     else:
-        index = ConcurrentSimIndex(MemorySimIndex())
+        index = ConcurrentSimIndex(MemorySimIndex(), snapshot=snapshot)
         index.set_query_scorer('tfidf')
 
     server.register_instance(SimIndexService(index))
@@ -211,12 +241,27 @@ def main():
             dest='root', default=True,
             help='True if this is the root index node'
     )
+    
+    parser_sim_index.add_argument(
+            '--shard_timeout', type=float, default=None,
+            help='Seconds to wait for remote shards before leaving them '
+                 'out of query results'
+    )
+    
+    parser_sim_index.add_argument(
+            '--snapshot', action='store_true',
+            default=False,
+            help='Publish a new copy of the local index on each update, '
+                 'so queries never block'
+    )
 
     args = parser.parse_args()
     if args.command == 'sim_index':
         start_sim_index_server(port=args.port,
                                remote_urls=args.remote_shards,
-                               root=args.root)
+                               root=args.root,
+                               snapshot=args.snapshot,
+                               shard_timeout=args.shard_timeout)
     else:
         raise Exception('Unknown command: {}'.format(args.command))
         
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2010, Taher Haveliwala <oss@taherh.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * The names of project contributors may not be used to endorse or
+#       promote products derived from this software without specific
+#       prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''
+Unittests for pysimsearch.sim_index.cached_map module
+
+To run unittests, run 'nosetests' from the test directory
+'''
+from __future__ import(division, absolute_import, print_function,
+                       unicode_literals)
+
+import unittest
+
+from pysimsearch.sim_index.cached_map import CachedMap
+
+class CountingDict(dict):
+    '''dict that counts item reads'''
+    def __init__(self, *args, **kwargs):
+        super(CountingDict, self).__init__(*args, **kwargs)
+        self.reads = 0
+
+    def __getitem__(self, key):
+        self.reads += 1
+        return super(CountingDict, self).__getitem__(key)
+
+class CachedMapTest(unittest.TestCase):
+    longMessage = True
+
+    def test_read_caching(self):
+        backing = CountingDict({'a': [1, 2], 'b': [3]})
+        cached = CachedMap(backing, max_weight=10, weigh=len)
+        self.assertEqual(cached['a'], [1, 2])
+        self.assertEqual(cached['a'], [1, 2])
+        self.assertEqual(backing.reads, 1)
+        self.assertEqual((cached.hits, cached.misses), (1, 1))
+        self.assertRaises(KeyError, cached.__getitem__, 'c')
+        self.assertIsNone(cached.get('c'))
+        self.assertEqual(len(cached), 2)
+        self.assertEqual(sorted(cached), ['a', 'b'])
+
+    def test_write_through(self):
+        '''Writes update the underlying map, and are never served stale'''
+        backing = CountingDict({'a': [1]})
+        cached = CachedMap(backing, max_weight=10, weigh=len)
+        cached['a']
+        cached['a'] = [1, 2]
+        self.assertEqual(backing['a'], [1, 2])
+        self.assertEqual(cached['a'], [1, 2])
+        del cached['a']
+        self.assertNotIn('a', backing)
+        self.assertNotIn('a', cached)
+        self.assertRaises(KeyError, cached.__getitem__, 'a')
+
+    def test_weight_bound(self):
+        backing = CountingDict({'a': [1, 2], 'b': [3, 4], 'c': [5, 6],
+                                'big': range(20)})
+        cached = CachedMap(backing, max_weight=4, weigh=len)
+        cached['a']
+        cached['b']
+        cached['a']  # 'b' is now least recently used
+        cached['c']
+        reads = backing.reads
+        cached['a']
+        cached['c']
+        self.assertEqual(backing.reads, reads)
+        cached['b']
+        self.assertEqual(backing.reads, reads + 1)
+        # values heavier than the bound are not cached
+        cached['big']
+        cached['big']
+        self.assertEqual(backing.reads, reads + 3)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2010, Taher Haveliwala <oss@taherh.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * The names of project contributors may not be used to endorse or
+#       promote products derived from this software without specific
+#       prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''
+Unittests for pysimsearch.sim_index.ingest module
+
+To run unittests, run 'nosetests' from the test directory
+'''
+from __future__ import(division, absolute_import, print_function,
+                       unicode_literals)
+
+import unittest
+
+import io
+
+from pysimsearch.sim_index import MemorySimIndex
+from pysimsearch.sim_index.ingest import iter_term_vecs, ParallelTokenizer
+
+class IngestTest(unittest.TestCase):
+    longMessage = True
+    
+    config = {'stoplist': {'stop': 1}, 'lowercase': True}
+    
+    def named_files(self):
+        return [('doc{}'.format(i),
+                 io.StringIO('Hello stop world {} {}'.format(i, i % 3)))
+                for i in range(25)]
+
+    def test_parallel_matches_serial(self):
+        '''Parallel tokenization yields the same term vectors, in order'''
+        golden = list(iter_term_vecs(self.named_files(), self.config))
+        self.assertEqual(golden[4], ('doc4', {'hello': 1, 'world': 1,
+                                              '4': 1, '1': 1}))
+        for (batch_size, max_pending) in ((1, 1), (4, 2), (100, 0)):
+            config = dict(self.config, ingest_workers=2,
+                          ingest_batch_size=batch_size,
+                          ingest_max_pending=max_pending)
+            self.assertEqual(list(iter_term_vecs(self.named_files(), config)),
+                             golden)
+
+    def test_byte_strings(self):
+        tokenizer = ParallelTokenizer(1, {}, False)
+        try:
+            self.assertEqual(list(tokenizer.term_vecs([('a', io.BytesIO(b'x X x'))])),
+                             [('a', {'x': 2, 'X': 1})])
+        finally:
+            tokenizer.close()
+
+    def test_index_reuses_tokenizer(self):
+        '''Indexes keep one pool across index_files() calls, until closed'''
+        sim_index = MemorySimIndex()
+        sim_index.set_config('ingest_workers', 2)
+        sim_index.index_files(self.named_files()[:10])
+        tokenizer = sim_index._tokenizer
+        self.assertIsNotNone(tokenizer)
+        sim_index.index_files(self.named_files()[10:])
+        self.assertIs(sim_index._tokenizer, tokenizer)
+        self.assertEqual(sim_index.name_to_docid('doc12'), 12)
+        
+        # settings changes start a new pool
+        sim_index.set_config('ingest_batch_size', 5)
+        sim_index.index_files([('extra', io.StringIO('hello'))])
+        self.assertIsNot(sim_index._tokenizer, tokenizer)
+        self.assertIsNone(tokenizer._pool)
+        
+        tokenizer = sim_index._tokenizer
+        sim_index.close()
+        self.assertIsNone(sim_index._tokenizer)
+        self.assertIsNone(tokenizer._pool)
+
+if __name__ == "__main__":
+    unittest.main()
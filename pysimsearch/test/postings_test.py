@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2010, Taher Haveliwala <oss@taherh.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * The names of project contributors may not be used to endorse or
+#       promote products derived from this software without specific
+#       prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''
+Unittests for pysimsearch.sim_index.postings module
+
+To run unittests, run 'nosetests' from the test directory
+'''
+from __future__ import(division, absolute_import, print_function,
+                       unicode_literals)
+
+import unittest
+
+import cPickle as pickle
+import random
+
+from pysimsearch.sim_index.postings import (PostingsList, DocidBitset,
+                                            CompressedPostingsList,
+                                            MappedPostingsList,
+                                            POSTINGS_BLOCK_SIZE, pack_postings)
+
+class PostingsListTest(unittest.TestCase):
+    longMessage = True
+
+    postings = [(0, 2), (3, 1), (7, 5)]
+
+    def test_sequence(self):
+        '''PostingsList behaves like a list of (docid, freq) tuples'''
+        p = PostingsList(self.postings)
+        self.assertEqual(len(p), 3)
+        self.assertEqual(list(p), self.postings)
+        self.assertEqual(p[1], (3, 1))
+        self.assertEqual(list(p[1:]), self.postings[1:])
+        self.assertEqual(p, self.postings)
+        self.assertEqual([x[0] for x in p], [0, 3, 7])
+
+    def test_add(self):
+        '''__add__() returns a new list, __iadd__() extends in place'''
+        p = PostingsList(self.postings[:1])
+        q = p + self.postings[1:]
+        self.assertIsInstance(q, PostingsList)
+        self.assertEqual(list(q), self.postings)
+        self.assertEqual(len(p), 1)
+        p += q[1:]
+        self.assertEqual(list(p), self.postings)
+
+    def test_pickle(self):
+        '''PostingsList survives a pickle round trip'''
+        p = PostingsList(self.postings)
+        self.assertEqual(list(pickle.loads(pickle.dumps(p))), self.postings)
+        self.assertEqual(list(pickle.loads(pickle.dumps(p, 2))), self.postings)
+
+class MappedPostingsListTest(unittest.TestCase):
+    longMessage = True
+
+    postings = [(0, 2), (3, 1), (7, 5)]
+
+    def test_sequence(self):
+        '''MappedPostingsList reads packed postings in place'''
+        buf = bytearray(b'xx' + pack_postings(self.postings))
+        p = MappedPostingsList(buf, 2, 3)
+        self.assertEqual(p.buffer_info(), (buf, 2, 3))
+        self.assertEqual(len(p), 3)
+        self.assertEqual(list(p), self.postings)
+        self.assertEqual(p[1], (3, 1))
+        self.assertEqual(list(p[1:]), self.postings[1:])
+        self.assertEqual(p, self.postings)
+        self.assertEqual(list(p.docids), [0, 3, 7])
+        self.assertEqual(list(p + [(9, 1)]), self.postings + [(9, 1)])
+        self.assertEqual(list(PostingsList(p)), self.postings)
+
+class CompressedPostingsListTest(unittest.TestCase):
+    longMessage = True
+
+    def setUp(self):
+        rand = random.Random(0)
+        docid = 0
+        self.postings = []
+        # span several blocks, plus a partial tail block, with some
+        # multi-byte gaps and freqs
+        for i in range(3 * POSTINGS_BLOCK_SIZE + 17):
+            docid += rand.choice((1, 2, 100, 70000))
+            self.postings.append((docid, rand.choice((1, 3, 200, 100000))))
+        self.postings[0] = (0, 1)
+
+    def test_sequence(self):
+        '''CompressedPostingsList behaves like a list of (docid, freq) tuples'''
+        p = CompressedPostingsList(self.postings)
+        self.assertEqual(len(p), len(self.postings))
+        self.assertEqual(list(p), self.postings)
+        self.assertEqual(p, self.postings)
+        self.assertEqual(p.decode(), self.postings)
+        for i in (0, 1, POSTINGS_BLOCK_SIZE, len(self.postings) - 1, -1):
+            self.assertEqual(p[i], self.postings[i])
+        self.assertEqual(list(p[5:300]), self.postings[5:300])
+        self.assertEqual(p.num_blocks(), 4)
+        self.assertEqual(list(CompressedPostingsList()), [])
+
+    def test_append(self):
+        '''Appending one at a time, or with +, matches bulk construction'''
+        p = CompressedPostingsList()
+        for posting in self.postings:
+            p.append(posting)
+        self.assertEqual(list(p), self.postings)
+        q = CompressedPostingsList(self.postings[:200])
+        r = q + self.postings[200:]
+        self.assertEqual(list(r), self.postings)
+        self.assertEqual(len(q), 200)
+        q += self.postings[200:]
+        self.assertEqual(list(q), self.postings)
+
+    def test_compression(self):
+        '''Small gaps and freqs take a byte each'''
+        postings = [(docid, 1) for docid in range(1000)]
+        p = CompressedPostingsList(postings)
+        self.assertLess(len(p.tobytes()), 2 * len(postings) + 100)
+
+    def test_serialization(self):
+        '''tobytes()/frombytes() and pickling round trip'''
+        for n in (0, 5, POSTINGS_BLOCK_SIZE, len(self.postings)):
+            p = CompressedPostingsList(self.postings[:n])
+            q = CompressedPostingsList.frombytes(p.tobytes())
+            self.assertEqual(list(q), self.postings[:n])
+            # can keep appending after a round trip
+            q += self.postings[n:]
+            self.assertEqual(list(q), self.postings)
+            self.assertEqual(list(pickle.loads(pickle.dumps(p))),
+                             self.postings[:n])
+            self.assertEqual(list(pickle.loads(pickle.dumps(p, 2))),
+                             self.postings[:n])
+
+class DocidBitsetTest(unittest.TestCase):
+    longMessage = True
+
+    def test_set_ops(self):
+        '''DocidBitset behaves like a set of ints'''
+        bits = DocidBitset([3, 17])
+        bits.add(0)
+        bits.add(17)
+        self.assertEqual(len(bits), 3)
+        self.assertEqual(list(bits), [0, 3, 17])
+        self.assertIn(17, bits)
+        self.assertNotIn(16, bits)
+        self.assertNotIn(10000, bits)
+        bits.discard(3)
+        bits.discard(4)
+        self.assertEqual(list(bits), [0, 17])
+        bits.clear()
+        self.assertEqual(len(bits), 0)
+        self.assertFalse(bits)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2010, Taher Haveliwala <oss@taherh.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * The names of project contributors may not be used to endorse or
+#       promote products derived from this software without specific
+#       prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''
+Unittests for pysimsearch.sim_index.query_cache module
+
+To run unittests, run 'nosetests' from the test directory
+'''
+from __future__ import(division, absolute_import, print_function,
+                       unicode_literals)
+
+import unittest
+
+from pysimsearch.sim_index.query_cache import QueryCache
+
+class QueryCacheTest(unittest.TestCase):
+    longMessage = True
+
+    hits = [('doc1', 2.0), ('doc2', 1.0)]
+
+    def test_make_key(self):
+        '''Equivalent query vectors map to the same key'''
+        key = QueryCache.make_key({'hello': 1, 'there': 2}, 'tfidf', 10)
+        self.assertEqual(QueryCache.make_key({'There': 2, 'HELLO': 1, 'bob': 0},
+                                             'tfidf', 10),
+                         key)
+        self.assertEqual(QueryCache.make_key({'there': 1, 'THERE': 1, 'hello': 1},
+                                             'tfidf', 10),
+                         key)
+        self.assertNotEqual(QueryCache.make_key({'hello': 1, 'there': 2},
+                                                'tfidf', 5),
+                            key)
+        self.assertNotEqual(QueryCache.make_key({'hello': 1, 'there': 2},
+                                                'simple_count', 10),
+                            key)
+        self.assertNotEqual(QueryCache.make_key({'There': 2, 'hello': 1},
+                                                'tfidf', 10, lowercase=False),
+                            key)
+
+    def test_get_put(self):
+        cache = QueryCache()
+        key = QueryCache.make_key({'hello': 1}, 'tfidf', None)
+        self.assertIsNone(cache.get(key, 0))
+        cache.put(key, self.hits, 0)
+        self.assertEqual(cache.get(key, 0), self.hits)
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']),
+                         (1, 1, 1))
+        self.assertGreater(stats['bytes'], 0)
+
+    def test_generation(self):
+        '''A newer generation empties the cache, and stale puts are dropped'''
+        cache = QueryCache()
+        key = QueryCache.make_key({'hello': 1}, 'tfidf', None)
+        cache.put(key, self.hits, 0)
+        self.assertIsNone(cache.get(key, 1))
+        self.assertEqual(cache.stats()['invalidations'], 1)
+        self.assertEqual(len(cache), 0)
+        cache.put(key, self.hits, 0)
+        self.assertEqual(len(cache), 0)
+
+    def test_lru_eviction(self):
+        cache = QueryCache(max_entries=2)
+        keys = [QueryCache.make_key({term: 1}, 'tfidf', None)
+                for term in ('a', 'b', 'c')]
+        cache.put(keys[0], self.hits, 0)
+        cache.put(keys[1], self.hits, 0)
+        cache.get(keys[0], 0)  # 'b' is now least recently used
+        cache.put(keys[2], self.hits, 0)
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertIsNotNone(cache.get(keys[0], 0))
+        self.assertIsNone(cache.get(keys[1], 0))
+        self.assertIsNotNone(cache.get(keys[2], 0))
+
+    def test_memory_bound(self):
+        key = QueryCache.make_key({'a': 1}, 'tfidf', None)
+        size = QueryCache._entry_size(key, self.hits)
+        cache = QueryCache(max_bytes=2 * size)
+        for term in ('a', 'b', 'c'):
+            cache.put(QueryCache.make_key({term: 1}, 'tfidf', None),
+                      self.hits, 0)
+        self.assertEqual(len(cache), 2)
+        self.assertLessEqual(cache.stats()['bytes'], 2 * size)
+        # entries larger than the bound are not cached
+        cache.put(key, self.hits * 10, 0)
+        self.assertIsNone(cache.get(key, 0))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2010, Taher Haveliwala <oss@taherh.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * The names of project contributors may not be used to endorse or
+#       promote products derived from this software without specific
+#       prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''
+Unittests for pysimsearch.sim_index.rwlock module
+
+To run unittests, run 'nosetests' from the test directory
+'''
+from __future__ import(division, absolute_import, print_function,
+                       unicode_literals)
+
+import threading
+import time
+import unittest
+
+from pysimsearch.sim_index.rwlock import RWLock
+
+class RWLockTest(unittest.TestCase):
+    longMessage = True
+
+    def _start(self, target):
+        thread = threading.Thread(target=target)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def test_concurrent_readers(self):
+        '''Readers don't block each other'''
+        lock = RWLock()
+        barrier = threading.Semaphore(0)
+        def reader():
+            with lock.read_locked():
+                barrier.release()
+                # wait until the other reader is inside, too
+                barrier.acquire()
+                barrier.release()
+        threads = [self._start(reader) for i in range(2)]
+        for thread in threads:
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+
+    def test_writer_exclusive(self):
+        lock = RWLock()
+        events = []
+        lock.acquire_read()
+        def writer():
+            with lock.write_locked():
+                events.append('write')
+        thread = self._start(writer)
+        time.sleep(0.05)
+        self.assertEqual(events, [])
+        events.append('read done')
+        lock.release_read()
+        thread.join(5)
+        self.assertEqual(events, ['read done', 'write'])
+
+    def test_writer_preference(self):
+        '''New readers wait behind a waiting writer'''
+        lock = RWLock()
+        events = []
+        lock.acquire_read()
+        def writer():
+            with lock.write_locked():
+                events.append('write')
+        def reader():
+            with lock.read_locked():
+                events.append('read')
+        writer_thread = self._start(writer)
+        while not lock._waiting_writers:
+            time.sleep(0.001)
+        reader_thread = self._start(reader)
+        time.sleep(0.05)
+        self.assertEqual(events, [])
+        lock.release_read()
+        writer_thread.join(5)
+        reader_thread.join(5)
+        self.assertEqual(events, ['write', 'read'])
+
+    def test_reentrant(self):
+        lock = RWLock()
+        with lock.read_locked():
+            with lock.read_locked():
+                pass
+        with lock.write_locked():
+            with lock.write_locked():
+                with lock.read_locked():
+                    pass
+        # lock is free again
+        with lock.write_locked():
+            pass
+
+    def test_upgrade(self):
+        lock = RWLock()
+        with lock.read_locked():
+            self.assertRaises(RuntimeError, lock.acquire_write)
+        self.assertRaises(RuntimeError, lock.release_write)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2010, Taher Haveliwala <oss@taherh.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * The names of project contributors may not be used to endorse or
+#       promote products derived from this software without specific
+#       prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''
+Unittests for pysimsearch.sim_index.segment_builder module
+
+To run unittests, run 'nosetests' from the test directory
+'''
+from __future__ import(division, absolute_import, print_function,
+                       unicode_literals)
+
+import unittest
+
+import io
+import os
+import random
+import shutil
+import tempfile
+
+from pysimsearch.sim_index import MemorySimIndex, SegmentSimIndex
+from pysimsearch.sim_index.segment import CODEC_VARINT
+from pysimsearch.sim_index import segment_builder
+from pysimsearch.sim_index.segment_builder import SegmentBuilder, build_segment
+
+def make_docs(num_docs, seed=0):
+    rand = random.Random(seed)
+    return [('doc{}'.format(rand.randint(0, 10 ** 6)),
+             ' '.join('t{}'.format(int(200 ** rand.random())) for j in range(10)))
+            for i in range(num_docs)]
+
+class SegmentBuilderTest(unittest.TestCase):
+    longMessage = True
+    
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.docs = make_docs(300)
+        self.golden_index = MemorySimIndex()
+        self.golden_index.set_config('stoplist', {'t1': 1})
+        self.golden_index.index_string_buffers(self.docs)
+        
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        
+    def build(self, memory_budget, **kwargs):
+        segment = io.BytesIO()
+        builder = SegmentBuilder(segment, memory_budget=memory_budget,
+                                 config={'stoplist': {'t1': 1}},
+                                 tmpdir=self.tmpdir, **kwargs)
+        builder.index_string_buffers(self.docs)
+        num_runs = builder.num_runs
+        builder.finish()
+        # spilled runs are cleaned up
+        self.assertEqual(os.listdir(self.tmpdir), [])
+        return (SegmentSimIndex(bytearray(segment.getvalue())), num_runs)
+        
+    def check_matches(self, sim_index):
+        golden_index = self.golden_index
+        self.assertEqual(sim_index.get_local_N(), golden_index.get_local_N())
+        self.assertEqual(sim_index.get_local_df_map(),
+                         golden_index.get_local_df_map())
+        self.assertEqual(sim_index.get_name_to_docid_map(),
+                         golden_index.get_name_to_docid_map())
+        self.assertEqual(sim_index.config('stoplist'), {'t1': 1})
+        for term in ('t0', 't1', 't2', 't50', 'none'):
+            self.assertEqual(list(sim_index.postings_list(term)),
+                             list(golden_index.postings_list(term)))
+        for query in ("t2 t3", "t4 t4 t100"):
+            for k in (None, 5):
+                self.assertEqual(list(sim_index.query(query, k)),
+                                 list(golden_index.query(query, k)))
+        
+    def test_spilled_runs(self):
+        '''Segments built from many runs match an in-memory index'''
+        (sim_index, num_runs) = self.build(memory_budget=10000)
+        self.assertGreater(num_runs, 5)
+        self.check_matches(sim_index)
+        
+    def test_single_run(self):
+        (sim_index, num_runs) = self.build(memory_budget=2**30)
+        self.assertEqual(num_runs, 0)
+        self.check_matches(sim_index)
+        
+    def test_max_fan_in(self):
+        '''Runs are merged over several passes, max_fan_in at a time'''
+        (sim_index, num_runs) = self.build(memory_budget=10000, max_fan_in=2)
+        self.assertGreater(num_runs, 5)
+        self.check_matches(sim_index)
+        
+    def test_small_chunks(self):
+        '''Postings are copied through in chunks'''
+        chunk_size = segment_builder._CHUNK_SIZE
+        segment_builder._CHUNK_SIZE = 16
+        try:
+            (sim_index, num_runs) = self.build(memory_budget=10000,
+                                               max_fan_in=3)
+        finally:
+            segment_builder._CHUNK_SIZE = chunk_size
+        self.check_matches(sim_index)
+        
+    def test_varint_codec(self):
+        (sim_index, num_runs) = self.build(memory_budget=10000,
+                                           codec=CODEC_VARINT)
+        self.check_matches(sim_index)
+        
+    def test_build_segment(self):
+        segment = io.BytesIO()
+        named_files = [(name, io.StringIO(text)) for (name, text) in self.docs]
+        build_segment(named_files, segment, config={'stoplist': {'t1': 1}},
+                      memory_budget=10000, tmpdir=self.tmpdir)
+        self.check_matches(SegmentSimIndex(bytearray(segment.getvalue())))
+        
+    def test_empty(self):
+        segment = io.BytesIO()
+        SegmentBuilder(segment, tmpdir=self.tmpdir).finish()
+        sim_index = SegmentSimIndex(bytearray(segment.getvalue()))
+        self.assertEqual(sim_index.get_local_N(), 0)
+        self.assertEqual(list(sim_index.query("t1")), [])
+
+if __name__ == "__main__":
+    unittest.main()
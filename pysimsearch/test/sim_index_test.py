@@ -36,20 +36,49 @@ from __future__ import(division, absolute_import, print_function,
 
 import unittest
 
+from array import array
+import glob
 import io
 import math
+import os
+import shutil
+import socket
+import random
+import shelve
+import sqlite3
 import sys
+import tempfile
+import threading
 import time
 from multiprocessing import Process
 from pprint import pprint
 
+try:
+    import numpy
+    import scipy
+except ImportError:
+    numpy = scipy = None
+
 from pysimsearch import term_vec
+from pysimsearch.sim_index import MapSimIndex
 from pysimsearch.sim_index import MemorySimIndex
 from pysimsearch.sim_index import ShelfSimIndex
 from pysimsearch.sim_index import ConcurrentSimIndex
 from pysimsearch.sim_index import SimIndexCollection
 from pysimsearch.sim_index import RemoteSimIndex
+from pysimsearch.sim_index import CSRSimIndex
+from pysimsearch.sim_index import SegmentSimIndex
+from pysimsearch.sim_index import SqliteSimIndex
+from pysimsearch.sim_index import SegmentedSimIndex
+from pysimsearch.sim_index import ProcessSimIndex
+from pysimsearch.sim_index import ProcessShardedSimIndex
+from pysimsearch.sim_index import segmented_sim_index
+from pysimsearch.sim_index.segment import write_segment, CODEC_VARINT
+from pysimsearch.sim_index.postings import PostingsList, MappedPostingsList
+from pysimsearch.query_scorer import TFIDFQueryScorer, NumPyTFIDFQueryScorer
+from pysimsearch import doc_reader
 from pysimsearch import sim_server
+from pysimsearch.exceptions import ReadOnlyIndexException, FileFormatException
 
 class SimIndexTest(object):
     '''
@@ -109,6 +138,12 @@ class SimIndexTest(object):
                                 "there world": {'doc1': 2, 'doc2': 1, 'doc3': 1},
                                 "hello world": {'doc1': 3, 'doc2': 2, 'doc3': 1} })
 
+    def test_get_local_df_map(self):
+        golden_df_map = { term: len(postings)
+                          for (term, postings) in self.golden_postings.items()
+                          if postings }
+        self.assertEqual(self.sim_index.get_local_df_map(), golden_df_map)
+
     def get_golden_hits_cos(self):
         '''Manually computes cosine scores for test set to create golden results'''
         d1_len = math.sqrt(2^2 + 1 + 1)
@@ -201,6 +236,74 @@ class SimIndexTest(object):
                                        golden_doc_hits_cos[docname],
                                        msg="results={}".format(str(results)))
     
+    @unittest.skipIf(numpy is None, 'requires numpy')
+    def test_query_tfidf_np_scorer(self):
+        '''Test query() with tfidf_np, which should match tfidf'''
+        queries = list(self.get_golden_hits_cos()) + ["bob", "nobody"]
+        self.sim_index.set_query_scorer('tfidf')
+        golden = [list(self.sim_index.query(query)) for query in queries]
+        self.sim_index.set_query_scorer('tfidf_np')
+        for (query, golden_hits) in zip(queries, golden):
+            for k in (None, 1, 2):
+                hits = list(self.sim_index.query(query, k))
+                self.assertEqual(len(hits), len(golden_hits[:k]))
+                for ((doc, score), (golden_doc, golden_score)) in zip(hits, golden_hits):
+                    self.assertAlmostEqual(score, golden_score,
+                                           msg="query={}".format(query))
+
+    def test_query_many(self):
+        '''Test query_many(), which should match query() for each query'''
+        queries = ["hello there", "there world", "bob", "nobody", "hello"]
+        for scorer in ('simple_count', 'tfidf'):
+            self.sim_index.set_query_scorer(scorer)
+            for k in (None, 2):
+                results = self.sim_index.query_many(queries, k)
+                self.assertEqual(len(results), len(queries))
+                for (query, hits) in zip(queries, results):
+                    golden = list(self.sim_index.query(query, k))
+                    self.assertEqual(len(hits), len(golden))
+                    for ((doc, score), (golden_doc, golden_score)) in zip(hits, golden):
+                        self.assertAlmostEqual(score, golden_score,
+                                               msg="query={}".format(query))
+
+    def test_query_cache(self):
+        '''Test query result caching'''
+        self.sim_index.set_query_scorer('simple_count')
+        golden = list(self.sim_index.query("hello there"))
+        self.sim_index.enable_query_cache(max_entries=10)
+        try:
+            self.assertEqual(list(self.sim_index.query("hello there")), golden)
+            # equivalent query vector hits the cache
+            self.assertEqual(list(self.sim_index.query("There  HELLO")), golden)
+            self.assertEqual(self.sim_index.query_many(["hello there", "bob"]),
+                             [golden, list(self.sim_index.query("bob"))])
+            stats = self.sim_index.query_cache_stats()
+            self.assertEqual(stats['hits'], 3)
+            self.assertEqual(stats['misses'], 2)
+            self.assertEqual(stats['entries'], 2)
+
+            # changing the scorer invalidates cached results
+            self.sim_index.set_query_scorer('tfidf')
+            hits = list(self.sim_index.query("hello there"))
+            self.assertEqual(self.sim_index.query_cache_stats()['invalidations'], 1)
+            self.assertNotAlmostEqual(hits[0][1], golden[0][1])
+        finally:
+            self.sim_index.disable_query_cache()
+        self.assertEqual(self.sim_index.query_cache_stats(), {})
+
+    def test_query_top_k(self):
+        '''Test query() with k, which returns only the top k hits'''
+        for scorer in ('simple_count', 'tfidf'):
+            self.sim_index.set_query_scorer(scorer)
+            for query in ("hello there", "there world", "bob"):
+                all_hits = list(self.sim_index.query(query))
+                for k in (0, 1, 2, 10):
+                    hits = list(self.sim_index.query(query, k))
+                    self.assertEqual(len(hits), min(k, len(all_hits)))
+                    self.assertEqual([score for (doc, score) in hits],
+                                     [score for (doc, score) in all_hits[:k]],
+                                     msg="query={}, k={}".format(query, k))
+
     def test_del_docids(self):
         '''Test del_docids()'''
         retest_list = (self.test_docnames_with_terms,
@@ -288,6 +391,670 @@ class MemorySimIndexTest(SimIndexTest, unittest.TestCase):
         self.sim_index = loaded_sim_index
         self.test_query_simple_scorer()  # make sure test_query() still works
 
+    def test_compact_postings(self):
+        '''Postings are stored as compact PostingsList objects'''
+        for term in ('hello', 'there', 'world', 'bob'):
+            self.assertIsInstance(self.sim_index.postings_list(term),
+                                  PostingsList)
+
+    def test_postings_append_in_place(self):
+        '''New postings are appended to the existing postings lists'''
+        postings = self.sim_index.postings_list('hello')
+        self.sim_index.index_string_buffers((('doc4', "hello again"),))
+        self.assertIs(self.sim_index.postings_list('hello'), postings)
+        self.assertEqual(len(postings), 4)
+
+    def test_tombstones(self):
+        '''del_docids() tombstones docids until compact() is called'''
+        self.sim_index.set_config('compact_ratio', 1.0)
+        hello_tid = self.sim_index._term_dict.get_id('hello')
+        docid = self.sim_index.name_to_docid('doc1')
+        self.sim_index.del_docids(docid)
+        self.assertIn(docid, self.sim_index._deleted)
+        self.assertIn(docid, [d for (d, f) in self.sim_index._term_index[hello_tid]])
+        self.assertNotIn(docid, [d for (d, f) in self.sim_index.postings_list('hello')])
+        self.assertIsInstance(self.sim_index.postings_list('hello'), PostingsList)
+        self.assertEqual(set(dict(self.sim_index.query('hello'))), {'doc2', 'doc3'})
+
+        self.sim_index.compact()
+        self.assertEqual(len(self.sim_index._deleted), 0)
+        self.assertNotIn(docid, [d for (d, f) in self.sim_index._term_index[hello_tid]])
+        self.assertEqual(self.sim_index.get_local_df_map()['hello'], 2)
+
+    def test_doc_len_array_concurrent_readers(self):
+        '''Concurrent readers filling in the doc len array keep it aligned'''
+        self.sim_index.index_string_buffers(
+            [('extra{}'.format(i), 'hello ' * (i + 1)) for i in range(200)])
+        doc_len_map = self.sim_index._doc_len_map
+        golden = [doc_len_map[docid] for docid in range(len(doc_len_map))]
+        check_interval = sys.getcheckinterval()
+        sys.setcheckinterval(1)
+        try:
+            for run in range(30):
+                # as if reopened, with no doc lens in memory yet
+                self.sim_index._doc_len_array = array(str('d'))
+                threads = [threading.Thread(
+                               target=self.sim_index.get_doc_len_array)
+                           for i in range(4)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                self.assertEqual(list(self.sim_index.get_doc_len_array()),
+                                 golden)
+        finally:
+            sys.setcheckinterval(check_interval)
+
+    def test_compact_threshold(self):
+        '''del_docids() compacts once enough docs are tombstoned'''
+        self.sim_index.set_config('compact_ratio', 0.5)
+        bob_tid = self.sim_index._term_dict.get_id('bob')
+        self.sim_index.del_docids(self.sim_index.name_to_docid('doc3'))
+        self.assertEqual(len(self.sim_index._deleted), 1)
+        self.assertIn(bob_tid, self.sim_index._term_index)
+        self.sim_index.del_docids(self.sim_index.name_to_docid('doc2'))
+        self.assertEqual(len(self.sim_index._deleted), 0)
+        self.assertNotIn(bob_tid, self.sim_index._term_index)
+        self.assertEqual(list(self.sim_index.postings_list('hello')),
+                         [(self.sim_index.name_to_docid('doc1'), 2)])
+
+    def test_query_cache_invalidation(self):
+        '''Updates to the index invalidate cached query results'''
+        self.sim_index.set_query_scorer('simple_count')
+        self.sim_index.enable_query_cache()
+        self.assertEqual(len(list(self.sim_index.query("bob"))), 1)
+        self.sim_index.index_string_buffers([('doc4', "bob bob")])
+        self.assertEqual(list(self.sim_index.query("bob")),
+                         [('doc4', 2), ('doc3', 1)])
+        self.sim_index.del_docids(self.sim_index.name_to_docid('doc4'))
+        self.assertEqual(list(self.sim_index.query("bob")), [('doc3', 1)])
+        self.assertEqual(self.sim_index.query_cache_stats()['invalidations'], 2)
+
+class CompressedMemorySimIndexTest(SimIndexTest, unittest.TestCase):
+    '''Runs the SimIndex tests against a MemorySimIndex with compressed postings'''
+    
+    def setUp(self):
+        print("CompressedMemorySimIndexTest")
+        self.sim_index = MemorySimIndex(compress_postings=True)
+        super(CompressedMemorySimIndexTest, self).setUp()
+
+class ParallelIngestSimIndexTest(SimIndexTest, unittest.TestCase):
+    '''Runs the SimIndex tests with documents tokenized by a process pool'''
+    
+    def setUp(self):
+        print("ParallelIngestSimIndexTest")
+        self.sim_index = MemorySimIndex()
+        self.sim_index.update_config(ingest_workers=2, ingest_batch_size=2)
+        super(ParallelIngestSimIndexTest, self).setUp()
+
+class MapSimIndexStagingTest(unittest.TestCase):
+    '''
+    Tests that a MapSimIndex without mutable postings writes back each
+    touched postings list once per batch.
+    '''
+
+    class CountingDict(dict):
+        '''dict that counts item assignments'''
+        def __init__(self):
+            super(MapSimIndexStagingTest.CountingDict, self).__init__()
+            self.assignments = 0
+
+        def __setitem__(self, key, value):
+            self.assignments += 1
+            super(MapSimIndexStagingTest.CountingDict, self).__setitem__(
+                key, value)
+
+    def test_one_assignment_per_term(self):
+        term_index = self.CountingDict()
+        index = MapSimIndex(name_to_docid_map={},
+                            docid_to_name_map={},
+                            docid_to_feature_map={},
+                            term_index=term_index,
+                            doc_vectors={},
+                            df_map={},
+                            doc_len_map={},
+                            max_score_map={})
+        index.index_string_buffers(SimIndexTest.docs)
+        self.assertEqual(term_index.assignments, len(term_index))
+        self.assertEqual(dict(index.postings_list('hello')),
+                         {0: 2, 1: 1, 2: 1})
+
+    def make_buffered_index(self, write_buffer_size):
+        self.term_index = self.CountingDict()
+        self.df_map = self.CountingDict()
+        index = MapSimIndex(name_to_docid_map={},
+                            docid_to_name_map={},
+                            docid_to_feature_map={},
+                            term_index=self.term_index,
+                            doc_vectors={},
+                            df_map=self.df_map,
+                            doc_len_map={},
+                            max_score_map={})
+        index.set_config('write_buffer_size', write_buffer_size)
+        return index
+
+    def test_write_buffer(self):
+        '''Buffered postings and df deltas are visible before commit()'''
+        golden_index = MemorySimIndex()
+        golden_index.index_string_buffers(SimIndexTest.docs)
+        index = self.make_buffered_index(1000)
+        index.set_config('compact_ratio', 1)
+        for doc in SimIndexTest.docs:
+            index.index_string_buffers([doc])
+        index.del_docids(index.name_to_docid('doc2'))
+        golden_index.del_docids(golden_index.name_to_docid('doc2'))
+        self.assertEqual(self.term_index.assignments, 0)
+        self.assertEqual(self.df_map.assignments, 0)
+        
+        def check():
+            self.assertEqual(index.get_local_df_map(),
+                             golden_index.get_local_df_map())
+            for term in SimIndexTest.golden_postings:
+                self.assertEqual(list(index.postings_list(term)),
+                                 list(golden_index.postings_list(term)))
+            for query in ("hello there", "world", "bob"):
+                self.assertEqual(list(index.query(query)),
+                                 list(golden_index.query(query)))
+        check()
+        index.commit()
+        self.assertEqual(self.term_index.assignments, len(self.term_index))
+        self.assertEqual(self.df_map.assignments, len(self.df_map))
+        check()
+
+    def test_write_buffer_threshold(self):
+        '''The write-back buffer is flushed once it fills up'''
+        index = self.make_buffered_index(5)
+        index.index_string_buffers(SimIndexTest.docs)
+        # doc1 and doc2 fill the buffer (with 5 distinct terms), while
+        # doc3 remains buffered
+        self.assertEqual(self.term_index.assignments, 5)
+        self.assertEqual(dict(index.postings_list('hello')),
+                         {0: 2, 1: 1, 2: 1})
+
+class ScorerEquivalenceTest(unittest.TestCase):
+    '''Tests that optimized scoring paths match exhaustive scoring'''
+
+    def test_max_score_matches_exhaustive(self):
+        rand = random.Random(0)
+        vocab = ['t{}'.format(i) for i in range(40)]
+        docs = [('doc{}'.format(i),
+                 ' '.join(rand.choice(vocab[:rand.randint(1, 40)])
+                          for j in range(rand.randint(1, 30))))
+                for i in range(300)]
+        index = MemorySimIndex()
+        index.index_string_buffers(docs)
+        index.del_docids(*range(0, 300, 7))
+        for tf_weight_type in ('raw', 'log'):
+            index.set_query_scorer(TFIDFQueryScorer(tf_weight_type))
+            for i in range(50):
+                query = ' '.join(rand.sample(vocab, rand.randint(1, 6)))
+                all_hits = list(index.query(query))
+                for k in (1, 5, 20):
+                    # ties are broken by docid in both paths
+                    self.assertEqual(list(index.query(query, k)), all_hits[:k],
+                                     msg="query={}, k={}".format(query, k))
+
+    @unittest.skipIf(numpy is None, 'requires numpy')
+    def test_numpy_matches_exhaustive(self):
+        '''tfidf_np gives the same results as tfidf'''
+        rand = random.Random(1)
+        vocab = ['t{}'.format(i) for i in range(40)]
+        docs = [('doc{}'.format(i),
+                 ' '.join(rand.choice(vocab) for j in range(rand.randint(1, 30))))
+                for i in range(300)]
+        index = MemorySimIndex()
+        index.index_string_buffers(docs)
+        index.del_docids(*range(0, 300, 7))
+        for tf_weight_type in ('raw', 'log'):
+            for i in range(20):
+                query = ' '.join(rand.sample(vocab, rand.randint(1, 6)))
+                index.set_query_scorer(TFIDFQueryScorer(tf_weight_type))
+                golden = list(index.query(query))
+                index.set_query_scorer(NumPyTFIDFQueryScorer(tf_weight_type))
+                for k in (None, 5):
+                    hits = list(index.query(query, k))
+                    for ((doc, score), (golden_doc, golden_score)) in zip(hits, golden):
+                        self.assertEqual(doc, golden_doc)
+                        self.assertAlmostEqual(score, golden_score)
+                    self.assertEqual(len(hits), len(golden[:k]))
+
+    def test_tombstones_match_compacted(self):
+        '''Scorers skip tombstoned docids as if they had been compacted'''
+        rand = random.Random(2)
+        vocab = ['t{}'.format(i) for i in range(40)]
+        docs = [('doc{}'.format(i),
+                 ' '.join(rand.choice(vocab) for j in range(rand.randint(1, 30))))
+                for i in range(300)]
+        index = MemorySimIndex()
+        index.set_config('compact_ratio', 1.0)
+        index.index_string_buffers(docs)
+        index.del_docids(*range(0, 300, 7))
+        compacted = MemorySimIndex()
+        compacted.index_string_buffers(docs)
+        compacted.del_docids(*range(0, 300, 7))
+        compacted.compact()
+        self.assertEqual(len(index._deleted), 43)
+        
+        scorers = ['simple_count', TFIDFQueryScorer('raw'),
+                   TFIDFQueryScorer('log')]
+        if numpy is not None:
+            scorers.append(NumPyTFIDFQueryScorer('log'))
+        for scorer in scorers:
+            index.set_query_scorer(scorer)
+            compacted.set_query_scorer(scorer)
+            for i in range(20):
+                query = ' '.join(rand.sample(vocab, rand.randint(1, 6)))
+                self.assertEqual(sorted(index.query(query)),
+                                 sorted(compacted.query(query)))
+                for k in (1, 5):
+                    self.assertEqual(list(index.query(query, k)),
+                                     list(compacted.query(query, k)))
+
+class TermDictionaryTest(unittest.TestCase):
+    '''Tests that index structures are keyed by term id'''
+
+    def test_term_ids(self):
+        index = MemorySimIndex()
+        index.index_string_buffers(SimIndexTest.docs)
+        term_dict = index._term_dict
+        self.assertEqual(term_dict.term(term_dict.get_id('hello')), 'hello')
+        self.assertIsNone(term_dict.get_id('nobody'))
+        self.assertEqual(set(index._term_index), set(range(len(term_dict))))
+        self.assertTrue(all(isinstance(tid, int)
+                            for doc_vec in index._doc_vectors.values()
+                            for tid in doc_vec))
+        self.assertEqual(index.get_local_df_map()['hello'], 3)
+
+@unittest.skipIf(scipy is None, 'requires scipy')
+class CSRSimIndexTest(SimIndexTest, unittest.TestCase):
+    '''
+    All tests hitting the SimIndex interface are in the parent class, SimIndexTest
+    
+    Tests for api's not in parent class are tested separately here.  This is
+    so we can reuse test code across all implementations of SimIndex.
+    '''
+    
+    def setUp(self):
+        print("CSRSimIndexTest")
+        # build a MemorySimIndex, and then freeze it
+        self.memory_index = self.sim_index = MemorySimIndex()
+        super(CSRSimIndexTest, self).setUp()
+        self.sim_index = CSRSimIndex(self.memory_index)
+
+    def tearDown(self):
+        pass
+
+    def test_del_docids(self):
+        '''CSRSimIndex is read-only'''
+        self.assertRaises(ReadOnlyIndexException,
+                          self.sim_index.del_docids, 0)
+        self.assertRaises(ReadOnlyIndexException,
+                          self.sim_index.index_string_buffers,
+                          (('extra_doc', "hello world"),))
+
+    def test_query_many(self):
+        '''query_many() matches per-query scoring of the unfrozen index'''
+        queries = ["hello there", "there world", "bob", "nobody", "world"]
+        for scorer in ('simple_count', 'tfidf'):
+            self.sim_index.set_query_scorer(scorer)
+            self.memory_index.set_query_scorer(scorer)
+            for k in (None, 1):
+                results = self.sim_index.query_many(queries, k)
+                self.assertEqual(len(results), len(queries))
+                for (query, hits) in zip(queries, results):
+                    # zero scores aren't returned, and ties may be
+                    # broken differently, so just compare scores
+                    golden = [score for (doc, score)
+                              in self.memory_index.query(query, k) if score]
+                    self.assertEqual(len(hits), len(golden))
+                    for ((doc, score), golden_score) in zip(hits, golden):
+                        self.assertAlmostEqual(score, golden_score)
+
+    def test_top_k_ties(self):
+        '''Docs tied at the k-th score are broken by docid'''
+        memory_index = MemorySimIndex()
+        # the banana docs give apple a non-zero idf
+        memory_index.index_string_buffers(
+            [('d{:02}'.format(i), "apple") for i in xrange(40)] +
+            [('banana{}'.format(i), "banana") for i in xrange(10)])
+        sim_index = CSRSimIndex(memory_index)
+        for scorer in ('simple_count', 'tfidf'):
+            sim_index.set_query_scorer(scorer)
+            memory_index.set_query_scorer(scorer)
+            golden = [doc for (doc, score) in memory_index.query('apple', 5)]
+            self.assertEqual(golden, ['d00', 'd01', 'd02', 'd03', 'd04'])
+            self.assertEqual([doc for (doc, score)
+                              in sim_index.query('apple', 5)], golden)
+            self.assertEqual([doc for (doc, score)
+                              in sim_index.query('apple')][:5], golden)
+
+class SegmentSimIndexTest(SimIndexTest, unittest.TestCase):
+    '''
+    All tests hitting the SimIndex interface are in the parent class, SimIndexTest
+    
+    Tests for api's not in parent class are tested separately here.  This is
+    so we can reuse test code across all implementations of SimIndex.
+    '''
+    
+    def setUp(self):
+        print("SegmentSimIndexTest")
+        # build a MemorySimIndex, and then write it out as a segment
+        self.memory_index = self.sim_index = MemorySimIndex()
+        super(SegmentSimIndexTest, self).setUp()
+        self.segment_file = tempfile.TemporaryFile()
+        write_segment(self.memory_index, self.segment_file)
+        self.sim_index = SegmentSimIndex(self.segment_file)
+
+    def tearDown(self):
+        self.sim_index.close()
+        self.segment_file.close()
+
+    def test_del_docids(self):
+        '''SegmentSimIndex is read-only'''
+        self.assertRaises(ReadOnlyIndexException,
+                          self.sim_index.del_docids, 0)
+        self.assertRaises(ReadOnlyIndexException,
+                          self.sim_index.index_string_buffers,
+                          (('extra_doc', "hello world"),))
+
+    def test_matches_memory_index(self):
+        '''Segment contents match the index it was written from'''
+        self.assertEqual(self.sim_index.get_local_N(),
+                         self.memory_index.get_local_N())
+        self.assertEqual(self.sim_index.get_local_df_map(),
+                         self.memory_index.get_local_df_map())
+        self.assertEqual(self.sim_index.get_name_to_docid_map(),
+                         self.memory_index.get_name_to_docid_map())
+        self.assertEqual(self.sim_index.config('stoplist'),
+                         self.memory_index.config('stoplist'))
+        for term in self.golden_postings:
+            self.assertEqual(list(self.sim_index.postings_list(term)),
+                             list(self.memory_index.postings_list(term)))
+        self.assertRaises(KeyError, self.sim_index.name_to_docid, 'nodoc')
+        self.assertRaises(KeyError, self.sim_index.docid_to_name, 100)
+
+    def test_deleted_docs(self):
+        '''Deleted documents are left out of the segment'''
+        self.memory_index.del_docids(self.memory_index.name_to_docid('doc3'))
+        segment = io.BytesIO()
+        write_segment(self.memory_index, segment)
+        sim_index = SegmentSimIndex(bytearray(segment.getvalue()))
+        self.assertEqual(sim_index.get_local_N(), 2)
+        self.assertEqual(sim_index.postings_list('bob'), [])
+        self.assertEqual(sorted(sim_index.get_name_to_docid_map()),
+                         ['doc1', 'doc2'])
+        self.memory_index.set_query_scorer('tfidf')
+        self.assertEqual(list(sim_index.query("hello there")),
+                         list(self.memory_index.query("hello there")))
+
+    def test_varint_codec(self):
+        '''Compressed segments match uncompressed ones'''
+        segment = io.BytesIO()
+        write_segment(self.memory_index, segment, codec=CODEC_VARINT)
+        sim_index = SegmentSimIndex(bytearray(segment.getvalue()))
+        for term in self.golden_postings:
+            self.assertEqual(list(sim_index.postings_list(term)),
+                             list(self.sim_index.postings_list(term)))
+        for query in ("hello there", "world"):
+            self.assertEqual(list(sim_index.query(query)),
+                             list(self.sim_index.query(query)))
+        # postings are decoded once
+        misses = sim_index._decoded_postings.misses
+        list(sim_index.query("hello there"))
+        self.assertEqual(sim_index._decoded_postings.misses, misses)
+        
+    @unittest.skipIf(numpy is None, 'requires numpy')
+    def test_mapped_postings(self):
+        '''Raw postings are scored straight from the mapping'''
+        postings = self.sim_index.postings_list('hello')
+        self.assertIsInstance(postings, MappedPostingsList)
+        (docids, freqs) = NumPyTFIDFQueryScorer._np_postings(postings)
+        self.assertTrue(numpy.may_share_memory(
+            docids, numpy.frombuffer(self.sim_index._buf, dtype=numpy.uint8)))
+        self.assertEqual(list(docids), [docid for (docid, freq) in postings])
+        self.sim_index.set_query_scorer('tfidf_np')
+        self.memory_index.set_query_scorer('tfidf')
+        for ((doc, score), (golden_doc, golden_score)) in zip(
+                self.sim_index.query("hello there"),
+                self.memory_index.query("hello there")):
+            self.assertEqual(doc, golden_doc)
+            self.assertAlmostEqual(score, golden_score)
+
+    def test_freeze(self):
+        '''Frozen indexes can be queried by forked workers'''
+        self.memory_index.set_query_scorer('tfidf')
+        frozen_index = SegmentSimIndex.freeze(self.memory_index)
+        worker = ProcessSimIndex(factory=lambda: frozen_index)
+        try:
+            for query in ("hello there", "world", "nobody"):
+                hits = list(self.memory_index.query(query))
+                self.assertEqual(list(frozen_index.query(query)), hits)
+                self.assertEqual([tuple(hit) for hit in worker.query(query)],
+                                 hits)
+            self.assertEqual(worker.get_name_to_docid_map(),
+                             self.memory_index.get_name_to_docid_map())
+        finally:
+            worker.close()
+            frozen_index.close()
+
+    def test_bad_segment(self):
+        self.assertRaises(FileFormatException, SegmentSimIndex, bytearray())
+        self.assertRaises(FileFormatException, SegmentSimIndex,
+                          bytearray(b'x' * 256))
+        with tempfile.TemporaryFile() as empty_file:
+            self.assertRaises(FileFormatException, SegmentSimIndex, empty_file)
+
+class SegmentedSimIndexTest(SimIndexTest, unittest.TestCase):
+    '''
+    All tests hitting the SimIndex interface are in the parent class, SimIndexTest
+    
+    Tests for api's not in parent class are tested separately here.  This is
+    so we can reuse test code across all implementations of SimIndex.
+    '''
+    
+    def setUp(self):
+        print("SegmentedSimIndexTest")
+        # tiny segments, so that the test docs span sealed segments, the
+        # in-memory segment, and background merges
+        self.sim_index = SegmentedSimIndex(segment_size=2, merge_factor=2)
+        super(SegmentedSimIndexTest, self).setUp()
+
+    def tearDown(self):
+        self.sim_index.close()
+        
+    def make_docs(self, num_docs):
+        rand = random.Random(num_docs)
+        return [('d{}'.format(i),
+                 ' '.join('t{}'.format(rand.randint(0, 20)) for j in range(8)))
+                for i in range(num_docs)]
+    
+    def check_matches(self, sim_index, golden_index):
+        for scorer in ('simple_count', 'tfidf'):
+            sim_index.set_query_scorer(scorer)
+            golden_index.set_query_scorer(scorer)
+            for query in ("t1 t2", "t3", "t4 t5 t5 t19"):
+                hits = dict(sim_index.query(query))
+                golden = dict(golden_index.query(query))
+                self.assertEqual(set(hits), set(golden))
+                for doc in hits:
+                    self.assertAlmostEqual(hits[doc], golden[doc])
+                # ties may be broken differently, due to rounding
+                top_hits = list(sim_index.query(query, 3))
+                golden_top_hits = list(golden_index.query(query, 3))
+                self.assertEqual(len(top_hits), len(golden_top_hits))
+                for ((doc, score), (golden_doc, golden_score)) in zip(top_hits, golden_top_hits):
+                    self.assertAlmostEqual(score, golden_score)
+                    self.assertAlmostEqual(score, golden[doc])
+        self.assertEqual(sim_index.get_local_N(), golden_index.get_local_N())
+        self.assertEqual(sim_index.get_local_df_map(),
+                         golden_index.get_local_df_map())
+
+    def test_del_unknown_docid(self):
+        '''Deleting a mix of valid and unknown docids deletes nothing'''
+        docid = self.sim_index.name_to_docid('doc1')
+        self.assertRaises(KeyError, self.sim_index.del_docids, docid, 9999)
+        self.assertEqual(self.sim_index.name_to_docid('doc1'), docid)
+        self.assertEqual(self.sim_index.get_local_N(), 3)
+        self.test_query_tfidf_scorer()
+        
+        self.sim_index.del_docids(docid)
+        self.sim_index.set_query_scorer('simple_count')
+        self.assertEqual(dict(self.sim_index.query('hello')),
+                         {'doc2': 1, 'doc3': 1})
+
+    def test_merges(self):
+        '''Merged segments match a single index over the same docs'''
+        docs = self.make_docs(50)
+        sim_index = SegmentedSimIndex(segment_size=3, merge_factor=3)
+        golden_index = MemorySimIndex()
+        try:
+            for i in range(0, len(docs), 4):
+                sim_index.index_string_buffers(docs[i:i + 4])
+                golden_index.index_string_buffers(docs[i:i + 4])
+                self.check_matches(sim_index, golden_index)
+            sim_index.wait_for_merges()
+            stats = sim_index.segment_stats()
+            self.assertGreater(stats['merges'], 0)
+            self.assertEqual(sum(stats['segments']), len(docs))
+            # no merge_factor adjacent segments are left in the same tier
+            self.assertEqual(stats['segments'], [27, 9, 9, 3, 2])
+            self.check_matches(sim_index, golden_index)
+        finally:
+            sim_index.close()
+
+    def test_concurrent_index_query(self):
+        '''Queries can run while docs are added to the in-memory segment'''
+        # a unique term per doc grows the in-memory segment's term table
+        docs = [(name, text + ' u{}'.format(i))
+                for (i, (name, text)) in enumerate(self.make_docs(400))]
+        sim_index = SegmentedSimIndex(segment_size=100, merge_factor=2)
+        sim_index.set_query_scorer('simple_count')
+        errors = []
+        def index_docs():
+            try:
+                for doc in docs:
+                    sim_index.index_string_buffers([doc])
+            except Exception as e:
+                errors.append(e)
+        writer = threading.Thread(target=index_docs)
+        # switch threads often, to interleave indexing with reads
+        check_interval = sys.getcheckinterval()
+        sys.setcheckinterval(1)
+        try:
+            writer.start()
+            while writer.is_alive():
+                for (doc, score) in sim_index.query("t1 t2 t3", 5):
+                    self.assertIn(score, range(1, 9))
+                for df in sim_index.get_local_df_map().values():
+                    self.assertGreater(df, 0)
+            writer.join()
+            self.assertEqual(errors, [])
+            sim_index.wait_for_merges()
+            golden_index = MemorySimIndex()
+            golden_index.index_string_buffers(docs)
+            self.check_matches(sim_index, golden_index)
+        finally:
+            sys.setcheckinterval(check_interval)
+            writer.join()
+            sim_index.close()
+
+    def test_synchronous_merges(self):
+        docs = self.make_docs(20)
+        sim_index = SegmentedSimIndex(segment_size=2, merge_factor=2,
+                                      background_merges=False)
+        sim_index.index_string_buffers(docs)
+        self.assertEqual(sim_index.segment_stats()['segments'], [16, 4, 0])
+        golden_index = MemorySimIndex()
+        golden_index.index_string_buffers(docs)
+        self.check_matches(sim_index, golden_index)
+
+    def test_compact(self):
+        '''Deleted docs are dropped by compact()'''
+        docs = self.make_docs(30)
+        golden_index = MemorySimIndex()
+        golden_index.index_string_buffers(docs)
+        sim_index = SegmentedSimIndex(segment_size=4, merge_factor=4)
+        sim_index.set_config('compact_ratio', 1)
+        try:
+            sim_index.index_string_buffers(docs)
+            sim_index.wait_for_merges()
+            segments = sim_index.segment_stats()['segments']
+            for name in ('d0', 'd5', 'd29'):
+                sim_index.del_docids(sim_index.name_to_docid(name))
+                golden_index.del_docids(golden_index.name_to_docid(name))
+            # deletes alone don't cause merges
+            sim_index.wait_for_merges()
+            self.assertEqual(sim_index.segment_stats()['segments'], segments)
+            self.check_matches(sim_index, golden_index)
+            self.assertEqual(sum(sim_index.segment_stats()['deleted']), 3)
+            
+            sim_index.compact()
+            stats = sim_index.segment_stats()
+            self.assertEqual(stats['segments'], [27, 0])
+            self.assertEqual(stats['deleted'], [0, 0])
+            self.check_matches(sim_index, golden_index)
+            for (docid, freq) in sim_index.postings_list('t1'):
+                self.assertNotIn(docid, (0, 5, 29))
+        finally:
+            sim_index.close()
+
+    def test_compact_ratio(self):
+        '''compact() runs once tombstones exceed compact_ratio'''
+        docs = self.make_docs(30)
+        sim_index = SegmentedSimIndex(segment_size=4, merge_factor=4)
+        sim_index.set_config('compact_ratio', 0.1)
+        try:
+            sim_index.index_string_buffers(docs)
+            sim_index.wait_for_merges()
+            for name in ('d0', 'd5'):
+                sim_index.del_docids(sim_index.name_to_docid(name))
+            self.assertEqual(sum(sim_index.segment_stats()['deleted']), 2)
+            sim_index.del_docids(sim_index.name_to_docid('d29'))
+            stats = sim_index.segment_stats()
+            self.assertEqual(stats['segments'], [27, 0])
+            self.assertEqual(stats['deleted'], [0, 0])
+        finally:
+            sim_index.close()
+
+    def test_merge_drops_tombstones(self):
+        '''Merges drop tombstones along with the deleted docs, and keep only
+        the ones for docs deleted while merging'''
+        docs = self.make_docs(30)
+        golden_index = MemorySimIndex()
+        golden_index.index_string_buffers(docs)
+        sim_index = SegmentedSimIndex(segment_size=4, merge_factor=4,
+                                      background_merges=False)
+        sim_index.set_config('compact_ratio', 1)
+        sim_index.index_string_buffers(docs)
+        for name in ('d0', 'd5', 'd29'):
+            sim_index.del_docids(sim_index.name_to_docid(name))
+            golden_index.del_docids(golden_index.name_to_docid(name))
+        sim_index._seal()
+        old_segments = sim_index._snapshot()
+        old_deleted = [docid for segment in old_segments
+                       for docid in segment.deleted_docids]
+        self.assertTrue(old_deleted)
+        
+        merge_terms = segmented_sim_index._merge_terms
+        def delete_while_merging(segments, deleted):
+            sim_index.del_docids(sim_index.name_to_docid('d6'))
+            return merge_terms(segments, deleted)
+        segmented_sim_index._merge_terms = delete_while_merging
+        try:
+            sim_index.compact()
+        finally:
+            segmented_sim_index._merge_terms = merge_terms
+        golden_index.del_docids(golden_index.name_to_docid('d6'))
+        
+        self.assertEqual([segment.deleted_docids
+                          for segment in sim_index._snapshot()], [[6], []])
+        self.assertEqual(sim_index.segment_stats()['segments'], [27, 0])
+        self.check_matches(sim_index, golden_index)
+        # the old segments keep their tombstones, for queries still on them
+        self.assertEqual(sorted(docid for segment in old_segments
+                                for docid in segment.deleted_docids),
+                         sorted(old_deleted + [6]))
+
 class ShelfSimIndexTest(SimIndexTest, unittest.TestCase):
     '''
     All tests hitting the SimIndex interface are in the parent class, SimIndexTest
@@ -298,12 +1065,168 @@ class ShelfSimIndexTest(SimIndexTest, unittest.TestCase):
     
     def setUp(self):
         print("ShelfSimIndexTest")
+        # dumbdbm ignores the 'n' flag, so remove shelves left by other tests
+        for filename in glob.glob("/tmp/test_dbm*"):
+            os.remove(filename)
         self.sim_index = ShelfSimIndex("/tmp/test_dbm", 'n')
         super(ShelfSimIndexTest, self).setUp()
 
     def tearDown(self):
         self.sim_index.close()
 
+    def test_read_caches(self):
+        '''Repeated queries are served from the postings cache'''
+        self.sim_index.commit()
+        list(self.sim_index.query("hello there"))
+        misses = self.sim_index._term_index.misses
+        list(self.sim_index.query("hello there"))
+        self.assertEqual(self.sim_index._term_index.misses, misses)
+        self.assertGreater(self.sim_index._term_index.hits, 0)
+        self.assertEqual(self.sim_index.get_doc_len(0),
+                         self.sim_index._doc_len_map[0])
+
+    def test_commit_deletes(self):
+        '''Deletes are durable once committed, even without close()'''
+        self.sim_index.set_config('compact_ratio', 1.0)
+        self.sim_index.del_docids(self.sim_index.name_to_docid('doc1'))
+        self.sim_index.commit()
+        # reopen, as if the process died before close()
+        reopened = ShelfSimIndex("/tmp/test_dbm", 'c')
+        reopened.set_query_scorer('simple_count')
+        self.assertEqual(sorted(reopened.query('hello')),
+                         [('doc2', 1), ('doc3', 1)])
+
+    def test_reopen(self):
+        '''A reopened shelf serves doc lengths from memory and resumes docids'''
+        queries = list(self.get_golden_hits_cos())
+        self.sim_index.set_query_scorer('tfidf')
+        golden = [list(self.sim_index.query(query)) for query in queries]
+        self.sim_index.close()
+        self.sim_index = ShelfSimIndex("/tmp/test_dbm", 'w')
+        self.assertEqual(len(self.sim_index.get_doc_len_array()), 3)
+        scorers = ['tfidf'] + (['tfidf_np'] if numpy is not None else [])
+        for scorer in scorers:
+            self.sim_index.set_query_scorer(scorer)
+            for (query, golden_hits) in zip(queries, golden):
+                hits = list(self.sim_index.query(query))
+                self.assertEqual(len(hits), len(golden_hits))
+                for ((doc, score), (golden_doc, golden_score)) in zip(hits, golden_hits):
+                    self.assertEqual(doc, golden_doc)
+                    self.assertAlmostEqual(score, golden_score,
+                                           msg="query={}".format(query))
+        self.sim_index.index_string_buffers([('doc4', "bob bob")])
+        self.assertEqual(self.sim_index.name_to_docid('doc4'), 3)
+
+    def test_format_version(self):
+        '''Shelves in other formats are refused rather than misread'''
+        self.sim_index.close()
+        meta = shelve.open("/tmp/test_dbm_meta")
+        self.assertEqual(meta[b'format_version'], ShelfSimIndex.FORMAT_VERSION)
+        meta[b'format_version'] = ShelfSimIndex.FORMAT_VERSION + 1
+        meta.close()
+        self.assertRaises(FileFormatException, ShelfSimIndex, "/tmp/test_dbm", 'w')
+
+        # a shelf written before term ids: term keys, and no term dictionary
+        for filename in glob.glob("/tmp/test_dbm*"):
+            os.remove(filename)
+        for (suffix, items) in (('_d2n', {b'0': 'doc1'}),
+                                ('_n2d', {b'doc1': 0}),
+                                ('_term', {b'hello': [(0, 1)]}),
+                                ('_df', {b'hello': 1})):
+            old_shelf = shelve.open("/tmp/test_dbm" + suffix)
+            old_shelf.update(items)
+            old_shelf.close()
+        self.assertRaises(FileFormatException, ShelfSimIndex, "/tmp/test_dbm", 'c')
+        # for tearDown()
+        for filename in glob.glob("/tmp/test_dbm*"):
+            os.remove(filename)
+        self.sim_index = ShelfSimIndex("/tmp/test_dbm", 'n')
+
+class SqliteSimIndexTest(SimIndexTest, unittest.TestCase):
+    '''
+    All tests hitting the SimIndex interface are in the parent class, SimIndexTest
+    
+    Tests for api's not in parent class are tested separately here.  This is
+    so we can reuse test code across all implementations of SimIndex.
+    '''
+    
+    def setUp(self):
+        print("SqliteSimIndexTest")
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'index.db')
+        self.sim_index = SqliteSimIndex(self.filename)
+        super(SqliteSimIndexTest, self).setUp()
+
+    def tearDown(self):
+        self.sim_index.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_reader(self):
+        '''Readers see committed updates only'''
+        self.sim_index.commit()
+        reader = SqliteSimIndex(self.filename, readonly=True)
+        self.sim_index.set_query_scorer('simple_count')
+        reader.set_query_scorer('simple_count')
+        self.assertEqual(reader.config('stoplist'),
+                         self.sim_index.config('stoplist'))
+        self.assertEqual(list(reader.query("hello there")),
+                         list(self.sim_index.query("hello there")))
+        self.assertEqual(reader.get_local_df_map(),
+                         self.sim_index.get_local_df_map())
+        
+        self.sim_index.index_string_buffers([('doc4', "bob bob")])
+        self.sim_index.del_docids(self.sim_index.name_to_docid('doc3'))
+        self.assertEqual(list(reader.query("bob")), [('doc3', 1)])
+        self.sim_index.commit()
+        self.assertEqual(list(reader.query("bob")), [('doc4', 2)])
+        self.assertEqual(reader.get_local_N(), 3)
+        self.assertRaises(ReadOnlyIndexException, reader.del_docids, 0)
+        self.assertRaises(ReadOnlyIndexException,
+                          reader.index_string_buffers, [('doc5', "bob")])
+        reader.close()
+        
+    def test_reader_readonly(self):
+        '''Readers don't create or write to the database'''
+        missing = os.path.join(self.tmpdir, 'missing.db')
+        self.assertRaises(sqlite3.OperationalError, SqliteSimIndex, missing,
+                          readonly=True)
+        self.assertFalse(os.path.exists(missing))
+        
+        self.sim_index.commit()
+        reader = SqliteSimIndex(self.filename, readonly=True)
+        self.assertRaises(sqlite3.OperationalError, reader._conn.execute,
+                          'CREATE TABLE extra (key, value)')
+        reader.close()
+        
+    def test_reader_doc_lens(self):
+        '''Readers load doc lengths in bulk, and reload them on commits'''
+        self.sim_index.commit()
+        reader = SqliteSimIndex(self.filename, readonly=True)
+        self.assertEqual(list(reader.get_doc_len_array()),
+                         list(self.sim_index.get_doc_len_array()))
+        
+        docid = self.sim_index.name_to_docid('doc2')
+        self.sim_index.del_docids(docid)
+        self.sim_index.commit()
+        reader.query('hello')
+        self.assertEqual(reader.get_doc_len(docid), 0)
+        self.assertEqual(list(reader.get_doc_len_array()),
+                         list(self.sim_index.get_doc_len_array()))
+        reader.close()
+
+    def test_reopen(self):
+        '''Index stats survive close() and docids are not reused'''
+        self.sim_index.close()
+        self.sim_index = SqliteSimIndex(self.filename)
+        self.assertEqual(self.sim_index.get_local_N(), 3)
+        self.assertEqual(sorted(self.sim_index.get_name_to_docid_map()),
+                         ['doc1', 'doc2', 'doc3'])
+        self.sim_index.index_string_buffers([('doc4', "bob bob")])
+        self.assertEqual(self.sim_index.name_to_docid('doc4'), 3)
+        self.sim_index.set_query_scorer('simple_count')
+        self.assertEqual(list(self.sim_index.query("bob")),
+                         [('doc4', 2), ('doc3', 1)])
+
 class ConcurrentSimIndexTest(SimIndexTest, unittest.TestCase):
     '''
     All tests hitting the SimIndex interface are in the parent class, SimIndexTest
@@ -316,10 +1239,123 @@ class ConcurrentSimIndexTest(SimIndexTest, unittest.TestCase):
         print("ConcurrentSimIndexTest")
         self.sim_index = ConcurrentSimIndex(MemorySimIndex())
         super(ConcurrentSimIndexTest, self).setUp()
+        self.get_urls = doc_reader.get_urls
+
+    def tearDown(self):
+        doc_reader.get_urls = self.get_urls
+
+    def test_index_urls_token(self):
+        '''Reads don't wait for index_urls() jobs unless given their token'''
+        fetch = threading.Event()
+        def get_urls(urls):
+            fetch.wait(5)
+            return ((url, io.StringIO('crawled ' + url)) for url in urls)
+        doc_reader.get_urls = get_urls
+        
+        token1 = self.sim_index.index_urls('http://a.edu/')
+        token2 = self.sim_index.index_urls('http://b.edu/')
+        self.assertGreater(token2, token1)
+        # fetches are still blocked, so reads see the committed state
+        self.assertEqual(list(self.sim_index.query('crawled')), [])
+        self.assertFalse(self.sim_index.wait(token1, timeout=0.01))
+        
+        fetch.set()
+        hits = self.sim_index.query('crawled', wait_for=token2)
+        self.assertEqual(sorted(name for (name, score) in hits),
+                         ['http://a.edu/', 'http://b.edu/'])
+        self.assertTrue(self.sim_index.wait())
+        
+    def test_index_urls_error(self):
+        '''A failed job's exception is raised once, by a read that waits on it'''
+        def get_urls(urls):
+            raise IOError('fetch failed')
+        doc_reader.get_urls = get_urls
+        
+        token = self.sim_index.index_urls('http://a.edu/')
+        self.assertRaises(IOError, self.sim_index.query, 'crawled',
+                          wait_for=token)
+        self.assertEqual(
+            list(self.sim_index.query('crawled', wait_for=token)), [])
+
+    class CountingSimIndex(MemorySimIndex):
+        '''MemorySimIndex that records how many queries run at once'''
+        def __init__(self, thread_safe_reads):
+            super(ConcurrentSimIndexTest.CountingSimIndex, self).__init__()
+            self.thread_safe_reads = thread_safe_reads
+            self.lock = threading.Lock()
+            self.active = self.max_active = 0
+            
+        def query(self, q, k=None):
+            with self.lock:
+                self.active += 1
+                self.max_active = max(self.max_active, self.active)
+            time.sleep(0.05)
+            with self.lock:
+                self.active -= 1
+            return super(ConcurrentSimIndexTest.CountingSimIndex,
+                         self).query(q, k)
+
+    def test_thread_safe_reads(self):
+        '''Only backends with thread-safe reads are read concurrently'''
+        self.assertTrue(MemorySimIndex.thread_safe_reads)
+        self.assertFalse(ShelfSimIndex.thread_safe_reads)
+        self.assertFalse(SqliteSimIndex.thread_safe_reads)
+        for (thread_safe_reads, expected) in ((True, 4), (False, 1)):
+            backend = self.CountingSimIndex(thread_safe_reads)
+            sim_index = ConcurrentSimIndex(backend)
+            threads = [threading.Thread(target=sim_index.query,
+                                        args=('hello',))
+                       for i in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(backend.max_active, expected)
+
+class SnapshotConcurrentSimIndexTest(SimIndexTest, unittest.TestCase):
+    '''
+    All tests hitting the SimIndex interface are in the parent class, SimIndexTest
+    
+    Tests for api's not in parent class are tested separately here.  This is
+    so we can reuse test code across all implementations of SimIndex.
+    '''
+    
+    def setUp(self):
+        print("SnapshotConcurrentSimIndexTest")
+        self.sim_index = ConcurrentSimIndex(MemorySimIndex(), snapshot=True)
+        super(SnapshotConcurrentSimIndexTest, self).setUp()
 
     def tearDown(self):
         pass
 
+    def test_snapshot_isolation(self):
+        '''Writes publish a new index, leaving earlier versions untouched'''
+        before = self.sim_index._sim_index
+        self.sim_index.index_string_buffers(
+            [('new_doc', 'hello there new doc')])
+        after = self.sim_index._sim_index
+        self.assertIsNot(before, after)
+        self.assertRaises(KeyError, before.name_to_docid, 'new_doc')
+        self.assertEqual(after.docid_to_name(after.name_to_docid('new_doc')),
+                         'new_doc')
+        
+    def test_stats_writes(self):
+        '''Writes that don't change postings aren't applied to a copy'''
+        before = self.sim_index._sim_index
+        self.sim_index.set_config('lowercase', True)
+        self.sim_index.set_global_N(10)
+        self.sim_index.set_global_df_map({'hello': 5})
+        self.sim_index.set_query_scorer('simple_count')
+        self.assertIs(self.sim_index._sim_index, before)
+        self.assertEqual(list(self.sim_index.query('bob')), [('doc3', 1)])
+        
+    def test_failed_write(self):
+        '''A write that raises doesn't publish a new index'''
+        before = self.sim_index._sim_index
+        self.assertRaises(Exception, self.sim_index.index_string_buffers,
+                          [('good_doc', 'hello'), ('bad_doc', 1)])
+        self.assertIs(self.sim_index._sim_index, before)
+
 class SimIndexCollectionTest(SimIndexTest, unittest.TestCase):
     '''
     All tests hitting the SimIndex interface are in the parent class, SimIndexTest
@@ -339,6 +1375,336 @@ class SimIndexCollectionTest(SimIndexTest, unittest.TestCase):
     def tearDown(self):
         pass
     
+    def test_index_urls_concurrent_shards(self):
+        '''Stats include urls indexed in the background by shards'''
+        get_urls = doc_reader.get_urls
+        def slow_get_urls(urls):
+            time.sleep(0.2)
+            return ((url, io.StringIO('crawled ' + url)) for url in urls)
+        doc_reader.get_urls = slow_get_urls
+        try:
+            sim_index = SimIndexCollection()
+            sim_index.add_shards(ConcurrentSimIndex(MemorySimIndex()),
+                                 ConcurrentSimIndex(MemorySimIndex()))
+            urls = ('http://a.edu/', 'http://b.edu/', 'http://c.edu/')
+            sim_index.index_urls(*urls)
+        finally:
+            doc_reader.get_urls = get_urls
+        self.assertEqual(sim_index.get_local_N(), 3)
+        self.assertEqual(sim_index.get_local_df_map()['crawled'], 3)
+        for url in urls:
+            docid = sim_index.name_to_docid(url)
+            self.assertEqual(sim_index.docid_to_name(docid), url)
+        for shard in sim_index._shards:
+            self.assertEqual(shard._sim_index._global_N, 3)
+    
+    class RecordingSimIndex(MemorySimIndex):
+        '''MemorySimIndex that records the batches it's asked to index'''
+        def __init__(self, log):
+            super(SimIndexCollectionTest.RecordingSimIndex, self).__init__()
+            self.log = log
+            
+        def index_string_buffers(self, named_string_buffers):
+            self.log.append((self, len(named_string_buffers)))
+            if any(name == 'bad' for (name, buffer) in named_string_buffers):
+                raise ValueError('bad doc')
+            super(SimIndexCollectionTest.RecordingSimIndex,
+                  self).index_string_buffers(named_string_buffers)
+
+    class SlowSimIndex(MemorySimIndex):
+        '''MemorySimIndex that records how many queries run at once'''
+        def __init__(self, counter):
+            super(SimIndexCollectionTest.SlowSimIndex, self).__init__()
+            self.counter = counter
+            
+        def query(self, q, k=None):
+            counter = self.counter
+            with counter['lock']:
+                counter['active'] += 1
+                counter['max'] = max(counter['max'], counter['active'])
+            time.sleep(0.05)
+            with counter['lock']:
+                counter['active'] -= 1
+            return super(SimIndexCollectionTest.SlowSimIndex,
+                         self).query(q, k)
+
+    def test_concurrent_fanout(self):
+        '''Shards are queried concurrently, up to shard_max_concurrency'''
+        for (max_concurrency, expected) in ((16, 4), (2, 2), (1, 1)):
+            counter = {'lock': threading.Lock(), 'active': 0, 'max': 0}
+            shards = [self.SlowSimIndex(counter) for i in range(4)]
+            collection = SimIndexCollection(shards)
+            collection.set_config('shard_max_concurrency', max_concurrency,
+                                  passthrough=False)
+            collection.index_string_buffers(self.docs)
+            hits = list(collection.query('hello'))
+            self.assertEqual(sorted(name for (name, score) in hits),
+                             ['doc1', 'doc2', 'doc3'])
+            self.assertEqual(counter['max'], expected)
+
+    class DelayedSimIndex(MemorySimIndex):
+        '''MemorySimIndex whose queries take ``delay`` seconds'''
+        def __init__(self, delay):
+            super(SimIndexCollectionTest.DelayedSimIndex, self).__init__()
+            self.delay = delay
+
+        def query(self, q, k=None):
+            time.sleep(self.delay)
+            return super(SimIndexCollectionTest.DelayedSimIndex,
+                         self).query(q, k)
+
+    def test_merge_ties(self):
+        '''Tied hits are ordered by shard id and docid, not by reply order'''
+        # earlier shards reply last
+        shards = [self.DelayedSimIndex(0.02 * (2 - i)) for i in range(3)]
+        collection = SimIndexCollection(shards)
+        collection.set_query_scorer('simple_count')
+        collection.shard_func = lambda name: int(name[1:]) % 3
+        collection.index_string_buffers(
+            [('a{}'.format(i), "apple") for i in range(9)])
+        golden = ['a0', 'a3', 'a6', 'a1', 'a4', 'a7', 'a2', 'a5', 'a8']
+        for k in (None, 4):
+            self.assertEqual([name for (name, score)
+                              in collection.query('apple', k)], golden[:k])
+            (hits, status) = collection.query_with_status('apple', k,
+                                                          timeout=5)
+            self.assertEqual([name for (name, score) in hits], golden[:k])
+            self.assertEqual([[name for (name, score) in hits] for hits
+                              in collection.query_many(['apple'] * 2, k)],
+                             [golden[:k]] * 2)
+
+    class HangingSimIndex(MemorySimIndex):
+        '''MemorySimIndex whose queries block until released'''
+        def __init__(self, release):
+            super(SimIndexCollectionTest.HangingSimIndex, self).__init__()
+            self.release = release
+            self.num_queries = 0
+            
+        def query(self, q, k=None):
+            self.num_queries += 1
+            self.release.wait(5)
+            return super(SimIndexCollectionTest.HangingSimIndex,
+                         self).query(q, k)
+
+    class FailingSimIndex(MemorySimIndex):
+        def query(self, q, k=None):
+            raise ValueError('shard failed')
+
+    def test_shard_deadline(self):
+        '''Shards that miss the deadline, or fail, are left out'''
+        release = threading.Event()
+        shards = [MemorySimIndex(), self.HangingSimIndex(release),
+                  self.FailingSimIndex()]
+        collection = SimIndexCollection(shards)
+        collection.set_query_scorer('simple_count')
+        collection.enable_query_cache()
+        # one doc per shard
+        collection.shard_func = lambda name: int(name[-1]) - 1
+        collection.index_string_buffers(self.docs)
+        try:
+            start = time.time()
+            (hits, status) = collection.query_with_status('hello', timeout=0.1)
+            self.assertLess(time.time() - start, 2)
+            self.assertEqual(hits, [('doc1', 2)])
+            self.assertEqual(status, {'responded': [0], 'missing': [1, 2],
+                                      'partial': True})
+            
+            # shard_timeout applies to query(), and partial results
+            # aren't cached.  The hung shard isn't queried again until
+            # its first call returns.
+            collection.set_config('shard_timeout', 0.1, passthrough=False)
+            self.assertEqual(collection.query('hello'), [('doc1', 2)])
+            self.assertEqual(shards[1].num_queries, 1)
+            release.set()
+            for i in range(100):
+                if not collection._stragglers:
+                    break
+                time.sleep(0.01)
+            del collection._shards[2]
+            (hits, status) = collection.query_with_status('hello')
+            self.assertEqual(sorted(hits), [('doc1', 2), ('doc2', 1)])
+            self.assertEqual(status['missing'], [])
+            self.assertEqual(collection.query_cache_stats()['entries'], 1)
+        finally:
+            release.set()
+
+    def test_nested_deadline(self):
+        '''Child collections report partial results to their parent'''
+        release = threading.Event()
+        child = SimIndexCollection([MemorySimIndex(),
+                                    self.HangingSimIndex(release)],
+                                   root=False)
+        child.shard_func = lambda name: 0 if name == 'doc1' else 1
+        collection = SimIndexCollection([child, MemorySimIndex()])
+        collection.shard_func = lambda name: 0 if name != 'doc3' else 1
+        collection.set_query_scorer('simple_count')
+        collection.index_string_buffers(self.docs)
+        try:
+            (hits, status) = collection.query_with_status('hello', timeout=0.2)
+            self.assertEqual(sorted(hits), [('doc1', 2), ('doc3', 1)])
+            self.assertEqual(status, {'responded': [0, 1], 'missing': [],
+                                      'partial': True})
+        finally:
+            release.set()
+
+    def test_remote_nested_deadline(self):
+        '''Remote child collections report partial results to their parent'''
+        # the hanging shard is never released in the server process, so
+        # its queries only return when the process is terminated
+        child = SimIndexCollection([MemorySimIndex(),
+                                    self.HangingSimIndex(threading.Event())],
+                                   root=False)
+        child.shard_func = lambda name: 0 if name == 'doc1' else 1
+        process = Process(target=sim_server.start_sim_index_server,
+                          kwargs={'port': 9300,
+                                  'backends': [child],
+                                  'logRequests': False})
+        process.daemon = True
+        process.start()
+        try:
+            time.sleep(0.1)
+            collection = SimIndexCollection(
+                [RemoteSimIndex('http://localhost:9300/RPC2'),
+                 MemorySimIndex()])
+            collection.shard_func = lambda name: 0 if name != 'doc3' else 1
+            collection.set_query_scorer('simple_count')
+            collection.index_string_buffers(self.docs)
+            start = time.time()
+            (hits, status) = collection.query_with_status('hello', timeout=0.5)
+            self.assertLess(time.time() - start, 2)
+            self.assertEqual(sorted(hits), [['doc1', 2], ('doc3', 1)])
+            self.assertEqual(status, {'responded': [0, 1], 'missing': [],
+                                      'partial': True})
+        finally:
+            process.terminate()
+
+    def test_remote_compressed_postings(self):
+        '''Compressed postings lists are returned over rpc'''
+        process = Process(target=sim_server.start_sim_index_server,
+                          kwargs={'port': 9301,
+                                  'backends': [MemorySimIndex(
+                                      compress_postings=True)],
+                                  'logRequests': False})
+        process.daemon = True
+        process.start()
+        try:
+            time.sleep(0.1)
+            remote_index = RemoteSimIndex('http://localhost:9301/RPC2')
+            remote_index.index_string_buffers(self.docs)
+            self.assertEqual(
+                [remote_index.docid_to_name(docid) for (docid, freq)
+                 in remote_index.postings_list('hello')],
+                ['doc1', 'doc2', 'doc3'])
+        finally:
+            process.terminate()
+
+    def test_remote_timeout(self):
+        '''RemoteSimIndex query rpcs time out, other rpcs don't'''
+        # a server that accepts connections, but never responds
+        listener = socket.socket()
+        listener.bind(('localhost', 0))
+        listener.listen(2)
+        try:
+            remote_index = RemoteSimIndex(
+                'http://localhost:{}/RPC2'.format(listener.getsockname()[1]),
+                query_timeout=0.1)
+            self.assertRaises(socket.timeout, remote_index.query, 'hello')
+            
+            def get_local_N():
+                try:
+                    remote_index.get_local_N()
+                except socket.error:
+                    pass
+            thread = threading.Thread(target=get_local_N)
+            thread.daemon = True
+            thread.start()
+            thread.join(0.3)
+            self.assertTrue(thread.is_alive())
+        finally:
+            listener.close()
+
+    def test_docids_with_terms(self):
+        '''docids_with_terms() intersects on shards, and returns global docids'''
+        for (term, golden) in self.golden_conj_hits.items():
+            docids = self.sim_index.docids_with_terms(term.split())
+            self.assertEqual(docids, sorted(docids))
+            self.assertEqual({self.sim_index.docid_to_name(docid)
+                              for docid in docids}, golden)
+
+    def test_compact(self):
+        '''compact() is passed to shards, including ones without deletes'''
+        memory_index = MemorySimIndex()
+        memory_index.index_string_buffers(self.docs)
+        collection = SimIndexCollection([CSRSimIndex(memory_index),
+                                         memory_index])
+        collection.compact()
+        self.sim_index.del_docids(self.sim_index.name_to_docid('doc1'))
+        self.sim_index.compact()
+        self.assertEqual(sorted(self.sim_index.docnames_with_terms('hello')),
+                         ['doc2', 'doc3'])
+
+    def test_streaming_index_files(self):
+        '''Files are read lazily and sent to shards in bounded batches'''
+        log = []
+        shards = [self.RecordingSimIndex(log) for i in range(2)]
+        collection = SimIndexCollection(shards)
+        collection.update_config(shard_batch_size=3, shard_max_inflight=1)
+        
+        num_read = [0]
+        def named_files():
+            for i in range(20):
+                # a shard gets its first batch before all files are read
+                num_read[0] += 1
+                if num_read[0] == 20:
+                    self.assertTrue(log)
+                yield ('doc{}'.format(i), io.StringIO('hello world {}'.format(i)))
+        collection.index_files(named_files())
+        
+        self.assertEqual(num_read[0], 20)
+        self.assertEqual(sum(num_docs for (shard, num_docs) in log), 20)
+        self.assertTrue(all(num_docs <= 3 for (shard, num_docs) in log))
+        self.assertEqual(collection.get_local_N(), 20)
+        self.assertEqual(set(collection.docnames_with_terms('hello')),
+                         {'doc{}'.format(i) for i in range(20)})
+        
+        # size-bounded batches
+        del log[:]
+        collection.update_config(shard_batch_bytes=10)
+        collection.index_string_buffers([('big1', 'x' * 20), ('big2', 'x' * 20)])
+        self.assertEqual([num_docs for (shard, num_docs) in log], [1, 1])
+        
+    def test_streaming_shard_error(self):
+        '''Errors from shards are raised by index_files()'''
+        shards = [self.RecordingSimIndex([]) for i in range(2)]
+        collection = SimIndexCollection(shards)
+        collection.update_config(shard_batch_size=1)
+        self.assertRaises(ValueError, collection.index_string_buffers,
+                          [('good', 'hello'), ('bad', 'world')])
+
+
+class ProcessShardedSimIndexTest(SimIndexTest, unittest.TestCase):
+    '''
+    All tests hitting the SimIndex interface are in the parent class, SimIndexTest
+    
+    Tests for api's not in parent class are tested separately here.  This is
+    so we can reuse test code across all implementations of SimIndex.    
+    '''
+
+    def setUp(self):
+        print("ProcessShardedSimIndexTest")
+        self.sim_index = ProcessShardedSimIndex(num_shards=2)
+        super(ProcessShardedSimIndexTest, self).setUp()
+    
+    def tearDown(self):
+        self.sim_index.close()
+
+    def test_scatter_error(self):
+        '''Shard errors are raised, and leave the shards usable'''
+        shards = self.sim_index._shards
+        self.assertRaises(KeyError, ProcessSimIndex.scatter, shards,
+                          'docid_to_name', 99)
+        self.assertEqual(sum(ProcessSimIndex.scatter(shards, 'get_local_N')),
+                         len(self.docs))
 
 class SimIndexRemoteCollectionTest(SimIndexTest, unittest.TestCase):
     '''